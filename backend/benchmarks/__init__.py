@@ -0,0 +1 @@
+"""Performance benchmarks for the backend. Run them from the ``backend`` directory."""
@@ -0,0 +1,369 @@
+"""Latency and throughput of every ``api_router`` endpoint.
+
+Generates a synthetic dataset (see ``benchmarks.datagen``), then drives each
+route through an in-process ASGI client and reports latency percentiles,
+throughput and status codes as JSON. Reads are issued as-is against the first
+study unless ``READ_SCENARIOS`` supplies their parameters; writes use the
+bodies in ``WRITE_SCENARIOS``, whose untimed setup creates whatever a
+destructive request consumes.
+
+    python -m benchmarks.api --mock --requests 50 --output results.json
+    python -m benchmarks.api --studies 10 --visits 60 --baseline results.json
+
+The run exits non-zero when any endpoint answered with a 5xx status, and,
+with ``--baseline``, when an endpoint's p95 latency grew by more than
+``--tolerance`` times its baseline. Under ``--mock``, routes whose queries
+mongomock cannot run (``MOCK_UNSUPPORTED``) are reported as skipped.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+from benchmarks.datagen import Dataset, add_database_arguments, add_scale_arguments, generate, scale_from_args
+from indexes import reconcile_indexes
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+@dataclass
+class Call:
+    """One request to time: path parameter overrides, query string and an optional body."""
+    params: Dict[str, str] = field(default_factory=dict)
+    query: Dict[str, Any] = field(default_factory=dict)
+    json: Any = None
+    content: Optional[bytes] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+Scenario = Callable[[Any, Dict[str, Any], int], Awaitable[Call]]
+
+
+async def _insert_master_procedure(db, sample, i):
+    procedure_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    await db.master_procedures.insert_one({
+        "id": procedure_id, "name": f"Disposable {i}", "category": "Observation", "description": "",
+        "default_cost": 1.0, "currency": "USD", "parent_id": None, "path": [], "depth": 0,
+        "input_fields": [], "is_active": True,
+        "created_at": now, "updated_at": now
+    })
+    return Call(params={"procedure_id": procedure_id})
+
+
+async def _insert_cohort(db, sample, i):
+    cohort_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    await db.cohorts.insert_one({
+        "id": cohort_id, "study_id": sample['study_id'], "name": f"Disposable {i}", "description": "",
+        "criteria": None, "planned_animal_count": 0, "animal_ids": [], "created_at": now, "updated_at": now
+    })
+    return Call(params={"cohort_id": cohort_id})
+
+
+async def _insert_animal(db) -> str:
+    animal_id = str(uuid.uuid4())
+    await db.animals.insert_one({
+        "id": animal_id, "animal_id": f"BENCH-{animal_id[:12]}", "species": "Rat", "strain": None, "sex": "F",
+        "birth_date": None, "weight": None, "is_active": True, "created_at": datetime.utcnow()
+    })
+    return animal_id
+
+
+async def _new_animal(db, sample, i):
+    return Call(params={"animal_id": await _insert_animal(db)})
+
+
+async def _new_cohort_member(db, sample, i):
+    animal_id = await _insert_animal(db)
+    await db.cohorts.update_one({"id": sample['cohort_id']}, {"$addToSet": {"animal_ids": animal_id}})
+    return Call(params={"animal_id": animal_id})
+
+
+def _call(factory: Callable[[Dict[str, Any], int], Call]) -> Scenario:
+    async def scenario(db, sample, i):
+        return factory(sample, i)
+    return scenario
+
+
+def _animal_row(i: int) -> Dict[str, Any]:
+    return {"animal_id": f"BENCH-{uuid.uuid4().hex[:12]}", "species": "Rat", "sex": "M" if i % 2 else "F"}
+
+
+# A valid value per input field type, for result submissions
+SAMPLE_VALUES = {
+    "string": "ok", "text_area": "ok", "number": 1.5, "integer": 2, "radio": "ok", "dropdown": "ok",
+    "checkbox": True, "date": "2024-01-01", "time": "09:00",
+}
+
+
+async def _visit_results(db, sample, i):
+    assignment = await db.visit_procedures.find_one({"visit_id": sample['visit_id']}, {"_id": 0, "study_procedure_id": 1})
+    if assignment is None:
+        assignment = {"id": str(uuid.uuid4()), "visit_id": sample['visit_id'],
+                      "study_procedure_id": sample['study_procedure_ids'][0], "assigned_at": datetime.utcnow()}
+        await db.visit_procedures.insert_one(dict(assignment))
+    procedure, visit = await asyncio.gather(
+        db.study_procedures.find_one({"id": assignment['study_procedure_id']}, {"_id": 0, "input_fields": 1}),
+        db.visits.find_one({"id": sample['visit_id']}, {"_id": 0, "cohort_ids": 1}),
+    )
+    cohorts = await db.cohorts.find({"id": {"$in": visit.get('cohort_ids', [])}}, {"_id": 0, "animal_ids": 1}).to_list(None)
+    values = {input_field['name']: SAMPLE_VALUES[str(getattr(input_field['field_type'], "value", input_field['field_type']))]
+              for input_field in procedure.get('input_fields', [])}
+    rows = [{"animal_id": animal_id, "values": dict(values)}
+            for animal_id in dict.fromkeys(a for cohort in cohorts for a in cohort.get('animal_ids', []))]
+    return Call(json={"study_procedure_id": assignment['study_procedure_id'], "rows": rows})
+
+
+async def _insert_fx_rate(db, sample, i):
+    rate_id = str(uuid.uuid4())
+    await db.fx_rates.insert_one({
+        "id": rate_id, "currency": "BEN", "rate": 1.0, "effective_date": f"{1900 + i:04d}-01-01",
+        "created_at": datetime.utcnow()
+    })
+    return Call(params={"rate_id": rate_id})
+
+
+def _bulk_csv(sample, i) -> Call:
+    rows = ["animal_id,species,strain,sex,birth_date,weight"]
+    rows += [f"BULK-{uuid.uuid4().hex[:12]},Rat,Wistar,F,2024-01-01,210.5" for _ in range(100)]
+    return Call(content="\n".join(rows).encode(), headers={"Content-Type": "text/csv"})
+
+
+WRITE_SCENARIOS: Dict[str, Scenario] = {
+    "create_master_procedure": _call(lambda sample, i: Call(json={
+        "name": f"Bench procedure {i}", "category": "Observation", "description": "Benchmark", "default_cost": 12.5,
+        "input_fields": [{"name": "weight", "label": "Weight", "field_type": "number", "units": "g"}]
+    })),
+    "update_master_procedure": _call(lambda sample, i: Call(json={"description": f"Revision {i}"})),
+    "delete_master_procedure": _insert_master_procedure,
+    "create_animal": _call(lambda sample, i: Call(json=_animal_row(i))),
+    "bulk_import_animals": _call(_bulk_csv),
+    "create_study": _call(lambda sample, i: Call(json={
+        "name": f"Bench study {i}", "description": "Benchmark", "principal_investigator": "PI"
+    })),
+    "create_cohort": _call(lambda sample, i: Call(json={
+        "study_id": sample['study_id'], "name": f"Bench cohort {i}", "description": "Benchmark", "planned_animal_count": 10
+    })),
+    "update_cohort": _call(lambda sample, i: Call(json={"description": f"Revision {i}"})),
+    "assign_animal_to_cohort": _new_animal,
+    "remove_animal_from_cohort": _new_cohort_member,
+    "update_cohort_animals": _call(lambda sample, i: Call(json={"add": sample['cohort_animal_ids'][:10]})),
+    "delete_cohort": _insert_cohort,
+    "import_procedure_to_study": _call(lambda sample, i: Call(json={"master_procedure_id": sample['procedure_id']})),
+    "create_visit": _call(lambda sample, i: Call(json={
+        "study_id": sample['study_id'], "name": f"Bench visit {i}", "label": f"B{i}",
+        "planned_timepoint": f"Day {i}", "cohort_ids": [sample['cohort_id']]
+    })),
+    "update_visit": _call(lambda sample, i: Call(json={"description": f"Revision {i}"})),
+    "assign_procedure_to_visit": _call(lambda sample, i: Call(json={
+        "study_procedure_id": sample['study_procedure_ids'][i % len(sample['study_procedure_ids'])]
+    })),
+    "generate_study_schedule": _call(lambda sample, i: Call(json={
+        "start_date": "2024-01-01",
+        "visits": [{"name": f"Bench {i} W{{week}}", "label": "W{week}", "planned_timepoint": "Day 7 +/- 1 day",
+                    "repeat_every_days": 7, "repeat_count": 13, "study_procedure_ids": sample['study_procedure_ids'][:2]}]
+    })),
+    "submit_visit_results": _visit_results,
+    "forecast_study_cost": _call(lambda sample, i: Call(json={"include_visits": False, "scenarios": [
+        {"name": "planned", "animal_basis": "planned"},
+        {"name": f"sizes {i}", "cohort_sizes": {sample['cohort_id']: 12}},
+        {"name": "cost +15%", "cost_multipliers": {sample['study_procedure_ids'][0]: 1.15}},
+    ]})),
+    "set_fx_rate": _call(lambda sample, i: Call(json={"currency": "EUR", "rate": 1.1, "effective_date": "2024-01-01"})),
+    "delete_fx_rate": _insert_fx_rate,
+    "create_status_check": _call(lambda sample, i: Call(json={"client_name": "benchmark"})),
+}
+
+READ_SCENARIOS: Dict[str, Scenario] = {
+    "export_study_table": _call(lambda sample, i: Call(params={"table": "visits"})),
+    "get_field_history": _call(lambda sample, i: Call(query={
+        "study_procedure_id": sample['study_procedure_ids'][0], "field": "field_0"
+    })),
+    "search_library": _call(lambda sample, i: Call(query={"q": "rat"})),
+}
+
+
+# Routes relying on server features mongomock does not implement
+MOCK_UNSUPPORTED: Dict[str, str] = {
+    "get_worklist": "$lookup with both localField and pipeline",
+    "search_library": "$text",
+    "get_index_report": "$indexStats",
+}
+
+
+async def _read(db, sample, i) -> Call:
+    return Call()
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+async def bench_route(http: httpx.AsyncClient, db, route, sample: Dict[str, Any], scenario: Scenario,
+                      requests: int, concurrency: int) -> Dict[str, Any]:
+    method = sorted(route.methods)[0]
+    calls = [await scenario(db, sample, i) for i in range(requests)]
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(call: Call) -> None:
+        path = route.path.format(**{**sample, **call.params})
+        async with semaphore:
+            started = time.perf_counter()
+            response = await http.request(method, path, params=call.query, json=call.json, content=call.content,
+                                          headers=call.headers)
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(call) for call in calls))
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        "endpoint": route.name,
+        "method": method,
+        "path": route.path,
+        "requests": requests,
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "server_errors": sum(count for status, count in statuses.items() if status >= 500),
+        "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies_ms), 3),
+            **{f"p{pct}": round(percentile(latencies_ms, pct), 3) for pct in PERCENTILES},
+            "max": round(latencies_ms[-1], 3),
+        },
+    }
+
+
+async def run(db, dataset: Dataset, requests: int, concurrency: int, pattern: Optional[str],
+              mock: bool = False) -> List[Dict[str, Any]]:
+    results = []
+    transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+        for route in server.api_router.routes:
+            if pattern and not re.search(pattern, route.name):
+                continue
+            if mock and route.name in MOCK_UNSUPPORTED:
+                results.append({"endpoint": route.name, "path": route.path,
+                                "skipped": f"mongomock lacks {MOCK_UNSUPPORTED[route.name]}"})
+                continue
+            reads = {"GET"} & route.methods
+            scenario = READ_SCENARIOS.get(route.name, _read) if reads else WRITE_SCENARIOS.get(route.name)
+            if scenario is None:
+                results.append({"endpoint": route.name, "path": route.path, "skipped": "no write scenario"})
+                continue
+            result = await bench_route(http, db, route, dataset.sample, scenario, requests, concurrency)
+            print(f"{result['method']:6} {route.path:45} p50 {result['latency_ms']['p50']:9.3f} ms  "
+                  f"p95 {result['latency_ms']['p95']:9.3f} ms  {result['throughput_rps']:9.2f} req/s",
+                  file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def regressions(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe every endpoint whose p95 latency exceeds ``tolerance`` times the baseline."""
+    previous = {(result['endpoint'], result.get('method')): result for result in baseline.get("results", [])}
+    found = []
+    for result in results:
+        before = previous.get((result['endpoint'], result.get('method')))
+        if "latency_ms" not in result or not before or "latency_ms" not in before or result['server_errors']:
+            continue
+        limit = before['latency_ms']['p95'] * tolerance
+        if result['latency_ms']['p95'] > limit:
+            found.append(f"{result['method']} {result['path']}: p95 {result['latency_ms']['p95']} ms "
+                         f"> {round(limit, 3)} ms ({tolerance}x baseline {before['latency_ms']['p95']} ms)")
+    return found
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark every API endpoint against a synthetic dataset.")
+    parser.add_argument("--mock", action="store_true", help="use mongomock-motor instead of a MongoDB server")
+    add_database_arguments(parser)
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--endpoints", help="only run endpoints whose name matches this regex")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON results to compare p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    client = None
+    if args.mock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            parser.error("--mock needs the mongomock-motor package")
+        db = AsyncMongoMockClient()[args.db_name]
+        backend = "mongomock"
+    else:
+        client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+        db = client[args.db_name]
+        backend = "mongodb"
+    server.db = db
+
+    try:
+        try:
+            dataset = await generate(db, scale_from_args(args), args.drop)
+        except ValueError as e:
+            parser.error(str(e))
+        await reconcile_indexes(db)
+        results = await run(db, dataset, args.requests, args.concurrency, args.endpoints, args.mock)
+    finally:
+        if client:
+            client.close()
+
+    report = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "backend": backend,
+        "requests_per_endpoint": args.requests,
+        "concurrency": args.concurrency,
+        "dataset": dataset.to_dict(),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    else:
+        print(output)
+
+    failed = [result for result in results if result.get("server_errors")]
+    for result in failed:
+        print(f"SERVER ERROR {result['method']} {result['path']}: {result['status_codes']}", file=sys.stderr)
+    found = []
+    if args.baseline:
+        with open(args.baseline) as handle:
+            found = regressions(results, json.load(handle), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if failed or found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,300 @@
+"""Synthetic large-study datasets for benchmarking.
+
+Documents are built from the API models and written straight to the
+collections in bulk, then the cost rollups are rebuilt, so the database looks
+as if it had been filled through the API. The scale is
+``studies x (cohorts x animals, visits x procedures)`` plus a shared master
+procedure library; the same seed always produces the same ids.
+
+The dataset goes into ``BENCHMARK_DB_NAME`` (default ``preclinical_benchmark``),
+never the app's ``DB_NAME``. Writing into the app's database, or into one
+that already holds data, is refused unless ``--drop`` is passed, which empties
+the dataset collections first.
+
+    python -m benchmarks.datagen --studies 5 --cohorts 4 --animals 25 --visits 30 --procedures 6
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from cost_rollups import refresh_visits
+from serialization import to_mongo
+from server import (
+    Animal,
+    Cohort,
+    InputField,
+    InputFieldType,
+    MasterProcedure,
+    ProcedureCategory,
+    Study,
+    StudyProcedure,
+    Visit,
+    VisitProcedure,
+    VisitStatus,
+)
+
+INSERT_CHUNK_SIZE = 1000
+BENCHMARK_DB_NAME = os.getenv("BENCHMARK_DB_NAME", "preclinical_benchmark")
+DATASET_COLLECTIONS = (
+    "master_procedures", "animals", "studies", "cohorts", "study_procedures",
+    "visits", "visit_procedures", "cost_rollups", "cache_versions", "status_checks",
+)
+
+
+@dataclass
+class Scale:
+    studies: int = 3
+    cohorts: int = 4  # per study
+    animals: int = 20  # per cohort
+    visits: int = 20  # per study
+    procedures: int = 5  # per visit
+    study_procedures: int = 12  # imported into each study
+    library: int = 60  # master procedures
+    seed: int = 42
+
+
+@dataclass
+class Dataset:
+    scale: Scale
+    counts: Dict[str, int] = field(default_factory=dict)
+    # Ids from the first study, used to fill endpoint path parameters
+    sample: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class _Generator:
+    def __init__(self, scale: Scale):
+        self.scale = scale
+        self.rng = random.Random(scale.seed)
+        self.now = datetime.utcnow()
+        self.docs: Dict[str, List[Dict[str, Any]]] = {}
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def created_at(self, index: int) -> datetime:
+        # Distinct, increasing timestamps keep keyset pagination realistic
+        return self.now - timedelta(days=365) + timedelta(seconds=index)
+
+    def add(self, collection: str, model) -> Dict[str, Any]:
+        doc = to_mongo(model)
+        self.docs.setdefault(collection, []).append(doc)
+        return doc
+
+    def input_fields(self) -> List[InputField]:
+        field_types = list(InputFieldType)
+        return [
+            InputField.model_construct(
+                id=self.uuid(),
+                name=f"field_{n}",
+                label=f"Field {n}",
+                field_type=self.rng.choice(field_types),
+                is_mandatory=n == 0,
+                units="g" if n == 0 else None
+            )
+            for n in range(self.rng.randint(1, 4))
+        ]
+
+    def library(self) -> List[Dict[str, Any]]:
+        categories = list(ProcedureCategory)
+        return [
+            self.add("master_procedures", MasterProcedure.model_construct(
+                id=self.uuid(),
+                name=f"Procedure {n:04d}",
+                category=self.rng.choice(categories),
+                description=f"Synthetic procedure {n}",
+                default_cost=round(self.rng.uniform(5, 500), 2),
+                currency="USD",
+                parent_id=None,
+                path=[],
+                depth=0,
+                input_fields=self.input_fields(),
+                is_active=True,
+                created_at=self.created_at(n),
+                updated_at=self.created_at(n)
+            ))
+            for n in range(self.scale.library)
+        ]
+
+    def study(self, n: int, library: List[Dict[str, Any]]) -> Dict[str, Any]:
+        scale = self.scale
+        start = date(2024, 1, 1) + timedelta(days=30 * n)
+        study = self.add("studies", Study.model_construct(
+            id=self.uuid(),
+            name=f"Study {n:03d}",
+            description="Synthetic benchmark study",
+            start_date=start,
+            end_date=start + timedelta(days=scale.visits * 7),
+            principal_investigator=f"PI {n % 7}",
+            status=self.rng.choice(["Planning", "Active", "Completed"]),
+            created_at=self.created_at(n),
+            updated_at=self.created_at(n)
+        ))
+
+        cohorts = []
+        for c in range(scale.cohorts):
+            animal_ids = []
+            for a in range(scale.animals):
+                index = (n * scale.cohorts + c) * scale.animals + a
+                animal = self.add("animals", Animal.model_construct(
+                    id=self.uuid(),
+                    animal_id=f"S{n:03d}-C{c:02d}-{a:04d}",
+                    species="Rat",
+                    strain="Sprague-Dawley",
+                    sex=self.rng.choice(["M", "F"]),
+                    birth_date=start - timedelta(days=self.rng.randint(42, 84)),
+                    weight=round(self.rng.uniform(180, 320), 1),
+                    is_active=True,
+                    created_at=self.created_at(index)
+                ))
+                animal_ids.append(animal['id'])
+            cohorts.append(self.add("cohorts", Cohort.model_construct(
+                id=self.uuid(),
+                study_id=study['id'],
+                name=f"Group {c + 1}",
+                description=f"Dose group {c + 1}",
+                criteria=None,
+                planned_animal_count=scale.animals,
+                animal_ids=animal_ids,
+                created_at=self.created_at(c),
+                updated_at=self.created_at(c)
+            )))
+
+        study_procedures = []
+        for p, master in enumerate(self.rng.sample(library, min(scale.study_procedures, len(library)))):
+            study_procedures.append(self.add("study_procedures", StudyProcedure.model_construct(
+                id=self.uuid(),
+                study_id=study['id'],
+                master_procedure_id=master['id'],
+                name=master['name'],
+                category=master['category'],
+                description=master['description'],
+                study_specific_cost=round(master['default_cost'] * 1.1, 2) if p % 3 == 0 else None,
+                default_cost=master['default_cost'],
+                currency="USD",
+                input_fields=[InputField.model_construct(**input_field) for input_field in master['input_fields']],
+                imported_at=self.created_at(p)
+            )))
+
+        statuses = list(VisitStatus)
+        for v in range(scale.visits):
+            cohort_ids = [cohort['id'] for cohort in cohorts if self.rng.random() < 0.75]
+            if not cohort_ids and cohorts:
+                cohort_ids = [cohorts[0]['id']]
+            visit = self.add("visits", Visit.model_construct(
+                id=self.uuid(),
+                study_id=study['id'],
+                name=f"Visit {v + 1}",
+                label=f"D{v * 7}",
+                description=None,
+                planned_timepoint=f"Day {v * 7} +/- 1 day",
+                planned_date=start + timedelta(days=v * 7),
+                actual_date=None,
+                cohort_ids=cohort_ids,
+                status=self.rng.choice(statuses),
+                created_at=self.created_at(v),
+                updated_at=self.created_at(v)
+            ))
+            chosen = self.rng.sample(study_procedures, min(scale.procedures, len(study_procedures)))
+            for order, study_procedure in enumerate(chosen, start=1):
+                self.add("visit_procedures", VisitProcedure.model_construct(
+                    id=self.uuid(),
+                    visit_id=visit['id'],
+                    study_procedure_id=study_procedure['id'],
+                    sequence_order=order,
+                    assigned_at=self.created_at(order)
+                ))
+        return study
+
+
+async def check_target(db, drop: bool) -> None:
+    """Raise ``ValueError`` unless ``db`` is safe to fill: not the app's database and empty, or ``drop`` is set."""
+    if drop:
+        return
+    if db.name == os.getenv("DB_NAME"):
+        raise ValueError(f"{db.name} is the application database (DB_NAME); pass --drop to overwrite it anyway")
+    for name in DATASET_COLLECTIONS:
+        if await db[name].find_one({}, {"_id": 1}):
+            raise ValueError(f"{db.name}.{name} already holds data; pass --drop to replace it")
+
+
+async def generate(db, scale: Scale, drop: bool = False) -> Dataset:
+    """Fill ``db`` with a synthetic dataset and return its counts and sample ids.
+
+    Raises ``ValueError`` when ``check_target`` refuses the database.
+    """
+    await check_target(db, drop)
+    if drop:
+        await asyncio.gather(*(db[name].delete_many({}) for name in DATASET_COLLECTIONS))
+
+    generator = _Generator(scale)
+    library = generator.library()
+    studies = [generator.study(n, library) for n in range(scale.studies)]
+
+    for collection, docs in generator.docs.items():
+        for start in range(0, len(docs), INSERT_CHUNK_SIZE):
+            await db[collection].insert_many(docs[start:start + INSERT_CHUNK_SIZE], ordered=False)
+    await refresh_visits(db, {"study_id": {"$in": [study['id'] for study in studies]}})
+
+    dataset = Dataset(scale=scale, counts={name: len(docs) for name, docs in generator.docs.items()})
+    if studies:
+        study_id = studies[0]['id']
+        cohort = next(doc for doc in generator.docs["cohorts"] if doc['study_id'] == study_id)
+        visit = next(doc for doc in generator.docs["visits"] if doc['study_id'] == study_id)
+        dataset.sample = {
+            "study_id": study_id,
+            "cohort_id": cohort['id'],
+            "cohort_animal_ids": cohort['animal_ids'],
+            "visit_id": visit['id'],
+            "study_procedure_ids": [doc['id'] for doc in generator.docs["study_procedures"] if doc['study_id'] == study_id],
+            "procedure_id": library[0]['id'] if library else None,
+            "animal_id": cohort['animal_ids'][0] if cohort['animal_ids'] else None,
+        }
+    return dataset
+
+
+def add_database_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--db-name", default=BENCHMARK_DB_NAME, help="database to fill (default $BENCHMARK_DB_NAME)")
+    parser.add_argument("--drop", action="store_true",
+                        help="empty the dataset collections first; needed for the app's database or one with data")
+
+
+def add_scale_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = Scale()
+    for name in asdict(defaults):
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=getattr(defaults, name))
+
+
+def scale_from_args(args: argparse.Namespace) -> Scale:
+    return Scale(**{name: getattr(args, name) for name in asdict(Scale())})
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Fill a database with a synthetic benchmark dataset.")
+    add_database_arguments(parser)
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    try:
+        dataset = await generate(client[args.db_name], scale_from_args(args), args.drop)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        client.close()
+    for collection, count in dataset.counts.items():
+        print(f"{collection}: {count}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
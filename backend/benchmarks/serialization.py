@@ -0,0 +1,103 @@
+"""Per-document cost of serializing list responses, before and after the fast path.
+
+The old path built a model per stored document with ``to_dict``, then FastAPI
+validated the ``response_model`` again and encoded it with ``json.dumps``. The
+fast path projects ``_id`` away in Mongo and encodes the documents with orjson.
+
+    python -m benchmarks.serialization [--docs 5000] [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from server import Animal, Visit, to_dict
+
+
+def animal_documents(count: int) -> List[dict]:
+    return [{
+        "id": str(uuid.uuid4()),
+        "animal_id": f"RAT{i:05d}",
+        "species": "Rat",
+        "strain": "Sprague-Dawley",
+        "sex": "M" if i % 2 else "F",
+        "birth_date": "2024-01-15",
+        "weight": 250.0 + i % 50,
+        "is_active": True,
+        "created_at": datetime.utcnow(),
+    } for i in range(count)]
+
+
+def visit_documents(count: int) -> List[dict]:
+    cohort_ids = [str(uuid.uuid4()) for _ in range(3)]
+    return [{
+        "id": str(uuid.uuid4()),
+        "study_id": "study",
+        "name": f"Day {i}",
+        "label": f"D{i}",
+        "description": "Scheduled visit",
+        "planned_timepoint": f"Day {i} +/- 1 day",
+        "planned_date": "2024-03-01",
+        "actual_date": None,
+        "cohort_ids": cohort_ids,
+        "status": "Scheduled",
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    } for i in range(count)]
+
+
+def old_path(model) -> Callable[[List[dict]], bytes]:
+    adapter = TypeAdapter(List[model])
+
+    def encode(docs: List[dict]) -> bytes:
+        with_ids = [{"_id": object(), **doc} for doc in docs]
+        models = [model(**to_dict(doc)) for doc in with_ids]
+        validated = adapter.validate_python([item.model_dump() for item in models])
+        content = jsonable_encoder(validated)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return encode
+
+
+def fast_path(docs: List[dict]) -> bytes:
+    return orjson.dumps(docs)
+
+
+def per_document_us(encode: Callable[[List[dict]], bytes], docs: List[dict], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode(docs)
+        best = min(best, time.perf_counter() - started)
+    return best / len(docs) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for name, model, factory in (("animals", Animal, animal_documents), ("visits", Visit, visit_documents)):
+        docs = factory(args.docs)
+        before = per_document_us(old_path(model), docs, args.repeat)
+        after = per_document_us(fast_path, docs, args.repeat)
+        results.append({
+            "collection": name,
+            "documents": args.docs,
+            "before_us_per_doc": round(before, 3),
+            "after_us_per_doc": round(after, 3),
+            "speedup": round(before / after, 1),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Streaming CSV/NDJSON bulk import.
+
+The request body is decoded line by line as it arrives, rows are validated in
+chunks and every valid chunk is written with one unordered ``insert_many``.
+Invalid rows and rejected writes are reported per row instead of aborting the
+whole load.
+"""
+
+import codecs
+import csv
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+IMPORT_CHUNK_SIZE = 500
+IMPORT_FORMATS = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+
+def detect_format(request: Request, requested: Optional[str]) -> str:
+    """Pick the upload format from the ``format`` parameter or the Content-Type."""
+    if requested:
+        return requested
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=415,
+            detail="Upload must be text/csv or application/x-ndjson (or pass format=csv|ndjson)"
+        )
+    return IMPORT_FORMATS[content_type]
+
+
+async def _iter_lines(request: Request) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_rows(request: Request, fmt: str) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield ``(row_number, row)`` pairs; unparsable rows are yielded as exceptions.
+
+    Every record must fit on one line, so quoted CSV values cannot contain newlines.
+    """
+    header = None
+    row_number = 0
+    async for line in _iter_lines(request):
+        if not line.strip():
+            continue
+        if fmt == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            row_number += 1
+            if len(values) != len(header):
+                yield row_number, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+                continue
+            yield row_number, {name: (value if value != "" else None) for name, value in zip(header, values)}
+        else:
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield row_number, ValueError(f"Invalid JSON: {e}")
+                continue
+            if not isinstance(row, dict):
+                row = ValueError("Each line must be a JSON object")
+            yield row_number, row
+
+
+def _error_messages(error: Exception) -> List[str]:
+    if isinstance(error, ValidationError):
+        return [
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" if err['loc'] else err['msg']
+            for err in error.errors()
+        ]
+    return [str(error)]
+
+
+async def _insert_chunk(collection, chunk: List[Tuple[int, Dict[str, Any]]], errors: List[Dict[str, Any]],
+                        on_insert: Optional[Callable[[], Awaitable[None]]]) -> int:
+    if not chunk:
+        return 0
+    try:
+        result = await collection.insert_many([doc for _, doc in chunk], ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            errors.append({"row": chunk[write_error["index"]][0], "errors": [write_error["errmsg"]]})
+        inserted = e.details.get("nInserted", 0)
+    if inserted and on_insert:
+        await on_insert()
+    return inserted
+
+
+async def import_rows(collection, rows: AsyncIterator[Tuple[int, Any]],
+                      build_document: Callable[[Dict[str, Any]], Dict[str, Any]],
+                      chunk_size: int = IMPORT_CHUNK_SIZE,
+                      on_insert: Optional[Callable[[], Awaitable[None]]] = None) -> Dict[str, Any]:
+    """Validate rows with ``build_document`` and insert them in unordered batches.
+
+    ``on_insert`` is awaited after every batch that stored at least one row.
+    """
+    inserted = 0
+    total = 0
+    errors: List[Dict[str, Any]] = []
+    chunk: List[Tuple[int, Dict[str, Any]]] = []
+
+    async for row_number, row in rows:
+        total += 1
+        if isinstance(row, Exception):
+            errors.append({"row": row_number, "errors": _error_messages(row)})
+            continue
+        try:
+            chunk.append((row_number, build_document(row)))
+        except (ValidationError, ValueError) as e:
+            errors.append({"row": row_number, "errors": _error_messages(e)})
+            continue
+        if len(chunk) >= chunk_size:
+            inserted += await _insert_chunk(collection, chunk, errors, on_insert)
+            chunk = []
+    inserted += await _insert_chunk(collection, chunk, errors, on_insert)
+
+    errors.sort(key=lambda error: error["row"])
+    return {"total_rows": total, "inserted": inserted, "failed": len(errors), "errors": errors}
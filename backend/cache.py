@@ -0,0 +1,142 @@
+"""Small in-process caches.
+
+``TTLCache`` is a least-recently-used map whose entries also expire after a
+fixed time to live. It counts hits, misses and evictions so callers can expose
+them. Caches are per worker process; ``VersionedCache`` adds cross-worker
+invalidation through a version counter stored in the ``cache_versions``
+collection.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from pymongo import ReturnDocument
+
+MISSING = object()
+
+
+class TTLCache:
+    """LRU cache with a per-entry time to live."""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value or ``MISSING`` when absent or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one key, or every entry when no key is given."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else None,
+        }
+
+
+class VersionedCache:
+    """Read-through ``TTLCache`` invalidated across workers by a version counter.
+
+    Writers call ``invalidate``, which clears the local entries and increments
+    the counter. Readers compare the counter at most every
+    ``version_check_interval`` seconds and drop their entries when it moved, so
+    other workers serve stale data for at most that long.
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 1024, version_check_interval: float = 1.0):
+        self.name = name
+        self.cache = TTLCache(ttl=ttl, maxsize=maxsize)
+        self.version_check_interval = version_check_interval
+        self.version: Optional[int] = None
+        self.remote_invalidations = 0
+        self._checked_at = float("-inf")
+        self._generation = 0
+
+    def _clear(self) -> None:
+        self.cache.invalidate()
+        self._generation += 1
+
+    async def _sync_version(self, db) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.version_check_interval:
+            return
+        self._checked_at = now
+        doc = await db.cache_versions.find_one({"_id": self.name})
+        version = doc['version'] if doc else 0
+        if version != self.version:
+            if self.version is not None:
+                self.remote_invalidations += 1
+            self._clear()
+            self.version = version
+
+    async def current_version(self, db) -> int:
+        """Return the shared version counter, re-reading it when the check interval passed."""
+        await self._sync_version(db)
+        return self.version
+
+    async def get_or_load(self, db, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for ``key``, loading and caching it on a miss."""
+        await self._sync_version(db)
+        value = self.cache.get(key)
+        if value is not MISSING:
+            return value
+
+        # Don't cache a value loaded before a concurrent invalidation
+        generation = self._generation
+        value = await loader()
+        if value is not None and generation == self._generation:
+            self.cache.set(key, value)
+        return value
+
+    async def invalidate(self, db) -> None:
+        """Clear this worker's entries and signal the other workers to clear theirs."""
+        self._clear()
+        doc = await db.cache_versions.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.version = doc['version']
+        self._checked_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.cache.stats()
+        stats["version"] = self.version
+        stats["remote_invalidations"] = self.remote_invalidations
+        return stats
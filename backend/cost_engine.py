@@ -0,0 +1,132 @@
+"""Batched cost calculation for visits and studies.
+
+Costs are resolved with a fixed number of queries regardless of study size:
+the visits are loaded once, their procedures and cohorts are fetched with one
+``$in`` query each, and the referenced study procedures with a final ``$in``
+query. The join happens in memory.
+
+Costs are summed per currency (``costs_by_currency``), each procedure in its
+own currency. Conversion to a single currency is left to the readers (see
+``fx``), so stored rollups stay valid when FX rates change. A procedure costs
+its ``study_specific_cost`` when set, otherwise the ``default_cost``
+snapshotted from the master procedure.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from fx import add_amounts, currency_code
+
+VISIT_COST_PROJECTION = {"_id": 0, "id": 1, "name": 1, "cohort_ids": 1}
+STUDY_PROCEDURE_COST_PROJECTION = {
+    "_id": 0, "id": 1, "master_procedure_id": 1, "study_specific_cost": 1, "default_cost": 1, "currency": 1
+}
+
+
+def per_animal_cost(study_procedure: Dict[str, Any]) -> float:
+    if study_procedure.get('study_specific_cost') is not None:
+        return study_procedure['study_specific_cost']
+    return study_procedure.get('default_cost') or 0
+
+
+async def load_procedure_costs(db, study_procedure_filter: Dict[str, Any],
+                               projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Load study procedures with the cost fields ``per_animal_cost`` needs.
+
+    Procedures imported before ``default_cost`` was snapshotted get it from
+    their master procedure, with one extra query when there are any.
+    """
+    study_procedures = await db.study_procedures.find(
+        study_procedure_filter, {**STUDY_PROCEDURE_COST_PROJECTION, **(projection or {})}
+    ).to_list(None)
+    missing = {
+        proc['master_procedure_id'] for proc in study_procedures
+        if proc.get('study_specific_cost') is None and proc.get('default_cost') is None
+    }
+    if missing:
+        masters = await db.master_procedures.find(
+            {"id": {"$in": list(missing)}}, {"_id": 0, "id": 1, "default_cost": 1}
+        ).to_list(None)
+        default_costs = {master['id']: master.get('default_cost') for master in masters}
+        for proc in study_procedures:
+            if proc.get('study_specific_cost') is None and proc.get('default_cost') is None:
+                proc['default_cost'] = default_costs.get(proc['master_procedure_id'])
+    return study_procedures
+
+
+async def compute_visit_costs(db, visits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Return a cost breakdown for each visit document, in the order given."""
+    if not visits:
+        return []
+
+    visit_ids = [visit['id'] for visit in visits]
+    cohort_ids = list({cohort_id for visit in visits for cohort_id in visit.get('cohort_ids', [])})
+
+    visit_procedures, cohorts = await asyncio.gather(
+        db.visit_procedures.find(
+            {"visit_id": {"$in": visit_ids}},
+            {"_id": 0, "visit_id": 1, "study_procedure_id": 1}
+        ).to_list(None),
+        db.cohorts.find(
+            {"id": {"$in": cohort_ids}},
+            {"_id": 0, "id": 1, "animal_ids": 1}
+        ).to_list(None),
+    )
+
+    study_procedure_ids = list({vp['study_procedure_id'] for vp in visit_procedures})
+    study_procedures = await load_procedure_costs(db, {"id": {"$in": study_procedure_ids}})
+
+    animals_by_cohort = {cohort['id']: len(cohort.get('animal_ids', [])) for cohort in cohorts}
+    study_procs_by_id = {proc['id']: proc for proc in study_procedures}
+    procedures_by_visit: Dict[str, List[Dict[str, Any]]] = {visit_id: [] for visit_id in visit_ids}
+    for visit_proc in visit_procedures:
+        procedures_by_visit[visit_proc['visit_id']].append(visit_proc)
+
+    results = []
+    for visit in visits:
+        total_animals = 0
+        for cohort_id in visit.get('cohort_ids', []):
+            total_animals += animals_by_cohort.get(cohort_id, 0)
+
+        costs_by_currency: Dict[str, float] = {}
+        visit_procs = procedures_by_visit[visit['id']]
+        for visit_proc in visit_procs:
+            study_proc = study_procs_by_id.get(visit_proc['study_procedure_id'])
+            if study_proc:
+                currency = currency_code(study_proc.get('currency'))
+                costs_by_currency[currency] = (
+                    costs_by_currency.get(currency, 0) + per_animal_cost(study_proc) * total_animals
+                )
+
+        results.append({
+            "visit_id": visit['id'],
+            "visit_name": visit.get('name'),
+            "costs_by_currency": costs_by_currency,
+            "total_animals": total_animals,
+            "procedure_count": len(visit_procs)
+        })
+
+    return results
+
+
+async def compute_study_costs(db, study_id: str) -> Dict[str, Any]:
+    """Return the cost breakdown for every visit of a study plus the study total."""
+    visits = await db.visits.find({"study_id": study_id}, VISIT_COST_PROJECTION).to_list(None)
+    visit_costs = await compute_visit_costs(db, visits)
+
+    costs_by_currency: Dict[str, float] = {}
+    for visit_cost in visit_costs:
+        add_amounts(costs_by_currency, visit_cost['costs_by_currency'])
+
+    return {
+        "study_id": study_id,
+        "costs_by_currency": costs_by_currency,
+        "visit_costs": [
+            {
+                "visit_id": visit_cost['visit_id'],
+                "visit_name": visit_cost['visit_name'],
+                "costs_by_currency": visit_cost['costs_by_currency']
+            }
+            for visit_cost in visit_costs
+        ]
+    }
@@ -0,0 +1,340 @@
+"""Materialized cost rollups per visit and per study.
+
+The ``cost_rollups`` collection holds one document per visit (``kind: "visit"``)
+and one per study (``kind: "study"``). Mutating endpoints refresh only the
+visits their change can affect and then re-sum the owning study from the
+stored visit rollups, so cost reads become single document lookups. Visits
+that have no rollup yet, such as those created before rollups existed, get
+one when their study is re-summed.
+
+Each rollup carries a ``revision`` token. A refresh reads the revisions
+before reading the data it computes from and only replaces a rollup whose
+revision is unchanged, recomputing the ones a concurrent refresh rewrote.
+
+Rollups hold native ``costs_by_currency`` totals; responses convert them to
+the requested currency with the FX rates effective on the requested date, or
+report a null total and the ``missing_rates`` when a currency has no rate.
+
+Run ``python cost_rollups.py --verify`` from the backend directory to compare
+the stored rollups against a full recompute, or without ``--verify`` to
+rebuild them.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from cost_engine import compute_visit_costs
+from fx import RateTable, add_amounts, convert_available, converted_costs
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_VISIT = "visit"
+ROLLUP_STUDY = "study"
+
+# Times a refresh recomputes rollups that concurrent refreshes keep rewriting
+REFRESH_ATTEMPTS = 5
+
+ROLLUP_VISIT_PROJECTION = {"_id": 0, "id": 1, "study_id": 1, "name": 1, "cohort_ids": 1, "created_at": 1}
+
+
+def visit_cost_response(rollup: Dict[str, Any], rates: RateTable, currency: Optional[str] = None,
+                        on: Optional[date] = None) -> Dict[str, Any]:
+    """Shape a visit rollup like the ``/visits/{visit_id}/cost`` response."""
+    return {
+        "visit_id": rollup['id'],
+        **converted_costs(rollup['costs_by_currency'], rates, currency, on),
+        "total_animals": rollup['total_animals'],
+        "procedure_count": rollup['procedure_count']
+    }
+
+
+def study_cost_response(rollup: Dict[str, Any], rates: RateTable, currency: Optional[str] = None,
+                        on: Optional[date] = None) -> Dict[str, Any]:
+    """Shape a study rollup like the ``/studies/{study_id}/cost`` response.
+
+    Every visit is converted with the same per-currency factors as the total;
+    a visit's cost is None when one of its currencies has no rate.
+    """
+    response = {"study_id": rollup['id'], **converted_costs(rollup['costs_by_currency'], rates, currency, on)}
+    visit_costs = [add_amounts({}, visit_cost['costs_by_currency']) for visit_cost in rollup['visit_costs']]
+    factors, _ = rates.available_factors(response['costs_by_currency'], response['currency'],
+                                         date.fromisoformat(response['fx_date']))
+    response["visit_costs"] = [
+        {
+            "visit_id": visit_cost['visit_id'],
+            "visit_name": visit_cost['visit_name'],
+            "cost": convert_available(costs, factors),
+            "costs_by_currency": costs
+        }
+        for visit_cost, costs in zip(rollup['visit_costs'], visit_costs)
+    ]
+    return response
+
+
+async def _stored_revisions(db, kind: str, rollup_ids: List[str]) -> Dict[str, Optional[str]]:
+    """The ``revision`` of each stored rollup; ids without a rollup are absent."""
+    stored = await db.cost_rollups.find(
+        {"kind": kind, "id": {"$in": rollup_ids}}, {"_id": 0, "id": 1, "revision": 1}
+    ).to_list(None)
+    return {rollup['id']: rollup.get('revision') for rollup in stored}
+
+
+async def _write_rollups(db, kind: str, rollups: Dict[str, Dict[str, Any]],
+                         revisions: Dict[str, Optional[str]]) -> List[str]:
+    """Store rollups whose revision is still the one read before computing them.
+
+    Returns the ids a concurrent refresh wrote in between; their rollups were
+    computed from data that may predate that refresh and are not stored.
+    """
+    if not rollups:
+        return []
+    revision = uuid.uuid4().hex
+    operations = []
+    for rollup_id, rollup in rollups.items():
+        rollup['revision'] = revision
+        if rollup_id in revisions:
+            # Rollups stored before revisions existed match ``None``
+            operations.append(ReplaceOne({"kind": kind, "id": rollup_id, "revision": revisions[rollup_id]}, dict(rollup)))
+        else:
+            operations.append(InsertOne(dict(rollup)))
+
+    try:
+        result = await db.cost_rollups.bulk_write(operations, ordered=False)
+        written = result.matched_count + result.inserted_count
+    except BulkWriteError as e:
+        # Only losing an insert race to a concurrent refresh is expected
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        written = e.details['nMatched'] + e.details['nInserted']
+    if written == len(operations):
+        return []
+    stored = await _stored_revisions(db, kind, list(rollups))
+    return [rollup_id for rollup_id in rollups if stored.get(rollup_id) != revision]
+
+
+async def _refresh_guarded(db, kind: str, rollup_ids: List[str], compute) -> Dict[str, Dict[str, Any]]:
+    """Compute and store rollups, recomputing those a concurrent refresh wrote meanwhile.
+
+    Revisions are read before ``compute`` reads its inputs, so a rollup is
+    only stored if no other refresh, which may have seen newer data, stored
+    one since.
+    """
+    refreshed: Dict[str, Dict[str, Any]] = {}
+    pending = list(rollup_ids)
+    for _ in range(REFRESH_ATTEMPTS):
+        revisions = await _stored_revisions(db, kind, pending)
+        rollups = await compute(pending)
+        conflicts = await _write_rollups(db, kind, rollups, revisions)
+        refreshed.update({rollup_id: rollup for rollup_id, rollup in rollups.items() if rollup_id not in conflicts})
+        pending = conflicts
+        if not pending:
+            return refreshed
+    # Still contended: drop them so the next read materializes them again
+    logger.warning("Dropping %d %s cost rollups after %d conflicting refreshes", len(pending), kind, REFRESH_ATTEMPTS)
+    await db.cost_rollups.delete_many({"kind": kind, "id": {"$in": pending}})
+    return refreshed
+
+
+async def _compute_visit_rollups(db, visit_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    visits = await db.visits.find({"id": {"$in": visit_ids}}, ROLLUP_VISIT_PROJECTION).to_list(None)
+    visit_costs = await compute_visit_costs(db, visits)
+    now = datetime.utcnow()
+    return {
+        visit['id']: {
+            "kind": ROLLUP_VISIT,
+            "id": visit['id'],
+            "study_id": visit['study_id'],
+            "visit_name": visit_cost['visit_name'],
+            "visit_created_at": visit.get('created_at'),
+            "costs_by_currency": visit_cost['costs_by_currency'],
+            "total_animals": visit_cost['total_animals'],
+            "procedure_count": visit_cost['procedure_count'],
+            "updated_at": now
+        }
+        for visit, visit_cost in zip(visits, visit_costs)
+    }
+
+
+async def _compute_study_rollups(db, study_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    visits = await db.visits.find(
+        {"study_id": {"$in": study_ids}}, {"_id": 0, "id": 1, "study_id": 1}
+    ).sort([("created_at", 1), ("id", 1)]).to_list(None)
+    visit_rollups = {
+        rollup['id']: rollup
+        for rollup in await db.cost_rollups.find(
+            {"kind": ROLLUP_VISIT, "id": {"$in": [visit['id'] for visit in visits]}},
+            {"_id": 0, "id": 1, "visit_name": 1, "costs_by_currency": 1}
+        ).to_list(None)
+        if 'costs_by_currency' in rollup
+    }
+    # Visits created before rollups existed have none yet
+    missing = [visit['id'] for visit in visits if visit['id'] not in visit_rollups]
+    if missing:
+        visit_rollups.update(await _refresh_guarded(
+            db, ROLLUP_VISIT, missing, lambda visit_ids: _compute_visit_rollups(db, visit_ids)
+        ))
+
+    now = datetime.utcnow()
+    rollups = {
+        study_id: {
+            "kind": ROLLUP_STUDY,
+            "id": study_id,
+            "study_id": study_id,
+            "costs_by_currency": {},
+            "visit_costs": [],
+            "updated_at": now
+        }
+        for study_id in study_ids
+    }
+    for visit in visits:
+        visit_rollup = visit_rollups.get(visit['id'])
+        if not visit_rollup:
+            continue
+        rollup = rollups[visit['study_id']]
+        add_amounts(rollup['costs_by_currency'], visit_rollup['costs_by_currency'])
+        rollup['visit_costs'].append({
+            "visit_id": visit['id'],
+            "visit_name": visit_rollup['visit_name'],
+            "costs_by_currency": visit_rollup['costs_by_currency']
+        })
+    return rollups
+
+
+async def refresh_visits(db, visit_filter: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Recompute the rollups of the visits matching ``visit_filter`` and of their studies."""
+    visits = await db.visits.find(visit_filter, {"_id": 0, "id": 1, "study_id": 1}).to_list(None)
+    if not visits:
+        return []
+
+    rollups = await _refresh_guarded(
+        db, ROLLUP_VISIT, [visit['id'] for visit in visits], lambda visit_ids: _compute_visit_rollups(db, visit_ids)
+    )
+    await refresh_studies(db, {visit['study_id'] for visit in visits})
+    return [rollups[visit['id']] for visit in visits if visit['id'] in rollups]
+
+
+async def refresh_studies(db, study_ids: Iterable[str]) -> List[Dict[str, Any]]:
+    """Re-sum study rollups from their visit rollups, computing the visit rollups still missing."""
+    study_ids = list(study_ids)
+    if not study_ids:
+        return []
+    rollups = await _refresh_guarded(
+        db, ROLLUP_STUDY, study_ids, lambda pending: _compute_study_rollups(db, pending)
+    )
+    return list(rollups.values())
+
+
+async def refresh_for_cohort(db, cohort_id: str) -> None:
+    """Refresh the visits that include a cohort after its animals changed."""
+    await refresh_visits(db, {"cohort_ids": cohort_id})
+
+
+async def refresh_for_study_procedure(db, study_procedure_id: str) -> None:
+    """Refresh the visits that use a study procedure after its cost changed."""
+    visit_ids = await db.visit_procedures.distinct("visit_id", {"study_procedure_id": study_procedure_id})
+    if visit_ids:
+        await refresh_visits(db, {"id": {"$in": visit_ids}})
+
+
+async def refresh_for_master_procedure(db, master_procedure_id: str) -> None:
+    """Refresh the visits whose study procedures fall back to a master's ``default_cost`` after it changed."""
+    study_procedure_ids = await db.study_procedures.distinct(
+        "id", {"master_procedure_id": master_procedure_id, "study_specific_cost": None, "default_cost": None}
+    )
+    if not study_procedure_ids:
+        return
+    visit_ids = await db.visit_procedures.distinct("visit_id", {"study_procedure_id": {"$in": study_procedure_ids}})
+    if visit_ids:
+        await refresh_visits(db, {"id": {"$in": visit_ids}})
+
+
+async def get_visit_rollup(db, visit_id: str) -> Optional[Dict[str, Any]]:
+    """Return the visit rollup, materializing it on first access."""
+    rollup = await db.cost_rollups.find_one({"kind": ROLLUP_VISIT, "id": visit_id}, {"_id": 0})
+    # Rollups stored before costs were kept per currency are recomputed
+    if rollup and 'costs_by_currency' in rollup:
+        return rollup
+    rollups = await refresh_visits(db, {"id": visit_id})
+    return rollups[0] if rollups else None
+
+
+async def get_study_rollup(db, study_id: str) -> Dict[str, Any]:
+    """Return the study rollup, materializing it on first access."""
+    rollup = await db.cost_rollups.find_one({"kind": ROLLUP_STUDY, "id": study_id}, {"_id": 0})
+    # Study rollups stored without a revision may have summed only some visits
+    if rollup and 'revision' in rollup:
+        return rollup
+    if not rollup and not await db.visits.find_one({"study_id": study_id}, {"_id": 1}):
+        return {"kind": ROLLUP_STUDY, "id": study_id, "costs_by_currency": {}, "visit_costs": []}
+    rollups = await refresh_studies(db, [study_id])
+    # Under persistent contention nothing was stored; answer from a fresh sum
+    return rollups[0] if rollups else (await _compute_study_rollups(db, [study_id]))[study_id]
+
+
+async def rebuild(db, verify_only: bool = False, study_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Compare stored rollups with a full recompute, rewriting them unless ``verify_only``."""
+    visit_filter = {"study_id": study_id} if study_id else {}
+    visits = await db.visits.find(visit_filter, ROLLUP_VISIT_PROJECTION).to_list(None)
+    visit_costs = await compute_visit_costs(db, visits)
+
+    rollup_filter = {"kind": ROLLUP_VISIT}
+    if study_id:
+        rollup_filter["study_id"] = study_id
+    stored = {
+        rollup['id']: rollup
+        for rollup in await db.cost_rollups.find(rollup_filter, {"_id": 0}).to_list(None)
+    }
+
+    mismatches = []
+    for visit_cost in visit_costs:
+        rollup = stored.pop(visit_cost['visit_id'], None)
+        expected = {key: visit_cost[key] for key in ("costs_by_currency", "total_animals", "procedure_count")}
+        actual = {key: rollup.get(key) for key in expected} if rollup else None
+        if actual != expected:
+            mismatches.append({"visit_id": visit_cost['visit_id'], "expected": expected, "stored": actual})
+    for orphan_id in stored:
+        mismatches.append({"visit_id": orphan_id, "expected": None, "stored": stored[orphan_id]})
+
+    if not verify_only:
+        if stored:
+            await db.cost_rollups.delete_many({"kind": ROLLUP_VISIT, "id": {"$in": list(stored)}})
+        await refresh_visits(db, visit_filter)
+        study_ids = [study_id] if study_id else await db.studies.distinct("id")
+        await refresh_studies(db, study_ids)
+
+    return mismatches
+
+
+async def _main(args) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[os.getenv("DB_NAME", "preclinical_research")]
+    try:
+        mismatches = await rebuild(db, verify_only=args.verify, study_id=args.study)
+    finally:
+        client.close()
+
+    for mismatch in mismatches:
+        print(f"❌ Visit {mismatch['visit_id']}: stored {mismatch['stored']}, expected {mismatch['expected']}")
+    if args.verify:
+        print(f"{'✅' if not mismatches else '❌'} {len(mismatches)} cost rollup mismatches found")
+        return 1 if mismatches else 0
+    print(f"✅ Cost rollups rebuilt ({len(mismatches)} were stale)")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild or verify materialized cost rollups.")
+    parser.add_argument("--verify", action="store_true", help="only compare stored rollups with a full recompute")
+    parser.add_argument("--study", help="limit to a single study id")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,67 @@
+"""Strong ETags and conditional GET handling.
+
+Single documents are tagged from their id and ``updated_at`` (or the
+collection's equivalent timestamp). Lists are tagged from a per-collection
+version counter in the ``cache_versions`` collection, the same counters
+``VersionedCache`` uses. Writers bump it after every insert, update and
+delete, so tagging a list costs one point read however long the list is.
+Readers fetch the version before the documents, so a response is never
+tagged with a version newer than its data. A matching ``If-None-Match``
+header short-circuits the handler with a bodyless 304 before anything is
+validated or serialized.
+"""
+
+import asyncio
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+ETAG_HEADERS = {"Cache-Control": "no-cache"}
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so a W/ prefix is ignored
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return any((candidate[2:] if candidate.startswith("W/") else candidate) == etag for candidate in candidates)
+
+
+def check_etag(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return a 304 response when the client's copy is current, else tag ``response``."""
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, **ETAG_HEADERS})
+    response.headers["ETag"] = etag
+    response.headers.update(ETAG_HEADERS)
+    return None
+
+
+def document_etag(doc: dict, field: str = "updated_at") -> str:
+    return make_etag(doc.get('id'), doc.get(field))
+
+
+def _version_key(collection: str) -> str:
+    return f"collection:{collection}"
+
+
+async def collection_version(db, collection: str) -> int:
+    """Return the write counter list ETags of ``collection`` are built from."""
+    doc = await db.cache_versions.find_one({"_id": _version_key(collection)})
+    return doc['version'] if doc else 0
+
+
+async def bump_collection_version(db, *collections: str) -> None:
+    """Change the list ETags of ``collections``; call after writing to them."""
+    await asyncio.gather(*(
+        db.cache_versions.update_one({"_id": _version_key(collection)}, {"$inc": {"version": 1}}, upsert=True)
+        for collection in collections
+    ))
@@ -0,0 +1,360 @@
+"""Flat-table export of a study for statistical analysis.
+
+A study exports as five tables:
+
+* ``animals``: one row per cohort membership;
+* ``cohorts``;
+* ``visits``;
+* ``procedures``: one row per visit procedure, joined to its study procedure;
+* ``results``: one row per measurement, from ``result_buckets``.
+
+Rows are read from Motor cursors and written in chunks of
+``EXPORT_CHUNK_SIZE``. Each chunk is encoded and handed to the client before
+the next is read, so memory stays bounded by the chunk size rather than the
+table size. Formats are ``csv``, ``parquet`` (one row group per chunk) and
+``arrow`` (an Arrow IPC stream). The binary formats need the optional
+``pyarrow`` package. ``columns`` selects and orders a subset of a table's
+columns.
+
+    python export.py <study_id> results --format parquet --columns animal_id,field,value_number -o weights.parquet
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import os
+import sys
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from cost_engine import load_procedure_costs, per_animal_cost
+from cost_rollups import get_study_rollup
+from fx import convert_available, currency_code, load_rate_table
+from results import RESULTS_COLLECTION
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # CSV exports still work without it
+    pyarrow = None
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+Row = Dict[str, Any]
+RowChunks = AsyncIterator[List[Row]]
+
+# Column name -> type; types map to Arrow types in _arrow_schema
+ANIMAL_COLUMNS = {
+    "cohort_id": "string", "cohort_name": "string", "id": "string", "animal_id": "string", "species": "string",
+    "strain": "string", "sex": "string", "birth_date": "date", "weight": "float", "is_active": "bool",
+}
+COHORT_COLUMNS = {
+    "id": "string", "name": "string", "description": "string", "criteria": "string",
+    "planned_animal_count": "int", "animal_count": "int", "created_at": "timestamp",
+}
+VISIT_COLUMNS = {
+    "id": "string", "name": "string", "label": "string", "planned_timepoint": "string",
+    "timepoint_offset_days": "int", "planned_date": "date", "window_start_date": "date",
+    "window_end_date": "date", "actual_date": "date", "status": "string", "cohort_ids": "string",
+    "total_cost": "float", "currency": "string",
+}
+PROCEDURE_COLUMNS = {
+    "visit_id": "string", "visit_name": "string", "planned_date": "date", "id": "string",
+    "study_procedure_id": "string", "procedure_name": "string", "category": "string",
+    "sequence_order": "int", "cost": "float", "currency": "string",
+}
+RESULT_COLUMNS = {
+    "visit_id": "string", "visit_date": "date", "study_procedure_id": "string", "procedure_name": "string",
+    "field": "string", "field_type": "string", "units": "string", "animal_id": "string",
+    "value": "string", "value_number": "float", "recorded_at": "timestamp",
+}
+
+# Multi-valued fields are flattened into one delimited string
+LIST_SEPARATOR = "; "
+
+
+def _joined(value: Any) -> Any:
+    return LIST_SEPARATOR.join(str(item) for item in value) if isinstance(value, list) else value
+
+
+async def _chunks(cursor, build: Callable[[Row], Row], chunk_size: int) -> RowChunks:
+    chunk: List[Row] = []
+    async for doc in cursor:
+        chunk.append(build(doc))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _study_cohorts(db, study_id: str) -> List[Row]:
+    return await db.cohorts.find({"study_id": study_id}, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).to_list(None)
+
+
+async def animal_rows(db, study_id: str, chunk_size: int) -> RowChunks:
+    for cohort in await _study_cohorts(db, study_id):
+        animal_ids = cohort.get('animal_ids', [])
+        for start in range(0, len(animal_ids), chunk_size):
+            animals = db.animals.find({"id": {"$in": animal_ids[start:start + chunk_size]}}, {"_id": 0}).sort("id", 1)
+            build = lambda animal: {**animal, "cohort_id": cohort['id'], "cohort_name": cohort['name']}
+            async for chunk in _chunks(animals, build, chunk_size):
+                yield chunk
+
+
+async def cohort_rows(db, study_id: str, chunk_size: int) -> RowChunks:
+    cohorts = await _study_cohorts(db, study_id)
+    for start in range(0, len(cohorts), chunk_size):
+        yield [{**cohort, "animal_count": len(cohort.get('animal_ids', []))} for cohort in cohorts[start:start + chunk_size]]
+
+
+def _study_visits(db, study_id: str, projection: Optional[Dict[str, int]] = None):
+    return db.visits.find({"study_id": study_id}, projection or {"_id": 0}).sort(
+        [("planned_date", 1), ("id", 1)]).batch_size(EXPORT_CHUNK_SIZE)
+
+
+async def visit_rows(db, study_id: str, chunk_size: int) -> RowChunks:
+    """Visits with their cost in ``FX_BASE_CURRENCY`` at today's rates; empty when a rate is missing."""
+    rates = await load_rate_table(db)
+    today = date.today()
+    # The study rollup covers every visit, computing the costs of visits that have no rollup yet
+    rollup = await get_study_rollup(db, study_id)
+    costs = {}
+    for visit_cost in rollup['visit_costs']:
+        factors, _ = rates.available_factors(visit_cost['costs_by_currency'], rates.base, today)
+        costs[visit_cost['visit_id']] = convert_available(visit_cost['costs_by_currency'], factors)
+
+    def build(visit: Row) -> Row:
+        cost = costs.get(visit['id'])
+        return {**visit, "cohort_ids": _joined(visit.get('cohort_ids')), "total_cost": cost,
+                "currency": rates.base if cost is not None else None}
+    async for chunk in _chunks(_study_visits(db, study_id), build, chunk_size):
+        yield chunk
+
+
+async def _study_procedures(db, study_id: str) -> Dict[str, Row]:
+    procedures = await load_procedure_costs(db, {"study_id": study_id}, {"name": 1, "category": 1})
+    return {procedure['id']: procedure for procedure in procedures}
+
+
+async def procedure_rows(db, study_id: str, chunk_size: int) -> RowChunks:
+    procedures = await _study_procedures(db, study_id)
+    visits = _study_visits(db, study_id, {"_id": 0, "id": 1, "name": 1, "planned_date": 1})
+    async for visit_chunk in _chunks(visits, lambda visit: visit, chunk_size):
+        by_id = {visit['id']: visit for visit in visit_chunk}
+        assignments = db.visit_procedures.find({"visit_id": {"$in": list(by_id)}}, {"_id": 0}).sort(
+            [("visit_id", 1), ("sequence_order", 1), ("assigned_at", 1), ("id", 1)])
+
+        def build(assignment: Row) -> Row:
+            visit = by_id[assignment['visit_id']]
+            procedure = procedures.get(assignment['study_procedure_id'], {})
+            return {
+                **assignment,
+                "visit_name": visit.get('name'),
+                "planned_date": visit.get('planned_date'),
+                "procedure_name": procedure.get('name'),
+                "category": procedure.get('category'),
+                "cost": per_animal_cost(procedure) if procedure else None,
+                "currency": currency_code(procedure.get('currency')) if procedure else None,
+            }
+        async for chunk in _chunks(assignments, build, chunk_size):
+            yield chunk
+
+
+async def result_rows(db, study_id: str, chunk_size: int) -> RowChunks:
+    procedures = await _study_procedures(db, study_id)
+    buckets = db[RESULTS_COLLECTION].find({"study_id": study_id}, {"_id": 0}).sort(
+        [("study_procedure_id", 1), ("field", 1), ("visit_date", 1)]).batch_size(100)
+    chunk: List[Row] = []
+    async for bucket in buckets:
+        procedure_name = procedures.get(bucket['study_procedure_id'], {}).get('name')
+        for animal_id, measurement in sorted(bucket.get('values', {}).items()):
+            value = measurement['value']
+            numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+            chunk.append({
+                "visit_id": bucket['visit_id'],
+                "visit_date": bucket.get('visit_date'),
+                "study_procedure_id": bucket['study_procedure_id'],
+                "procedure_name": procedure_name,
+                "field": bucket['field'],
+                "field_type": bucket.get('field_type'),
+                "units": bucket.get('units'),
+                "animal_id": animal_id,
+                "value": value,
+                "value_number": float(value) if numeric else None,
+                "recorded_at": measurement.get('recorded_at'),
+            })
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+EXPORT_TABLES: Dict[str, Tuple[Dict[str, str], Callable[[Any, str, int], RowChunks]]] = {
+    "animals": (ANIMAL_COLUMNS, animal_rows),
+    "cohorts": (COHORT_COLUMNS, cohort_rows),
+    "visits": (VISIT_COLUMNS, visit_rows),
+    "procedures": (PROCEDURE_COLUMNS, procedure_rows),
+    "results": (RESULT_COLUMNS, result_rows),
+}
+
+
+def select_columns(table: str, columns: Optional[Sequence[str]]) -> Dict[str, str]:
+    """Return the exported ``{column: type}``; raises ``ValueError`` for unknown columns."""
+    available = EXPORT_TABLES[table][0]
+    if not columns:
+        return dict(available)
+    unknown = [column for column in columns if column not in available]
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {', '.join(unknown)} (available: {', '.join(available)})")
+    return {column: available[column] for column in columns}
+
+
+def _coerce(value: Any, column_type: str) -> Any:
+    if value is None:
+        return None
+    if column_type == "date":
+        return value if isinstance(value, date) else date.fromisoformat(value)
+    if column_type == "timestamp":
+        return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if column_type == "string":
+        if isinstance(value, Enum):
+            return value.value
+        return _joined(value) if isinstance(value, list) else str(value)
+    if column_type == "int":
+        return int(value)
+    if column_type == "float":
+        return float(value)
+    return value
+
+
+def _arrow_schema(columns: Dict[str, str]):
+    types = {
+        "string": pyarrow.string(), "int": pyarrow.int64(), "float": pyarrow.float64(),
+        "bool": pyarrow.bool_(), "date": pyarrow.date32(), "timestamp": pyarrow.timestamp("ms"),
+    }
+    return pyarrow.schema([(name, types[column_type]) for name, column_type in columns.items()])
+
+
+class _ChunkSink:
+    """Write-only file that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+async def _encode_csv(chunks: RowChunks, columns: Dict[str, str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for chunk in chunks:
+        writer.writerows([[_coerce(row.get(name), "string") for name in columns] for row in chunk])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def _encode_arrow(chunks: RowChunks, columns: Dict[str, str], fmt: str) -> AsyncIterator[bytes]:
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    output = pyarrow.PythonFile(sink, mode="w")
+    writer = pyarrow.parquet.ParquetWriter(output, schema) if fmt == "parquet" else pyarrow.ipc.new_stream(output, schema)
+    try:
+        async for chunk in chunks:
+            arrays = [
+                pyarrow.array([_coerce(row.get(name), column_type) for row in chunk], type=schema.field(name).type)
+                for name, column_type in columns.items()
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_table(db, study_id: str, table: str, fmt: str = "csv", columns: Optional[Sequence[str]] = None,
+                 chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Stream one study table in ``fmt``.
+
+    Raises ``ValueError`` for unknown tables, formats or columns, and for
+    binary formats when ``pyarrow`` is not installed.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table {table!r} (available: {', '.join(EXPORT_TABLES)})")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (available: {', '.join(EXPORT_FORMATS)})")
+    if fmt != "csv" and pyarrow is None:
+        raise ValueError(f"{fmt} exports need the pyarrow package; use format=csv")
+    selected = select_columns(table, columns)
+    chunks = EXPORT_TABLES[table][1](db, study_id, chunk_size)
+    if fmt == "csv":
+        return _encode_csv(chunks, selected)
+    return _encode_arrow(chunks, selected, fmt)
+
+
+async def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Export one table of a study for analysis.")
+    parser.add_argument("study_id")
+    parser.add_argument("table", choices=list(EXPORT_TABLES))
+    parser.add_argument("--format", dest="fmt", choices=list(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--columns", help="comma-separated columns to export, in order")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--db-name", default=os.getenv("DB_NAME", "preclinical_research"))
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    try:
+        columns = args.columns.split(",") if args.columns else None
+        try:
+            stream = export_table(client[args.db_name], args.study_id, args.table, args.fmt, columns)
+        except ValueError as e:
+            parser.error(str(e))
+        output = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            async for data in stream:
+                output.write(data)
+        finally:
+            if args.output:
+                output.close()
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+"""What-if cost forecasts for a study, evaluated as one batched NumPy computation.
+
+A study's cost is ``sum over visits of (animals in the visit's cohorts) x
+(per-animal cost of the visit's procedures)``. ``StudyMatrix`` loads the
+study once as matrices:
+
+* ``visit_cohorts`` (visits x cohorts): 1 where the visit includes a cohort;
+* ``visit_procedures`` (visits x procedures): assignment counts;
+* ``actual_animals`` / ``planned_animals`` (cohorts): ``animal_ids`` size and
+  ``planned_animal_count``;
+* ``costs`` (procedures): per-animal cost, converted once into the
+  forecast currency with the FX rates of the requested date.
+
+Each scenario becomes one row of a scenarios x cohorts animal matrix and a
+scenarios x procedures cost matrix. Visits added by any scenario are
+appended as extra matrix rows and masked out of the other scenarios. All
+scenarios are then priced with a handful of matrix products, whatever their
+number.
+
+Scenario fields (all optional):
+
+* ``animal_basis``: ``actual`` (default) or ``planned`` cohort sizes;
+* ``cohort_sizes``: ``{cohort_id: animals}``;
+* ``cost_overrides``: ``{study_procedure_id: per-animal cost}`` in the
+  forecast currency;
+* ``cost_multipliers``: ``{study_procedure_id: factor}``, e.g. ``1.15``;
+* ``category_multipliers``: ``{category: factor}``;
+* ``added_visits``: ``[{name, study_procedure_ids, cohort_ids, count}]``.
+  Cohorts default to all of the study's cohorts.
+"""
+
+import asyncio
+import math
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from cost_engine import load_procedure_costs, per_animal_cost
+from fx import RateTable, currency_code
+
+MAX_SCENARIOS = 500
+MAX_ADDED_VISITS = 1000
+ANIMAL_BASES = ("actual", "planned")
+
+
+@dataclass
+class StudyMatrix:
+    visit_ids: List[str]
+    visit_names: List[str]
+    cohort_ids: List[str]
+    procedure_ids: List[str]
+    procedure_names: List[str]
+    categories: List[str]
+    visit_cohorts: np.ndarray
+    visit_procedures: np.ndarray
+    actual_animals: np.ndarray
+    planned_animals: np.ndarray
+    costs: np.ndarray
+    currency: str
+    # procedures x categories one-hot
+    procedure_categories: np.ndarray
+
+
+def _index(ids: Sequence[str]) -> Dict[str, int]:
+    return {item_id: position for position, item_id in enumerate(ids)}
+
+
+async def load_study_matrix(db, study_id: str, rates: RateTable, currency: Optional[str] = None,
+                            on: Optional[date] = None) -> StudyMatrix:
+    """Load a study's visits, cohorts and procedures into matrices with four queries.
+
+    Raises ``ValueError`` when a procedure currency has no rate effective on ``on``.
+    """
+    visits, cohorts, procedures = await asyncio.gather(
+        db.visits.find({"study_id": study_id}, {"_id": 0, "id": 1, "name": 1, "cohort_ids": 1}).sort(
+            [("planned_date", 1), ("created_at", 1), ("id", 1)]).to_list(None),
+        db.cohorts.find({"study_id": study_id}, {"_id": 0, "id": 1, "planned_animal_count": 1, "animal_ids": 1}).sort(
+            [("created_at", 1), ("id", 1)]).to_list(None),
+        load_procedure_costs(db, {"study_id": study_id}, {"name": 1, "category": 1, "imported_at": 1}),
+    )
+    procedures.sort(key=lambda procedure: (procedure['imported_at'], procedure['id']))
+    currency = currency_code(currency or rates.base)
+    factors = rates.factors([currency_code(procedure.get('currency')) for procedure in procedures],
+                            currency, on or date.today())
+    assignments = await db.visit_procedures.find(
+        {"visit_id": {"$in": [visit['id'] for visit in visits]}}, {"_id": 0, "visit_id": 1, "study_procedure_id": 1}
+    ).to_list(None)
+
+    cohort_index = _index([cohort['id'] for cohort in cohorts])
+    procedure_index = _index([procedure['id'] for procedure in procedures])
+    visit_index = _index([visit['id'] for visit in visits])
+    categories = sorted({str(procedure['category']) for procedure in procedures})
+    category_index = _index(categories)
+
+    visit_cohorts = np.zeros((len(visits), len(cohorts)))
+    for row, visit in enumerate(visits):
+        for cohort_id in visit.get('cohort_ids', []):
+            if cohort_id in cohort_index:
+                visit_cohorts[row, cohort_index[cohort_id]] = 1
+    visit_procedures = np.zeros((len(visits), len(procedures)))
+    for assignment in assignments:
+        if assignment['study_procedure_id'] in procedure_index:
+            visit_procedures[visit_index[assignment['visit_id']], procedure_index[assignment['study_procedure_id']]] += 1
+    procedure_categories = np.zeros((len(procedures), len(categories)))
+    for row, procedure in enumerate(procedures):
+        procedure_categories[row, category_index[str(procedure['category'])]] = 1
+
+    return StudyMatrix(
+        visit_ids=[visit['id'] for visit in visits],
+        visit_names=[visit.get('name') for visit in visits],
+        cohort_ids=list(cohort_index),
+        procedure_ids=list(procedure_index),
+        procedure_names=[procedure.get('name') for procedure in procedures],
+        categories=categories,
+        visit_cohorts=visit_cohorts,
+        visit_procedures=visit_procedures,
+        actual_animals=np.array([len(cohort.get('animal_ids', [])) for cohort in cohorts], dtype=float),
+        planned_animals=np.array([cohort.get('planned_animal_count') or 0 for cohort in cohorts], dtype=float),
+        costs=np.array([per_animal_cost(procedure) * factors[currency_code(procedure.get('currency'))]
+                        for procedure in procedures], dtype=float),
+        currency=currency,
+        procedure_categories=procedure_categories,
+    )
+
+
+def _lookup(index: Dict[str, int], key: str, kind: str, scenario: str) -> int:
+    if key not in index:
+        raise ValueError(f"Scenario {scenario!r}: {kind} {key} is not part of this study")
+    return index[key]
+
+
+def _amount(value: float, kind: str, key: str, scenario: str) -> float:
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"Scenario {scenario!r}: {kind} for {key} must be a finite number of at least 0")
+    return value
+
+
+def evaluate_scenarios(matrix: StudyMatrix, scenarios: Sequence[Dict[str, Any]],
+                       include_visits: bool = True) -> List[Dict[str, Any]]:
+    """Price every scenario; the first result is always the unchanged ``baseline``.
+
+    Raises ``ValueError`` for ids outside the study or invalid scenario values.
+    """
+    scenarios = [{"name": "baseline"}, *scenarios]
+    if len(scenarios) > MAX_SCENARIOS + 1:
+        raise ValueError(f"At most {MAX_SCENARIOS} scenarios can be evaluated at once")
+    cohort_index = _index(matrix.cohort_ids)
+    procedure_index = _index(matrix.procedure_ids)
+    category_index = _index(matrix.categories)
+    scenario_count = len(scenarios)
+
+    # Checked before expanding, so a huge count is rejected without building its rows
+    added_visits = sum(visit.get('count') or 1 for scenario in scenarios for visit in scenario.get('added_visits') or [])
+    if added_visits > MAX_ADDED_VISITS:
+        raise ValueError(f"Scenarios add more than {MAX_ADDED_VISITS} visits")
+
+    # Visits added by any scenario become extra rows, enabled only for that scenario
+    added_cohorts, added_procedures, added_names, added_owner = [], [], [], []
+    for position, scenario in enumerate(scenarios):
+        for visit in scenario.get('added_visits') or []:
+            cohorts_row = np.zeros(len(cohort_index))
+            if visit.get('cohort_ids') is None:
+                cohorts_row[:] = 1
+            for cohort_id in visit.get('cohort_ids') or []:
+                cohorts_row[_lookup(cohort_index, cohort_id, "cohort", scenario['name'])] = 1
+            procedures_row = np.zeros(len(procedure_index))
+            for procedure_id in visit.get('study_procedure_ids') or []:
+                procedures_row[_lookup(procedure_index, procedure_id, "study procedure", scenario['name'])] += 1
+            for occurrence in range(visit.get('count') or 1):
+                added_cohorts.append(cohorts_row)
+                added_procedures.append(procedures_row)
+                added_names.append(visit['name'] if (visit.get('count') or 1) == 1 else f"{visit['name']} {occurrence + 1}")
+                added_owner.append(position)
+
+    base_visits = len(matrix.visit_ids)
+    visit_cohorts = np.vstack([matrix.visit_cohorts, *added_cohorts]) if added_cohorts else matrix.visit_cohorts
+    visit_procedures = np.vstack([matrix.visit_procedures, *added_procedures]) if added_procedures else matrix.visit_procedures
+    active = np.zeros((scenario_count, base_visits + len(added_owner)))
+    active[:, :base_visits] = 1
+    for offset, owner in enumerate(added_owner):
+        active[owner, base_visits + offset] = 1
+
+    animals = np.empty((scenario_count, len(cohort_index)))
+    costs = np.tile(matrix.costs, (scenario_count, 1))
+    for position, scenario in enumerate(scenarios):
+        name = scenario['name']
+        basis = scenario.get('animal_basis') or "actual"
+        if basis not in ANIMAL_BASES:
+            raise ValueError(f"Scenario {name!r}: animal_basis must be one of {', '.join(ANIMAL_BASES)}")
+        animals[position] = matrix.planned_animals if basis == "planned" else matrix.actual_animals
+        for cohort_id, size in (scenario.get('cohort_sizes') or {}).items():
+            animals[position, _lookup(cohort_index, cohort_id, "cohort", name)] = _amount(size, "cohort size", cohort_id, name)
+        for category, factor in (scenario.get('category_multipliers') or {}).items():
+            factor = _amount(factor, "multiplier", category, name)
+            costs[position] *= np.where(matrix.procedure_categories[:, _lookup(category_index, category, "category", name)] == 1,
+                                        factor, 1.0)
+        for procedure_id, factor in (scenario.get('cost_multipliers') or {}).items():
+            costs[position, _lookup(procedure_index, procedure_id, "study procedure", name)] *= _amount(
+                factor, "multiplier", procedure_id, name)
+        for procedure_id, cost in (scenario.get('cost_overrides') or {}).items():
+            costs[position, _lookup(procedure_index, procedure_id, "study procedure", name)] = _amount(
+                cost, "cost override", procedure_id, name)
+
+    # scenarios x visits: animals seen at each visit, zero for visits a scenario does not have
+    visit_animals = (animals @ visit_cohorts.T) * active
+    # scenarios x procedures: animal-procedure units, then their cost
+    procedure_units = visit_animals @ visit_procedures
+    procedure_costs = procedure_units * costs
+    category_costs = procedure_costs @ matrix.procedure_categories
+    visit_costs = visit_animals * (costs @ visit_procedures.T)
+    totals = procedure_costs.sum(axis=1)
+
+    visit_ids = matrix.visit_ids + [None] * len(added_owner)
+    visit_names = matrix.visit_names + added_names
+    results = []
+    for position, scenario in enumerate(scenarios):
+        result = {
+            "name": scenario['name'],
+            "total_cost": float(totals[position]),
+            "difference": float(totals[position] - totals[0]),
+            "currency": matrix.currency,
+            "total_animal_procedures": float(procedure_units[position].sum()),
+            "by_category": {category: float(category_costs[position, column])
+                            for column, category in enumerate(matrix.categories)},
+            "by_procedure": [
+                {"study_procedure_id": procedure_id, "name": matrix.procedure_names[column],
+                 "cost": float(procedure_costs[position, column])}
+                for column, procedure_id in enumerate(matrix.procedure_ids)
+            ],
+        }
+        if include_visits:
+            result["by_visit"] = [
+                {"visit_id": visit_ids[column], "visit_name": visit_names[column], "added": column >= base_visits,
+                 "animals": float(visit_animals[position, column]), "cost": float(visit_costs[position, column])}
+                for column in np.flatnonzero(active[position])
+            ]
+        results.append(result)
+    return results
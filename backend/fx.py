@@ -0,0 +1,143 @@
+"""Locally managed FX rates and currency conversion of cost totals.
+
+The ``fx_rates`` collection holds one document per currency and effective
+date:
+
+    {id, currency, rate, effective_date, created_at}
+
+``rate`` is the number of ``FX_BASE_CURRENCY`` units one unit of
+``currency`` is worth. A new rate takes effect on its ``effective_date``,
+and older rates stay in place so past dates keep converting as they did.
+
+Costs are summed per currency first (see ``cost_engine``). Converting a
+total then needs one rate lookup per currency rather than per procedure:
+``RateTable.factors`` resolves each currency once for a date and target, and
+``convert`` applies those factors in a single pass.
+
+Currency codes are upper-cased on the way in (``currency_code``). A cost
+response never fails for lack of a rate: ``converted_costs`` keeps the
+native per-currency totals, reports ``total_cost`` as null and names the
+currencies in ``missing_rates``.
+"""
+
+import os
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+FX_BASE_CURRENCY = os.getenv("FX_BASE_CURRENCY", "USD").upper()
+
+FX_RATES_COLLECTION = "fx_rates"
+
+
+def currency_code(currency: Optional[str]) -> str:
+    """The stored form of a currency: upper-case, ``FX_BASE_CURRENCY`` when unset."""
+    return (currency or FX_BASE_CURRENCY).strip().upper()
+
+
+class RateTable:
+    """All FX rates, indexed per currency by effective date."""
+
+    def __init__(self, rates: Iterable[Dict[str, Any]], base: str = FX_BASE_CURRENCY):
+        self.base = base
+        history: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+        for rate in rates:
+            history[currency_code(rate['currency'])].append((rate['effective_date'], rate['rate']))
+        self._dates: Dict[str, List[str]] = {}
+        self._rates: Dict[str, List[float]] = {}
+        for currency, entries in history.items():
+            entries.sort()
+            self._dates[currency] = [effective for effective, _ in entries]
+            self._rates[currency] = [rate for _, rate in entries]
+
+    @property
+    def currencies(self) -> List[str]:
+        return sorted({self.base, *self._dates})
+
+    def rate(self, currency: str, on: date) -> float:
+        """Base units per unit of ``currency`` on ``on``; raises ``ValueError`` without a rate."""
+        currency = currency_code(currency)
+        if currency == self.base:
+            return 1.0
+        position = bisect_right(self._dates.get(currency, []), on.isoformat())
+        if not position:
+            raise ValueError(f"No FX rate for {currency} effective on {on.isoformat()}")
+        return self._rates[currency][position - 1]
+
+    def factors(self, currencies: Iterable[str], target: str, on: date) -> Dict[str, float]:
+        """Multipliers converting each currency into ``target`` on ``on``."""
+        target_rate = self.rate(target, on)
+        return {currency: self.rate(currency, on) / target_rate for currency in set(currencies)}
+
+    def available_factors(self, currencies: Iterable[str], target: str,
+                          on: date) -> Tuple[Dict[str, float], List[str]]:
+        """Like ``factors``, but currencies without a rate are listed instead of raising.
+
+        When ``target`` itself has no rate, only amounts already in it convert.
+        """
+        target = currency_code(target)
+        try:
+            target_rate: Optional[float] = self.rate(target, on)
+        except ValueError:
+            target_rate = None
+        found: Dict[str, float] = {}
+        missing = set()
+        for currency in set(currencies):
+            if currency_code(currency) == target:
+                found[currency] = 1.0
+                continue
+            try:
+                rate = self.rate(currency, on)
+            except ValueError:
+                missing.add(currency_code(currency))
+                continue
+            if target_rate is None:
+                missing.add(target)
+            else:
+                found[currency] = rate / target_rate
+        return found, sorted(missing)
+
+
+def convert(amounts: Mapping[str, float], factors: Mapping[str, float]) -> float:
+    return sum(amount * factors[currency] for currency, amount in amounts.items())
+
+
+def convert_available(amounts: Mapping[str, float], factors: Mapping[str, float]) -> Optional[float]:
+    """``convert``, or None when an amount's currency has no factor."""
+    if any(currency not in factors for currency in amounts):
+        return None
+    return convert(amounts, factors)
+
+
+def add_amounts(total: Dict[str, float], amounts: Mapping[str, float]) -> Dict[str, float]:
+    for currency, amount in amounts.items():
+        currency = currency_code(currency)
+        total[currency] = total.get(currency, 0) + amount
+    return total
+
+
+async def load_rate_table(db, base: str = FX_BASE_CURRENCY) -> RateTable:
+    rates = await db[FX_RATES_COLLECTION].find({}, {"_id": 0, "currency": 1, "rate": 1, "effective_date": 1}).to_list(None)
+    return RateTable(rates, base)
+
+
+def converted_costs(costs_by_currency: Mapping[str, float], table: RateTable, target: Optional[str],
+                    on: Optional[date]) -> Dict[str, Any]:
+    """``total_cost`` in the target currency next to the native per-currency totals.
+
+    ``total_cost`` is None when a currency has no rate effective on ``on``;
+    those currencies are listed in ``missing_rates``.
+    """
+    target = currency_code(target or table.base)
+    on = on or date.today()
+    # Totals stored before codes were upper-cased may still hold "usd" next to "USD"
+    costs = add_amounts({}, costs_by_currency)
+    factors, missing = table.available_factors(costs, target, on)
+    return {
+        "total_cost": convert_available(costs, factors),
+        "currency": target,
+        "costs_by_currency": costs,
+        "missing_rates": missing,
+        "fx_date": on.isoformat(),
+    }
@@ -0,0 +1,178 @@
+"""Declared MongoDB indexes and their reconciliation.
+
+``INDEXES`` lists every index the API's query paths rely on. On startup
+``reconcile_indexes`` compares it with what exists in the database, builds
+anything missing, rebuilds indexes whose definition changed and drops the
+retired ones. ``index_report`` summarizes the declared indexes together with
+their ``$indexStats`` usage counters.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "master_procedures": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("is_active", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("path", ASCENDING)]),
+        IndexModel([("name", TEXT), ("category", TEXT), ("description", TEXT)],
+                   weights={"name": 10, "category": 5, "description": 1}, default_language="english", name="search_text"),
+    ],
+    "animals": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("animal_id", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+        # Identifiers and strains are short, so no stemming
+        IndexModel([("animal_id", TEXT), ("species", TEXT), ("strain", TEXT)],
+                   weights={"animal_id": 10, "species": 3, "strain": 3}, default_language="none", name="search_text"),
+    ],
+    "studies": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("name", TEXT), ("principal_investigator", TEXT)],
+                   weights={"name": 10, "principal_investigator": 5}, default_language="english", name="search_text"),
+    ],
+    "cohorts": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("study_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "visits": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("study_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("cohort_ids", ASCENDING)]),
+        IndexModel([("planned_date", ASCENDING), ("status", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("window_end_date", ASCENDING)]),
+    ],
+    "study_procedures": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("study_id", ASCENDING), ("imported_at", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "visit_procedures": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("visit_id", ASCENDING), ("assigned_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("visit_id", ASCENDING), ("sequence_order", ASCENDING)]),
+        IndexModel([("study_procedure_id", ASCENDING)]),
+    ],
+    "cost_rollups": [
+        IndexModel([("kind", ASCENDING), ("id", ASCENDING)], unique=True),
+        IndexModel([("kind", ASCENDING), ("study_id", ASCENDING), ("visit_created_at", ASCENDING)]),
+    ],
+    "status_checks": [
+        IndexModel([("timestamp", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "fx_rates": [
+        IndexModel([("currency", ASCENDING), ("effective_date", ASCENDING)], unique=True),
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "result_buckets": [
+        IndexModel([("visit_id", ASCENDING), ("study_procedure_id", ASCENDING), ("field", ASCENDING)], unique=True),
+        IndexModel([
+            ("study_id", ASCENDING), ("study_procedure_id", ASCENDING), ("field", ASCENDING), ("visit_date", ASCENDING)
+        ]),
+    ],
+}
+
+# Indexes created by earlier versions that a declared index now covers.
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    "status_checks": ["timestamp_1"],
+}
+
+# Options that make two indexes with the same name different.
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds", "weights", "default_language")
+
+
+def _definition(index: Dict[str, Any]) -> Dict[str, Any]:
+    key = list(index["key"].items())
+    definition: Dict[str, Any] = {"key": key}
+    if any(value == TEXT for _, value in key):
+        # The server lists a text index's fields as _fts/_ftsx and keeps the field names in weights
+        placeholders = ("_fts", "_ftsx")
+        weights = {name: 1 for name, value in key if value == TEXT and name not in placeholders}
+        weights.update(index.get("weights", {}))
+        definition["key"] = [(name, value) for name, value in key
+                             if value != TEXT and name not in placeholders] + [("_fts", TEXT), ("_ftsx", 1)]
+        definition["weights"] = weights
+        definition["default_language"] = index.get("default_language", "english")
+    for option in COMPARED_OPTIONS:
+        if option in index and option not in definition:
+            definition[option] = index[option]
+    if definition.get("unique") is False:
+        del definition["unique"]
+    return definition
+
+
+async def reconcile_collection(db, collection_name: str) -> Dict[str, List[str]]:
+    """Bring one collection's indexes in line with its declaration."""
+    collection = db[collection_name]
+    declared = {model.document["name"]: model for model in INDEXES.get(collection_name, [])}
+    existing = {index["name"]: index async for index in collection.list_indexes()}
+
+    dropped = []
+    for name in RETIRED_INDEXES.get(collection_name, []):
+        if name in existing and name not in declared:
+            await collection.drop_index(name)
+            dropped.append(name)
+
+    to_create = []
+    for name, model in declared.items():
+        current = existing.get(name)
+        if current is None:
+            to_create.append(model)
+        elif _definition(current) != _definition(model.document):
+            await collection.drop_index(name)
+            dropped.append(name)
+            to_create.append(model)
+
+    created = await collection.create_indexes(to_create) if to_create else []
+    return {"created": list(created), "dropped": dropped}
+
+
+async def reconcile_indexes(db) -> Dict[str, Dict[str, List[str]]]:
+    """Reconcile every declared collection, logging what changed."""
+    names = list(INDEXES)
+    results = await asyncio.gather(
+        *(reconcile_collection(db, name) for name in names),
+        return_exceptions=True
+    )
+
+    summary = {}
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            logger.error("Index reconciliation failed for %s: %s", name, result)
+            continue
+        summary[name] = result
+        if result["created"] or result["dropped"]:
+            logger.info("Indexes on %s: created %s, dropped %s", name, result["created"], result["dropped"])
+    return summary
+
+
+async def index_report(db) -> Dict[str, Any]:
+    """Return declared vs. existing indexes with their usage counters per collection."""
+    async def collection_report(collection_name: str) -> Dict[str, Any]:
+        collection = db[collection_name]
+        existing = [index["name"] async for index in collection.list_indexes()]
+        try:
+            stats = await collection.aggregate([{"$indexStats": {}}]).to_list(None)
+        except OperationFailure:
+            stats = []
+        usage = {
+            stat["name"]: {"ops": stat["accesses"]["ops"], "since": stat["accesses"]["since"]}
+            for stat in stats
+        }
+        declared = [model.document["name"] for model in INDEXES[collection_name]]
+        return {
+            "declared": declared,
+            "missing": [name for name in declared if name not in existing],
+            "undeclared": [name for name in existing if name not in declared and name != "_id_"],
+            "usage": usage,
+        }
+
+    names = list(INDEXES)
+    reports = await asyncio.gather(*(collection_report(name) for name in names))
+    return dict(zip(names, reports))
@@ -0,0 +1,229 @@
+"""Per-route request metrics and MongoDB command instrumentation.
+
+``MetricsMiddleware`` times every HTTP request and counts the bytes it sent.
+``CommandMetrics`` is a pymongo command listener: Motor runs commands on its
+executor threads with a copy of the request's context, so each command is
+charged to the request that issued it through the ``_request_stats`` context
+variable. Per request the middleware then records how many Mongo round trips
+were made and how many documents came back, which makes N+1 endpoints stand
+out. ``render_metrics`` returns everything in the Prometheus text format.
+
+Metrics are kept per worker process, as Prometheus expects when it scrapes
+each worker.
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# Commands that are part of connection management rather than request work
+IGNORED_COMMANDS = {"hello", "isMaster", "ismaster", "ping", "saslStart", "saslContinue", "endSessions"}
+
+_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [per-bucket counts, sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with _lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = ("le", _format_value(float(bound)))
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes", "Serialized response body size by route.", ("method", "route"), SIZE_BUCKETS)
+REQUEST_DB_COMMANDS = Histogram(
+    "http_request_db_commands", "MongoDB round trips issued per request.", ("method", "route"), COUNT_BUCKETS)
+REQUEST_DB_DOCUMENTS = Histogram(
+    "http_request_db_documents", "Documents returned by MongoDB per request.", ("method", "route"), COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_duration_seconds", "Time spent in MongoDB commands per request.", ("method", "route"))
+DB_COMMANDS = Counter(
+    "mongodb_commands_total", "MongoDB commands by name and outcome.", ("command", "outcome"))
+DB_COMMAND_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by name.", ("command",), DB_LATENCY_BUCKETS)
+
+REGISTRY = (
+    REQUESTS, REQUEST_LATENCY, RESPONSE_BYTES, REQUEST_DB_COMMANDS, REQUEST_DB_DOCUMENTS, REQUEST_DB_TIME,
+    DB_COMMANDS, DB_COMMAND_LATENCY,
+)
+
+
+class RequestStats:
+    """Mongo activity charged to one HTTP request."""
+
+    __slots__ = ("commands", "documents", "db_seconds")
+
+    def __init__(self):
+        self.commands = 0
+        self.documents = 0
+        self.db_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _returned_documents(reply) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        return len(batch) if batch is not None else 0
+    return 0
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Record every MongoDB command, charging it to the current request."""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def _record(self, event, outcome: str, documents: int = 0) -> None:
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        seconds = event.duration_micros / 1_000_000
+        DB_COMMANDS.inc(event.command_name, outcome)
+        DB_COMMAND_LATENCY.observe(seconds, event.command_name)
+        stats = _request_stats.get()
+        if stats is not None:
+            with _lock:
+                stats.commands += 1
+                stats.documents += documents
+                stats.db_seconds += seconds
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._record(event, "success", _returned_documents(event.reply))
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._record(event, "failure")
+
+
+command_metrics = CommandMetrics()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status, size and DB usage per route.
+
+    Routes are labelled with their path template (``/api/visits/{visit_id}``)
+    so label cardinality stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        body_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", "unmatched"))
+            REQUESTS.inc(*labels, str(status))
+            REQUEST_LATENCY.observe(elapsed, *labels)
+            RESPONSE_BYTES.observe(body_bytes, *labels)
+            REQUEST_DB_COMMANDS.observe(stats.commands, *labels)
+            REQUEST_DB_DOCUMENTS.observe(stats.documents, *labels)
+            REQUEST_DB_TIME.observe(stats.db_seconds, *labels)
+
+
+def render_metrics(registry: Iterable = REGISTRY) -> str:
+    lines: List[str] = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,115 @@
+"""Keyset pagination and NDJSON streaming for list endpoints.
+
+Pages are ordered by ``(sort_field, id)`` and continued with an opaque
+``after`` cursor, so every page is a bounded indexed range scan no matter how
+deep the client has paged. The cursor for the next page is returned in the
+``X-Next-Cursor`` response header. ``format=ndjson`` streams one JSON document
+per line straight from the Motor cursor instead of building the full list.
+
+JSON responses are always bounded: without ``limit`` they return the first
+``DEFAULT_PAGE_SIZE`` documents and a cursor when there are more. Clients
+reading a whole list follow the cursors (the frontend's ``fetchAllPages``
+does) or use NDJSON, which streams every matching document unless ``limit``
+is given.
+"""
+
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import orjson
+from fastapi import HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = min(int(os.getenv("DEFAULT_PAGE_SIZE", "100")), MAX_PAGE_SIZE)
+STREAM_BATCH_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams:
+    """Query parameters shared by every paginated list endpoint."""
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE,
+                                     description=f"Page size; JSON pages default to {DEFAULT_PAGE_SIZE}, "
+                                                 "NDJSON streams every document unless it is set"),
+        after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+        response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    ):
+        self.streaming = response_format == "ndjson"
+        self.limit = limit if limit is not None or self.streaming else DEFAULT_PAGE_SIZE
+        self.after = after
+
+
+def encode_cursor(doc: Dict[str, Any], sort_field: str) -> str:
+    value = doc.get(sort_field)
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    raw = json.dumps([value, doc['id']], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$date"])
+        return value, last_id
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def keyset_filter(filter_dict: Dict[str, Any], sort_field: str, after: Optional[str]) -> Dict[str, Any]:
+    """Restrict ``filter_dict`` to documents sorted after the cursor position."""
+    if not after:
+        return filter_dict
+    value, last_id = decode_cursor(after)
+    position = {"$or": [
+        {sort_field: {"$gt": value}},
+        {sort_field: value, "id": {"$gt": last_id}}
+    ]}
+    return {"$and": [filter_dict, position]} if filter_dict else position
+
+
+def _find(collection, filter_dict: Dict[str, Any], sort_field: str, page: PageParams):
+    return collection.find(
+        keyset_filter(filter_dict, sort_field, page.after),
+        {"_id": 0}
+    ).sort([(sort_field, 1), ("id", 1)])
+
+
+async def fetch_page(collection, filter_dict: Dict[str, Any], page: PageParams, response: Response,
+                     sort_field: str = "created_at") -> List[Dict[str, Any]]:
+    """Return one page of documents and set the next-page cursor header.
+
+    Without ``page.limit`` every matching document is loaded at once; request
+    pages always carry one.
+    """
+    cursor = _find(collection, filter_dict, sort_field, page)
+    if page.limit is None:
+        return await cursor.to_list(None)
+
+    docs = await cursor.limit(page.limit + 1).to_list(None)
+    if len(docs) > page.limit:
+        docs = docs[:page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1], sort_field)
+    return docs
+
+
+async def _ndjson_lines(cursor) -> AsyncIterator[bytes]:
+    async for doc in cursor:
+        yield orjson.dumps(doc, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def stream_ndjson(collection, filter_dict: Dict[str, Any], page: PageParams,
+                  sort_field: str = "created_at") -> StreamingResponse:
+    """Stream matching documents as newline-delimited JSON while the cursor yields them."""
+    cursor = _find(collection, filter_dict, sort_field, page).batch_size(STREAM_BATCH_SIZE)
+    if page.limit is not None:
+        cursor = cursor.limit(page.limit)
+    return StreamingResponse(_ndjson_lines(cursor), media_type="application/x-ndjson")
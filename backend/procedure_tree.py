@@ -0,0 +1,182 @@
+"""Master procedure hierarchy kept as materialized paths.
+
+Every master procedure stores ``path``, the ids of its ancestors from the
+root down, and ``depth`` (the length of ``path``). With a multikey index on
+``path``, a whole subtree is one indexed query: the root by ``id`` and its
+descendants by ``path``. The ancestor chain is one ``$in`` query on the ids
+in the procedure's own ``path``.
+
+Paths are maintained on create and on re-parenting. Moving a procedure
+rewrites the path of every descendant, so moves that would create a cycle
+are rejected. ``backfill_paths`` fills in paths for procedures stored before
+paths existed.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from fx import add_amounts, currency_code
+
+# Tree nodes leave out the input field definitions
+TREE_PROJECTION = {"_id": 0, "input_fields": 0}
+COST_PROJECTION = {"_id": 0, "id": 1, "name": 1, "path": 1, "default_cost": 1, "currency": 1}
+
+
+def _subtree_filter(root_id: str, active_only: bool = False) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"$or": [{"id": root_id}, {"path": root_id}]}
+    if active_only:
+        query["is_active"] = True
+    return query
+
+
+async def path_under(db, parent_id: Optional[str]) -> List[str]:
+    """The path of a new child of ``parent_id``; raises ``ValueError`` for an unknown parent."""
+    if not parent_id:
+        return []
+    parent = await db.master_procedures.find_one({"id": parent_id}, {"_id": 0, "id": 1, "path": 1})
+    if not parent:
+        raise ValueError(f"Parent procedure {parent_id} not found")
+    return [*parent.get('path', []), parent['id']]
+
+
+async def move_procedure(db, procedure_id: str, parent_id: Optional[str], now: datetime) -> bool:
+    """Re-parent a procedure and rewrite its descendants' paths; False if it does not exist.
+
+    Passing the current parent changes nothing, so an update that echoes the
+    stored ``parent_id`` back does not move the procedure. Raises
+    ``ValueError`` for an unknown parent or a move below its own subtree.
+    """
+    procedure = await db.master_procedures.find_one({"id": procedure_id}, {"_id": 0, "id": 1, "path": 1, "parent_id": 1})
+    if not procedure:
+        return False
+    if (procedure.get('parent_id') or None) == (parent_id or None):
+        return True
+    new_path = await path_under(db, parent_id)
+    if procedure_id in new_path or parent_id == procedure_id:
+        raise ValueError("A procedure cannot be moved below itself")
+
+    old_depth = len(procedure.get('path', []))
+    operations = [UpdateOne(
+        {"id": procedure_id},
+        {"$set": {"parent_id": parent_id or None, "path": new_path, "depth": len(new_path), "updated_at": now}}
+    )]
+    async for descendant in db.master_procedures.find({"path": procedure_id}, {"_id": 0, "id": 1, "path": 1}):
+        # Everything from the moved procedure down is kept; only the prefix above it changes
+        path = new_path + descendant['path'][old_depth:]
+        operations.append(UpdateOne(
+            {"id": descendant['id']}, {"$set": {"path": path, "depth": len(path), "updated_at": now}}
+        ))
+    await db.master_procedures.bulk_write(operations, ordered=False)
+    return True
+
+
+def build_tree(nodes: List[Dict[str, Any]], root_ids: List[str], max_depth: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Nest ``nodes`` under their parents, children ordered by name.
+
+    ``max_depth`` counts levels below the roots. Nodes whose parent is not
+    among ``nodes`` (e.g. below an archived procedure) are left out.
+    """
+    by_id = {node['id']: {**node, "children": []} for node in nodes}
+    for node in sorted(by_id.values(), key=lambda node: (node.get('name') or "", node['id'])):
+        parent = by_id.get(node.get('parent_id'))
+        if parent is not None and node['id'] not in root_ids:
+            parent['children'].append(node)
+
+    def trim(node: Dict[str, Any], level: int) -> Dict[str, Any]:
+        if max_depth is not None and level >= max_depth:
+            node['children'] = []
+        for child in node['children']:
+            trim(child, level + 1)
+        return node
+
+    roots = [by_id[root_id] for root_id in root_ids if root_id in by_id]
+    return [trim(root, 0) for root in sorted(roots, key=lambda node: (node.get('name') or "", node['id']))]
+
+
+async def load_subtree(db, root_id: str, max_depth: Optional[int] = None,
+                       active_only: bool = False) -> Optional[Dict[str, Any]]:
+    nodes = await db.master_procedures.find(_subtree_filter(root_id, active_only), TREE_PROJECTION).to_list(None)
+    trees = build_tree(nodes, [root_id], max_depth)
+    return trees[0] if trees else None
+
+
+async def load_forest(db, max_depth: Optional[int] = None, active_only: bool = False) -> List[Dict[str, Any]]:
+    query: Dict[str, Any] = {"is_active": True} if active_only else {}
+    if max_depth is not None:
+        query["depth"] = {"$lte": max_depth}
+    nodes = await db.master_procedures.find(query, TREE_PROJECTION).to_list(None)
+    return build_tree(nodes, [node['id'] for node in nodes if not node.get('path')], max_depth)
+
+
+async def load_ancestors(db, procedure_id: str) -> Optional[List[Dict[str, Any]]]:
+    """The procedure's ancestors from the root down, or None when it does not exist."""
+    procedure = await db.master_procedures.find_one({"id": procedure_id}, {"_id": 0, "path": 1})
+    if procedure is None:
+        return None
+    path = procedure.get('path', [])
+    if not path:
+        return []
+    ancestors = await db.master_procedures.find({"id": {"$in": path}}, TREE_PROJECTION).to_list(None)
+    order = {ancestor_id: position for position, ancestor_id in enumerate(path)}
+    return sorted(ancestors, key=lambda ancestor: order[ancestor['id']])
+
+
+async def subtree_cost_totals(db, root_id: str, active_only: bool = False) -> Optional[Dict[str, Any]]:
+    """Sum ``default_cost`` per currency over a subtree, overall and per direct child.
+
+    Returns None when the root does not exist.
+    """
+    nodes = await db.master_procedures.find(_subtree_filter(root_id, active_only), COST_PROJECTION).to_list(None)
+    root = next((node for node in nodes if node['id'] == root_id), None)
+    if root is None:
+        return None
+    child_depth = len(root.get('path', [])) + 1
+    children: Dict[str, Dict[str, Any]] = {}
+    totals: Dict[str, float] = {}
+    for node in nodes:
+        amount = {currency_code(node.get('currency')): node.get('default_cost') or 0}
+        add_amounts(totals, amount)
+        path = node.get('path', [])
+        if len(path) < child_depth:
+            continue  # the root itself
+        branch = node['id'] if len(path) == child_depth else path[child_depth]
+        child = children.setdefault(branch, {"procedure_id": branch, "name": None, "costs_by_currency": {},
+                                             "procedure_count": 0})
+        if node['id'] == branch:
+            child['name'] = node.get('name')
+        add_amounts(child['costs_by_currency'], amount)
+        child['procedure_count'] += 1
+    return {
+        "procedure_id": root_id,
+        "name": root.get('name'),
+        "costs_by_currency": totals,
+        "procedure_count": len(nodes),
+        "children": sorted(children.values(), key=lambda child: (child['name'] or "", child['procedure_id'])),
+    }
+
+
+async def backfill_paths(db) -> int:
+    """Compute paths for the whole library if any procedure lacks one; returns how many changed."""
+    if not await db.master_procedures.find_one({"path": {"$exists": False}}, {"_id": 1}):
+        return 0
+    procedures = await db.master_procedures.find({}, {"_id": 0, "id": 1, "parent_id": 1, "path": 1}).to_list(None)
+    parents = {procedure['id']: procedure.get('parent_id') for procedure in procedures}
+
+    def path_of(procedure_id: str) -> List[str]:
+        path: List[str] = []
+        parent_id = parents.get(procedure_id)
+        while parent_id and parent_id in parents and parent_id not in path and parent_id != procedure_id:
+            path.insert(0, parent_id)
+            parent_id = parents[parent_id]
+        return path
+
+    operations = []
+    for procedure in procedures:
+        path = path_of(procedure['id'])
+        if procedure.get('path') != path:
+            operations.append(UpdateOne({"id": procedure['id']}, {"$set": {"path": path, "depth": len(path)}}))
+    if operations:
+        await db.master_procedures.bulk_write(operations, ordered=False)
+    return len(operations)
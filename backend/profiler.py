@@ -0,0 +1,297 @@
+"""Request-scoped MongoDB query profiler for diagnosing slow endpoints.
+
+When profiling is on for a request, ``CommandProfiler`` captures every Mongo
+command it issues with its collection, filter, duration and documents
+returned. Before the response is sent, ``ProfilerMiddleware`` explains the
+distinct read commands (``queryPlanner`` verbosity) and summarizes the winning
+plan, e.g. ``IXSCAN visit_id_1_assigned_at_1_id_1 > FETCH`` or ``COLLSCAN``.
+The timings are returned in a ``Server-Timing`` header, and requests slower
+than ``PROFILE_SLOW_MS`` are written to ``PROFILE_TRACE_DIR`` as JSON traces.
+
+``PROFILE_REQUESTS`` selects the mode: ``off`` (the default), ``header`` to
+profile requests sent with ``X-Profile: 1``, or ``all``. Explaining adds a
+round trip per distinct query, so this is meant for staging, not production.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import monitoring
+
+from metrics import IGNORED_COMMANDS
+
+PROFILE_MODE = os.getenv("PROFILE_REQUESTS", "off").lower()
+PROFILE_HEADER = "x-profile"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_TRACE_DIR = os.getenv("PROFILE_TRACE_DIR", "traces")
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+EXPLAIN_LIMIT = 20
+SERVER_TIMING_LIMIT = 25
+FILTER_PREVIEW_CHARS = 500
+
+# Command fields that belong to the session or driver, not to the query itself
+_DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTrace:
+    """The Mongo commands issued by one profiled request."""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.commands: List[Dict[str, Any]] = []
+        self._pending: Dict[int, Dict[str, Any]] = {}
+
+    def db_ms(self) -> float:
+        return sum(command['duration_ms'] for command in self.commands if 'duration_ms' in command)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def _query_filter(command_name: str, command: Dict[str, Any]) -> Any:
+    if command_name in ("find", "delete", "update"):
+        if command_name == "find":
+            return command.get("filter", {})
+        statements = command.get("deletes" if command_name == "delete" else "updates") or [{}]
+        return statements[0].get("q", {})
+    if command_name in ("count", "distinct"):
+        return command.get("query", {})
+    if command_name == "aggregate":
+        return command.get("pipeline", [])
+    if command_name == "findAndModify":
+        return command.get("query", {})
+    return None
+
+
+def _preview(value: Any) -> Any:
+    text = json.dumps(value, default=str)
+    return value if len(text) <= FILTER_PREVIEW_CHARS else text[:FILTER_PREVIEW_CHARS] + "..."
+
+
+def _returned_documents(reply: Dict[str, Any]) -> Optional[int]:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        return len(batch) if batch is not None else None
+    if "n" in reply:
+        return reply["n"]
+    return None
+
+
+class CommandProfiler(monitoring.CommandListener):
+    """Capture the commands of the request being profiled, if any."""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        trace = _current_trace.get()
+        if trace is None or event.command_name in IGNORED_COMMANDS:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        entry = {
+            "command": event.command_name,
+            "collection": collection if isinstance(collection, str) else None,
+            "filter": _preview(_query_filter(event.command_name, command)),
+            # Kept for explain(); dropped from the trace output
+            "_command": {key: value for key, value in command.items()
+                         if not key.startswith("$") and key not in _DRIVER_FIELDS},
+        }
+        trace._pending[event.request_id] = entry
+        trace.commands.append(entry)
+
+    def _finish(self, event, **fields) -> None:
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        entry = trace._pending.pop(event.request_id, None)
+        if entry is not None:
+            entry["duration_ms"] = round(event.duration_micros / 1000, 3)
+            entry.update(fields)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, documents=_returned_documents(event.reply))
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, error=str(event.failure.get("errmsg", event.failure)))
+
+
+command_profiler = CommandProfiler()
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """Flatten a winning plan into ``STAGE [index]`` steps, innermost first."""
+    stages: List[str] = []
+    for child_key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(child_key), dict):
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    stage = plan.get("stage")
+    if stage:
+        stages.append(f"{stage} {plan['indexName']}" if plan.get("indexName") else stage)
+    return stages
+
+
+def _find_winning_plan(explain: Any) -> Optional[Dict[str, Any]]:
+    if isinstance(explain, dict):
+        if isinstance(explain.get("winningPlan"), dict):
+            return explain["winningPlan"]
+        values = explain.values()
+    elif isinstance(explain, list):
+        values = explain
+    else:
+        return None
+    for value in values:
+        plan = _find_winning_plan(value)
+        if plan is not None:
+            return plan
+    return None
+
+
+def summarize_plan(explain: Dict[str, Any]) -> Dict[str, Any]:
+    plan = _find_winning_plan(explain)
+    if plan is None:
+        return {"plan": None, "collection_scan": None}
+    stages = _plan_stages(plan)
+    return {"plan": " > ".join(stages), "collection_scan": any(stage.startswith("COLLSCAN") for stage in stages)}
+
+
+async def explain_commands(db, trace: RequestTrace) -> None:
+    """Attach a plan summary to each distinct read command in ``trace``."""
+    token = _current_trace.set(None)  # the explains themselves are not part of the trace
+    try:
+        explained: Dict[str, Dict[str, Any]] = {}
+        for entry in trace.commands:
+            command = entry["_command"]
+            if entry["command"] not in EXPLAINABLE_COMMANDS:
+                continue
+            key = json.dumps(command, sort_keys=True, default=str)
+            if key not in explained:
+                if len(explained) >= EXPLAIN_LIMIT:
+                    break
+                try:
+                    result = await db.command({"explain": command, "verbosity": "queryPlanner"})
+                    explained[key] = summarize_plan(result)
+                except Exception as e:
+                    explained[key] = {"explain_error": str(e)}
+            entry.update(explained[key])
+    finally:
+        _current_trace.reset(token)
+
+
+def _token(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]", "_", value)
+
+
+def server_timing(trace: RequestTrace, total_ms: float) -> str:
+    metrics = [
+        f'total;dur={total_ms:.3f}',
+        f'db;dur={trace.db_ms():.3f};desc="{len(trace.commands)} commands"',
+    ]
+    for index, entry in enumerate(trace.commands[:SERVER_TIMING_LIMIT], start=1):
+        description = f"{entry['command']} {entry['collection'] or ''}".strip()
+        if entry.get("collection_scan"):
+            description += " COLLSCAN"
+        metrics.append(f'db{index}-{_token(entry["command"])};dur={entry.get("duration_ms", 0):.3f};desc="{description}"')
+    return ", ".join(metrics)
+
+
+def trace_document(trace: RequestTrace, status: int, total_ms: float) -> Dict[str, Any]:
+    return {
+        "id": trace.id,
+        "method": trace.method,
+        "path": trace.path,
+        "status": status,
+        "started_at": trace.started_at.isoformat(),
+        "duration_ms": round(total_ms, 3),
+        "db_ms": round(trace.db_ms(), 3),
+        "command_count": len(trace.commands),
+        "commands": [{key: value for key, value in entry.items() if key != "_command"} for entry in trace.commands],
+    }
+
+
+def write_trace(document: Dict[str, Any], directory: str = PROFILE_TRACE_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    slug = _token(document['path'].strip("/"))[:60] or "root"
+    path = os.path.join(directory, f"{stamp}-{document['method']}-{slug}-{document['id']}.json")
+    with open(path, "w") as handle:
+        json.dump(document, handle, indent=2, default=str)
+    return path
+
+
+class ProfilerMiddleware:
+    """Profile selected requests and report their Mongo commands.
+
+    The response start is held back until the body is complete so the
+    ``Server-Timing`` header can include the explain results. Streaming
+    responses are timed up to their first chunk and are not explained.
+    """
+
+    def __init__(self, app, get_db: Callable[[], Any], mode: str = PROFILE_MODE,
+                 slow_ms: float = PROFILE_SLOW_MS, trace_dir: str = PROFILE_TRACE_DIR):
+        self.app = app
+        self.get_db = get_db
+        self.mode = mode
+        self.slow_ms = slow_ms
+        self.trace_dir = trace_dir
+
+    def _enabled(self, scope) -> bool:
+        if self.mode == "all":
+            return True
+        if self.mode == "header":
+            headers = dict(scope.get("headers") or [])
+            return headers.get(PROFILE_HEADER.encode(), b"").strip() in (b"1", b"true", b"on")
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._enabled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        started = time.perf_counter()
+        start_message = None
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal start_message, status
+            if message["type"] == "http.response.start":
+                start_message = message
+                status = message["status"]
+                return
+            if start_message is not None:
+                if not message.get("more_body", False):
+                    await explain_commands(self.get_db(), trace)
+                total_ms = (time.perf_counter() - started) * 1000
+                headers = list(start_message.get("headers", []))
+                headers.append((b"server-timing", server_timing(trace, total_ms).encode("latin-1", "replace")))
+                await send({**start_message, "headers": headers})
+                start_message = None
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+
+        total_ms = (time.perf_counter() - started) * 1000
+        if total_ms >= self.slow_ms:
+            document = trace_document(trace, status, total_ms)
+            loop = asyncio.get_running_loop()
+            path = await loop.run_in_executor(None, write_trace, document, self.trace_dir)
+            logger.warning(f"Slow request {trace.method} {trace.path} took {total_ms:.0f} ms; trace written to {path}")
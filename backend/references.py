@@ -0,0 +1,42 @@
+"""Concurrent existence checks for referenced documents.
+
+Handlers describe every id they depend on as a ``Reference``; all of them are
+resolved with one ``$in`` query per reference, run concurrently, and the first
+missing id (in declaration order) is reported as a 404. Latency therefore no
+longer grows with the number of referenced ids.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Sequence
+
+from fastapi import HTTPException
+
+
+@dataclass
+class Reference:
+    collection: str
+    ids: Sequence[str]
+    not_found: str  # 404 detail, may use {id}
+    filter: Dict[str, Any] = field(default_factory=dict)
+    projection: Dict[str, Any] = field(default_factory=lambda: {"_id": 0, "id": 1})
+
+
+async def _fetch(db, reference: Reference) -> Dict[str, Dict[str, Any]]:
+    ids = list(dict.fromkeys(reference.ids))
+    if not ids:
+        return {}
+    query = {"id": ids[0]} if len(ids) == 1 else {"id": {"$in": ids}}
+    query.update(reference.filter)
+    docs = await db[reference.collection].find(query, {**reference.projection, "id": 1}).to_list(None)
+    return {doc['id']: doc for doc in docs}
+
+
+async def resolve_references(db, *references: Reference) -> List[Dict[str, Dict[str, Any]]]:
+    """Return the referenced documents keyed by id for each reference, or raise 404."""
+    found = await asyncio.gather(*(_fetch(db, reference) for reference in references))
+    for reference, docs in zip(references, found):
+        for ref_id in reference.ids:
+            if ref_id not in docs:
+                raise HTTPException(status_code=404, detail=reference.not_found.format(id=ref_id))
+    return list(found)
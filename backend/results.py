@@ -0,0 +1,115 @@
+"""Procedure result capture stored in per-visit field buckets.
+
+A whole visit's measurements for one study procedure are submitted at once
+and checked against the procedure's ``input_fields`` snapshot by its compiled
+validator (see ``validation``). Valid values go to ``result_buckets``, one
+document per study procedure field and visit:
+
+    {study_id, study_procedure_id, field, field_type, units, visit_id,
+     visit_date, values: {<animal id>: {value, recorded_at}}, updated_at}
+
+Every animal measured for that field at that visit sits in one document. A
+study's history of one field (body weight across a 13-week study, say) is
+therefore one index range scan over ``(study_id, study_procedure_id, field,
+visit_date)`` returning a document per visit, not per measurement.
+Resubmitting an animal overwrites its value, and submitting ``null`` clears
+it.
+"""
+
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+
+RESULTS_COLLECTION = "result_buckets"
+
+def bucket_operations(visit: Dict[str, Any], study_procedure: Dict[str, Any],
+                      rows: Sequence[Dict[str, Any]], now: datetime) -> List[UpdateOne]:
+    """One upsert per input field, setting or clearing each animal's value."""
+    visit_date = visit.get('actual_date') or visit.get('planned_date')
+    operations = []
+    for field in study_procedure.get('input_fields', []):
+        name = field['name']
+        set_values: Dict[str, Any] = {}
+        unset_values: Dict[str, str] = {}
+        for row in rows:
+            if name not in row['values']:
+                continue
+            path = f"values.{row['animal_id']}"
+            value = row['values'][name]
+            if value is None:
+                unset_values[path] = ""
+            else:
+                set_values[path] = {"value": value, "recorded_at": row.get('recorded_at') or now}
+        if not set_values and not unset_values:
+            continue
+        update: Dict[str, Any] = {
+            "$set": {**set_values, "visit_date": visit_date, "updated_at": now},
+            "$setOnInsert": {
+                "study_id": study_procedure['study_id'],
+                "field_type": field['field_type'],
+                "units": field.get('units'),
+            },
+        }
+        if unset_values:
+            update["$unset"] = unset_values
+        operations.append(UpdateOne(
+            {"visit_id": visit['id'], "study_procedure_id": study_procedure['id'], "field": name},
+            update,
+            upsert=True
+        ))
+    return operations
+
+
+async def store_results(db, visit: Dict[str, Any], study_procedure: Dict[str, Any],
+                        rows: Sequence[Dict[str, Any]]) -> None:
+    operations = bucket_operations(visit, study_procedure, rows, datetime.utcnow())
+    if operations:
+        await db[RESULTS_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def visit_results(db, visit_id: str, study_procedure_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Return one row per animal and study procedure with all recorded field values."""
+    query: Dict[str, Any] = {"visit_id": visit_id}
+    if study_procedure_id:
+        query["study_procedure_id"] = study_procedure_id
+    buckets = await db[RESULTS_COLLECTION].find(
+        query, {"_id": 0, "study_procedure_id": 1, "field": 1, "values": 1}
+    ).to_list(None)
+
+    rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for bucket in buckets:
+        for animal_id, measurement in bucket.get('values', {}).items():
+            key = (bucket['study_procedure_id'], animal_id)
+            row = rows.setdefault(key, {
+                "animal_id": animal_id, "study_procedure_id": bucket['study_procedure_id'], "values": {}
+            })
+            row['values'][bucket['field']] = measurement['value']
+    return sorted(rows.values(), key=lambda row: (row['study_procedure_id'], row['animal_id']))
+
+
+async def field_history(db, study_id: str, study_procedure_id: str, field: str,
+                        date_from: Optional[date] = None, date_to: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Return every measurement of one field across a study's visits, oldest visit first."""
+    query: Dict[str, Any] = {"study_id": study_id, "study_procedure_id": study_procedure_id, "field": field}
+    if date_from or date_to:
+        query["visit_date"] = {}
+        if date_from:
+            query["visit_date"]["$gte"] = date_from.isoformat()
+        if date_to:
+            query["visit_date"]["$lte"] = date_to.isoformat()
+    buckets = db[RESULTS_COLLECTION].find(
+        query, {"_id": 0, "visit_id": 1, "visit_date": 1, "values": 1}
+    ).sort([("visit_date", 1), ("visit_id", 1)])
+
+    measurements = []
+    async for bucket in buckets:
+        for animal_id, measurement in sorted(bucket.get('values', {}).items()):
+            measurements.append({
+                "visit_id": bucket['visit_id'],
+                "visit_date": bucket.get('visit_date'),
+                "animal_id": animal_id,
+                "value": measurement['value'],
+                "recorded_at": measurement['recorded_at'],
+            })
+    return measurements
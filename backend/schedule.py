@@ -0,0 +1,159 @@
+"""Timepoint parsing and schedule expansion for study visits.
+
+``planned_timepoint`` is free text such as ``"Day 7 +/- 1 day"``. Parsed, it
+becomes a structured offset from the study start (Day 0 is ``start_date``)
+and an allowed window before and after the planned date. Visit templates,
+optionally repeating (e.g. weekly for 13 weeks), expand into the list of
+planned visits that the schedule endpoint inserts in bulk.
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+MAX_SCHEDULED_VISITS = 5000
+
+# Visit fields derived from the timepoint and planned date
+TIMEPOINT_FIELDS = (
+    "timepoint_offset_days", "window_before_days", "window_after_days", "window_start_date", "window_end_date",
+)
+
+_UNIT_DAYS = {"d": 1, "day": 1, "days": 1, "w": 7, "week": 7, "weeks": 7}
+_UNIT = r"(?:\s*(?P<unit>days?|d|weeks?|w))?"
+_TIMEPOINT = re.compile(r"^\s*(?P<unit>day|d|week|w)\s*(?P<value>[-+]?\d+)\s*(?P<window>.*?)\s*$", re.IGNORECASE)
+_SYMMETRIC_WINDOW = re.compile(r"^(?:\+/-|\+-|±)\s*(?P<amount>\d+)" + _UNIT + r"$", re.IGNORECASE)
+_ASYMMETRIC_WINDOW = re.compile(
+    r"^(?P<sign1>[+-])\s*(?P<first>\d+)\s*/\s*(?P<sign2>[+-])\s*(?P<second>\d+)" + _UNIT + r"$", re.IGNORECASE
+)
+_ONE_SIDED_WINDOW = re.compile(r"^(?P<sign>[+-])\s*(?P<amount>\d+)" + _UNIT + r"$", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class Timepoint:
+    offset_days: int
+    window_before_days: int = 0
+    window_after_days: int = 0
+
+    def describe(self) -> str:
+        """Canonical text for the timepoint, e.g. ``Day 14 +/- 1 day``."""
+        text = f"Day {self.offset_days}"
+        before, after = self.window_before_days, self.window_after_days
+        if before == after and before:
+            text += f" +/- {before} day{'s' if before != 1 else ''}"
+        elif before or after:
+            text += f" -{before}/+{after} days"
+        return text
+
+    def shifted(self, days: int) -> "Timepoint":
+        return Timepoint(self.offset_days + days, self.window_before_days, self.window_after_days)
+
+
+def _unit_days(unit: Optional[str]) -> int:
+    return _UNIT_DAYS[unit.lower()] if unit else 1
+
+
+def parse_timepoint(text: str) -> Timepoint:
+    """Parse ``Day 7``, ``Week 2``, ``Day 7 +/- 1 day``, ``Day 28 -2/+1 days``, ``Day 3 +1``...
+
+    Raises ``ValueError`` for text that does not describe a timepoint.
+    """
+    match = _TIMEPOINT.match(text or "")
+    if not match:
+        raise ValueError(f"Unrecognized timepoint: {text!r}")
+    offset = int(match.group("value")) * _unit_days(match.group("unit"))
+    window = match.group("window").strip().strip("()").strip()
+    if not window:
+        return Timepoint(offset)
+
+    symmetric = _SYMMETRIC_WINDOW.match(window)
+    if symmetric:
+        amount = int(symmetric.group("amount")) * _unit_days(symmetric.group("unit"))
+        return Timepoint(offset, amount, amount)
+
+    asymmetric = _ASYMMETRIC_WINDOW.match(window)
+    if asymmetric and asymmetric.group("sign1") != asymmetric.group("sign2"):
+        multiplier = _unit_days(asymmetric.group("unit"))
+        first = int(asymmetric.group("first")) * multiplier
+        second = int(asymmetric.group("second")) * multiplier
+        if asymmetric.group("sign1") == "-":
+            return Timepoint(offset, first, second)
+        return Timepoint(offset, second, first)
+
+    one_sided = _ONE_SIDED_WINDOW.match(window)
+    if one_sided:
+        amount = int(one_sided.group("amount")) * _unit_days(one_sided.group("unit"))
+        if one_sided.group("sign") == "-":
+            return Timepoint(offset, amount, 0)
+        return Timepoint(offset, 0, amount)
+
+    raise ValueError(f"Unrecognized timepoint window: {window!r}")
+
+
+def timepoint_fields(planned_timepoint: Optional[str], planned_date: Optional[date]) -> Dict[str, Any]:
+    """Structured visit fields for a timepoint; empty when the text does not parse.
+
+    Free-text timepoints stay allowed on single visits, they just carry no
+    offset or window.
+    """
+    try:
+        timepoint = parse_timepoint(planned_timepoint)
+    except ValueError:
+        return {}
+    fields: Dict[str, Any] = {
+        "timepoint_offset_days": timepoint.offset_days,
+        "window_before_days": timepoint.window_before_days,
+        "window_after_days": timepoint.window_after_days,
+    }
+    if planned_date:
+        fields["window_start_date"] = planned_date - timedelta(days=timepoint.window_before_days)
+        fields["window_end_date"] = planned_date + timedelta(days=timepoint.window_after_days)
+    return fields
+
+
+def _fill(text: Optional[str], occurrence: int, timepoint: Timepoint, repeated: bool) -> Optional[str]:
+    if text is None:
+        return None
+    filled = (text.replace("{n}", str(occurrence))
+              .replace("{day}", str(timepoint.offset_days))
+              .replace("{week}", str(timepoint.offset_days // 7)))
+    if repeated and filled == text:
+        filled = f"{text} {occurrence}"
+    return filled
+
+
+def expand_templates(templates: Sequence[Dict[str, Any]], start_date: date) -> List[Dict[str, Any]]:
+    """Expand visit templates into planned visits ordered by planned date.
+
+    Each template has ``name``, ``label``, ``planned_timepoint`` and optionally
+    ``description``, ``study_procedure_ids``, ``repeat_every_days`` and
+    ``repeat_count``. ``{n}``, ``{day}`` and ``{week}`` in the name and label
+    are replaced per occurrence; repeated visits without placeholders are
+    numbered. Raises ``ValueError`` for unparseable timepoints or schedules
+    larger than ``MAX_SCHEDULED_VISITS``.
+    """
+    planned: List[Dict[str, Any]] = []
+    for template in templates:
+        timepoint = parse_timepoint(template['planned_timepoint'])
+        repeat_count = template.get('repeat_count') or 1
+        every = template.get('repeat_every_days')
+        if repeat_count > 1 and not every:
+            raise ValueError(f"Template {template['name']!r} repeats without repeat_every_days")
+        if len(planned) + repeat_count > MAX_SCHEDULED_VISITS:
+            raise ValueError(f"Schedule exceeds {MAX_SCHEDULED_VISITS} visits")
+
+        repeated = repeat_count > 1
+        for index in range(repeat_count):
+            occurrence = timepoint.shifted(index * every) if repeated else timepoint
+            planned_date = start_date + timedelta(days=occurrence.offset_days)
+            planned.append({
+                "name": _fill(template['name'], index + 1, occurrence, repeated),
+                "label": _fill(template['label'], index + 1, occurrence, repeated),
+                "description": template.get('description'),
+                "planned_timepoint": occurrence.describe() if repeated else template['planned_timepoint'],
+                "planned_date": planned_date,
+                "study_procedure_ids": list(template.get('study_procedure_ids') or []),
+                **timepoint_fields(occurrence.describe(), planned_date),
+            })
+    planned.sort(key=lambda visit: visit['timepoint_offset_days'])
+    return planned
@@ -0,0 +1,147 @@
+"""Full-text search with facet counts over procedures, animals and studies.
+
+Every searchable collection has one text index (``search_text`` in
+``indexes``):
+
+* ``master_procedures``: name, category and description;
+* ``animals``: animal_id, species and strain;
+* ``studies``: name and principal_investigator.
+
+A search is a single aggregation per collection. ``$text`` matches and
+scores the documents through the text index, then one ``$facet`` stage
+returns the page of best-ranked documents, the number of matches and the
+value counts of every facet. Facet counts ignore the facet's own filter, so
+selecting ``species=Rat`` still shows how many mice match. When several
+kinds are searched, the collections are queried concurrently and their
+pages merged by text score.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+MAX_SEARCH_PAGE_SIZE = 100
+# Deepest result position a search can page to; each kind sorts at most this many matches
+MAX_SEARCH_WINDOW = 1000
+
+SCORE = {"$meta": "textScore"}
+
+
+@dataclass(frozen=True)
+class SearchTarget:
+    collection: str
+    facets: Tuple[str, ...]
+    projection: Dict[str, Any]
+    base_filter: Dict[str, Any] = field(default_factory=dict)
+
+
+SEARCH_TARGETS: Dict[str, SearchTarget] = {
+    "procedures": SearchTarget(
+        collection="master_procedures",
+        facets=("category",),
+        projection={"id": 1, "name": 1, "category": 1, "description": 1, "default_cost": 1, "currency": 1,
+                    "parent_id": 1},
+        base_filter={"is_active": True},
+    ),
+    "animals": SearchTarget(
+        collection="animals",
+        facets=("species", "sex"),
+        projection={"id": 1, "animal_id": 1, "species": 1, "strain": 1, "sex": 1, "birth_date": 1},
+        base_filter={"is_active": True},
+    ),
+    "studies": SearchTarget(
+        collection="studies",
+        facets=("status",),
+        projection={"id": 1, "name": 1, "principal_investigator": 1, "status": 1, "start_date": 1, "end_date": 1},
+    ),
+}
+
+FACETS = tuple(dict.fromkeys(facet for target in SEARCH_TARGETS.values() for facet in target.facets))
+
+
+def _text_match(query: str) -> Dict[str, Any]:
+    return {"$text": {"$search": query}}
+
+
+def search_pipeline(target: SearchTarget, query: str, filters: Mapping[str, str], window: int) -> List[Dict[str, Any]]:
+    """The aggregation returning ``{results, total, <facet>...}`` for one collection."""
+    def matching(skip: Optional[str] = None) -> List[Dict[str, Any]]:
+        conditions = {name: value for name, value in filters.items() if name != skip}
+        return [{"$match": conditions}] if conditions else []
+
+    facets: Dict[str, List[Dict[str, Any]]] = {
+        "results": matching() + [
+            {"$sort": {"score": -1, "id": 1}},
+            {"$limit": window},
+            {"$project": {"_id": 0, "score": 1, **target.projection}},
+        ],
+        "total": matching() + [{"$count": "count"}],
+    }
+    for name in target.facets:
+        facets[name] = matching(skip=name) + [{"$group": {"_id": f"${name}", "count": {"$sum": 1}}}]
+    return [
+        {"$match": {**_text_match(query), **target.base_filter}},
+        {"$addFields": {"score": SCORE}},
+        {"$facet": facets},
+    ]
+
+
+async def _search_kind(db, kind: str, query: str, filters: Mapping[str, str], window: int) -> Dict[str, Any]:
+    target = SEARCH_TARGETS[kind]
+    pipeline = search_pipeline(target, query, filters, window)
+    output = (await db[target.collection].aggregate(pipeline).to_list(None))[0]
+    return {
+        "kind": kind,
+        "results": [{"type": kind, **document} for document in output["results"]],
+        "total": output["total"][0]["count"] if output["total"] else 0,
+        "facets": {name: output[name] for name in target.facets},
+    }
+
+
+async def search(db, query: str, kinds: Optional[Sequence[str]] = None, filters: Optional[Mapping[str, str]] = None,
+                 page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+    """Ranked, paginated matches of ``query`` with facet counts.
+
+    Kinds that lack a filtered facet (e.g. procedures when filtering on
+    ``species``) cannot match and are skipped. Raises ``ValueError`` for
+    unknown kinds or facets and for pages past ``MAX_SEARCH_WINDOW``.
+    """
+    kinds = list(kinds or SEARCH_TARGETS)
+    filters = {name: value for name, value in (filters or {}).items() if value is not None}
+    unknown = [kind for kind in kinds if kind not in SEARCH_TARGETS]
+    if unknown:
+        raise ValueError(f"Unknown search type(s): {', '.join(unknown)}. Available: {', '.join(SEARCH_TARGETS)}")
+    unknown = [name for name in filters if name not in FACETS]
+    if unknown:
+        raise ValueError(f"Unknown facet(s): {', '.join(unknown)}. Available: {', '.join(FACETS)}")
+    window = page * page_size
+    if window > MAX_SEARCH_WINDOW:
+        raise ValueError(f"Search results are limited to the first {MAX_SEARCH_WINDOW} matches")
+
+    searched = [kind for kind in kinds if set(filters) <= set(SEARCH_TARGETS[kind].facets)]
+    outputs = await asyncio.gather(*(_search_kind(db, kind, query, filters, window) for kind in searched))
+
+    ranked = sorted((result for output in outputs for result in output["results"]),
+                    key=lambda result: (-result["score"], result["type"], result["id"]))
+    totals = {output["kind"]: output["total"] for output in outputs}
+    facets: Dict[str, Dict[Any, int]] = {}
+    for output in outputs:
+        for name, counts in output["facets"].items():
+            merged = facets.setdefault(name, {})
+            for bucket in counts:
+                if bucket["_id"] is not None:
+                    merged[bucket["_id"]] = merged.get(bucket["_id"], 0) + bucket["count"]
+    return {
+        "query": query,
+        "page": page,
+        "page_size": page_size,
+        "total": sum(totals.values()),
+        "totals_by_type": {kind: totals.get(kind, 0) for kind in kinds},
+        "results": ranked[window - page_size:window],
+        "facets": {
+            name: [{"value": value, "count": count}
+                   for value, count in sorted(facets.get(name, {}).items(), key=lambda item: (-item[1], str(item[0])))]
+            for name in FACETS
+            if any(name in SEARCH_TARGETS[kind].facets for kind in kinds)
+        },
+    }
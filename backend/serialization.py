@@ -0,0 +1,44 @@
+"""Fast paths between MongoDB documents, models and JSON.
+
+Documents written by this API are already validated on the way in, so read
+endpoints hand the stored documents (projected without ``_id``) straight to
+orjson instead of building a model per document and letting FastAPI validate
+the ``response_model`` again. Writes build their model once and encode it with
+``model_dump_json``.
+"""
+
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+NO_ID = {"_id": 0}
+
+
+def to_mongo(model: BaseModel) -> Dict[str, Any]:
+    """Dump a model for storage: dates become ISO strings, datetimes stay native."""
+    doc = model.model_dump()
+    for key, value in doc.items():
+        if isinstance(value, date) and not isinstance(value, datetime):
+            doc[key] = value.isoformat()
+    return doc
+
+
+def _with_headers(result: Response, response: Optional[Response]) -> Response:
+    # FastAPI only merges headers set on the injected ``response`` into
+    # responses it builds itself, so carry them over explicitly
+    if response is not None:
+        result.headers.update(response.headers)
+    return result
+
+
+def json_response(content: Any, response: Optional[Response] = None) -> ORJSONResponse:
+    """Encode trusted stored documents with orjson, skipping model validation."""
+    return _with_headers(ORJSONResponse(content), response)
+
+
+def model_response(model: BaseModel, response: Optional[Response] = None) -> Response:
+    """Encode a freshly built model once with ``model_dump_json``."""
+    return _with_headers(Response(content=model.model_dump_json(), media_type="application/json"), response)
@@ -1,25 +1,103 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
 import os
 import logging
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import Annotated, List, Optional, Dict, Any
 import uuid
 from datetime import datetime, date
 from bson import ObjectId
 from enum import Enum
+from pymongo import ReturnDocument, UpdateOne
+
+from cache import MISSING, TTLCache, VersionedCache
+from bulk_import import detect_format, import_rows, iter_rows
+from cost_rollups import (
+    get_study_rollup,
+    get_visit_rollup,
+    refresh_for_cohort,
+    refresh_for_master_procedure,
+    refresh_for_study_procedure,
+    refresh_visits,
+    study_cost_response,
+    visit_cost_response,
+)
+from etag import bump_collection_version, check_etag, collection_version, document_etag, make_etag
+from export import EXPORT_FORMATS, EXPORT_TABLES, export_table
+from forecast import MAX_ADDED_VISITS, evaluate_scenarios, load_study_matrix
+from fx import RateTable, convert_available, converted_costs, currency_code, load_rate_table
+from indexes import index_report, reconcile_indexes
+from metrics import PROMETHEUS_CONTENT_TYPE, MetricsMiddleware, command_metrics, render_metrics
+from profiler import ProfilerMiddleware, command_profiler
+from procedure_tree import (
+    backfill_paths,
+    load_ancestors,
+    load_forest,
+    load_subtree,
+    move_procedure,
+    path_under,
+    subtree_cost_totals,
+)
+from serialization import NO_ID, json_response, model_response, to_mongo
+from references import Reference, resolve_references
+from results import field_history, store_results, visit_results
+from search import MAX_SEARCH_PAGE_SIZE, search
+from schedule import MAX_SCHEDULED_VISITS, TIMEPOINT_FIELDS, expand_templates, timepoint_fields
+from pagination import NEXT_CURSOR_HEADER, PageParams, fetch_page, stream_ndjson
+from workspace import load_workspace, parse_fields, parse_include
+from worklist import load_worklist
+from validation import compile_validator, validator_cache, validator_for
+from visit_status import run_status_scheduler
 
 # MongoDB configuration
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "preclinical_research")
 
+# Dashboard counts are cached briefly per worker
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "10"))
+stats_cache = TTLCache(ttl=STATS_CACHE_TTL, maxsize=1)
+
+# The master procedure library is read far more often than it changes
+procedure_cache = VersionedCache(
+    "master_procedures",
+    ttl=float(os.getenv("PROCEDURE_CACHE_TTL", "300")),
+    maxsize=int(os.getenv("PROCEDURE_CACHE_SIZE", "4096")),
+    version_check_interval=float(os.getenv("PROCEDURE_CACHE_VERSION_CHECK", "1"))
+)
+
+# FX rates change rarely; the whole table is cached per worker
+fx_cache = VersionedCache(
+    "fx_rates",
+    ttl=float(os.getenv("FX_CACHE_TTL", "3600")),
+    maxsize=1,
+    version_check_interval=float(os.getenv("FX_CACHE_VERSION_CHECK", "5"))
+)
+
+# Longest date range a single worklist request may cover
+WORKLIST_MAX_DAYS = int(os.getenv("WORKLIST_MAX_DAYS", "93"))
+
 # MongoDB client (will be initialized on startup)
 client = None
 db = None
+index_task = None
+status_task = None
 
 # Create the main app without a prefix
-app = FastAPI(title="Preclinical Research Management API", version="2.0.0")
+app = FastAPI(
+    title="Preclinical Research Management API",
+    version="2.0.0",
+    default_response_class=ORJSONResponse
+)
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    # The default handler's json.dumps fails on the NaN or Infinity a client sent; orjson writes null
+    return ORJSONResponse(status_code=422, content={"detail": jsonable_encoder(exc.errors())})
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -79,6 +157,8 @@ class MasterProcedure(BaseModel):
     default_cost: float
     currency: str = "USD"
     parent_id: Optional[str] = None  # For hierarchical procedures
+    path: List[str] = []  # Ancestor ids, root first; maintained by procedure_tree
+    depth: int = 0
     input_fields: List[InputField] = []
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -89,7 +169,7 @@ class MasterProcedureCreate(BaseModel):
     category: ProcedureCategory
     description: str
     default_cost: float
-    currency: str = "USD"
+    currency: str = Field("USD", pattern="^[A-Za-z]{3}$")
     parent_id: Optional[str] = None
     input_fields: List[InputFieldCreate] = []
 
@@ -98,7 +178,8 @@ class MasterProcedureUpdate(BaseModel):
     category: Optional[ProcedureCategory] = None
     description: Optional[str] = None
     default_cost: Optional[float] = None
-    currency: Optional[str] = None
+    currency: Optional[str] = Field(None, pattern="^[A-Za-z]{3}$")
+    parent_id: Optional[str] = None  # null moves the procedure to the top level
     input_fields: Optional[List[InputFieldCreate]] = None
     is_active: Optional[bool] = None
 
@@ -164,6 +245,10 @@ class CohortUpdate(BaseModel):
     criteria: Optional[str] = None
     planned_animal_count: Optional[int] = None
 
+class CohortAnimalsBatch(BaseModel):
+    add: List[str] = []
+    remove: List[str] = []
+
 class StudyProcedure(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     study_id: str
@@ -172,6 +257,7 @@ class StudyProcedure(BaseModel):
     category: ProcedureCategory  # Snapshot from master
     description: str  # Snapshot from master
     study_specific_cost: Optional[float] = None  # Override cost
+    default_cost: Optional[float] = None  # Snapshot from master
     currency: str = "USD"
     input_fields: List[InputField] = []  # Snapshot from master
     imported_at: datetime = Field(default_factory=datetime.utcnow)
@@ -191,6 +277,12 @@ class Visit(BaseModel):
     actual_date: Optional[date] = None
     cohort_ids: List[str] = []
     status: VisitStatus = VisitStatus.SCHEDULED
+    # Parsed from planned_timepoint when it is structured
+    timepoint_offset_days: Optional[int] = None
+    window_before_days: Optional[int] = None
+    window_after_days: Optional[int] = None
+    window_start_date: Optional[date] = None
+    window_end_date: Optional[date] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -224,6 +316,67 @@ class VisitProcedureCreate(BaseModel):
     study_procedure_id: str
     sequence_order: Optional[int] = None
 
+class VisitTemplate(BaseModel):
+    name: str  # may use {n}, {day} and {week}
+    label: str
+    description: Optional[str] = None
+    planned_timepoint: str  # e.g., "Day 7 +/- 1 day"
+    study_procedure_ids: List[str] = []  # pre-assigned in this order
+    repeat_every_days: Optional[int] = Field(None, ge=1)
+    repeat_count: int = Field(1, ge=1)
+
+class ResultRow(BaseModel):
+    animal_id: str
+    values: Dict[str, Any]  # input field name -> value; null clears a stored value
+    recorded_at: Optional[datetime] = None
+
+class ResultSubmission(BaseModel):
+    study_procedure_id: str
+    rows: List[ResultRow]
+
+class FxRate(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    currency: str
+    rate: float  # FX_BASE_CURRENCY units per unit of currency
+    effective_date: date
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class FxRateCreate(BaseModel):
+    currency: str = Field(..., pattern="^[A-Za-z]{3}$")
+    rate: float = Field(..., gt=0)
+    effective_date: date
+
+class ForecastVisit(BaseModel):
+    name: str
+    study_procedure_ids: List[str] = []
+    cohort_ids: Optional[List[str]] = None  # None: all cohorts of the study
+    count: int = Field(1, ge=1, le=MAX_ADDED_VISITS)
+
+# Scenario values go straight into the forecast matrices, so they must be finite and not negative
+ForecastCount = Annotated[int, Field(ge=0)]
+ForecastAmount = Annotated[float, Field(ge=0, allow_inf_nan=False)]
+
+class ForecastScenario(BaseModel):
+    name: str
+    animal_basis: str = "actual"  # "actual" animal_ids or "planned" planned_animal_count
+    cohort_sizes: Dict[str, ForecastCount] = {}
+    cost_overrides: Dict[str, ForecastAmount] = {}
+    cost_multipliers: Dict[str, ForecastAmount] = {}
+    category_multipliers: Dict[str, ForecastAmount] = {}
+    added_visits: List[ForecastVisit] = []
+
+class ForecastRequest(BaseModel):
+    scenarios: List[ForecastScenario]
+    include_visits: bool = True
+    currency: Optional[str] = None  # Defaults to FX_BASE_CURRENCY; cost overrides are in this currency
+    as_of: Optional[date] = None
+
+class ScheduleCreate(BaseModel):
+    visits: List[VisitTemplate]
+    cohort_ids: Optional[List[str]] = None  # defaults to every cohort in the study
+    per_cohort: bool = False  # one visit per cohort instead of one visit for all of them
+    start_date: Optional[date] = None  # defaults to the study's start_date
+
 # Status Check Models (keeping existing functionality)
 class StatusCheck(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -245,6 +398,12 @@ def to_dict(item):
                 item[key] = value.isoformat()
     return item
 
+def check_validation_rules(input_fields: List[Dict[str, Any]]):
+    try:
+        compile_validator(input_fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # MASTER PROCEDURE LIBRARY ENDPOINTS
 
 @api_router.post("/master-procedures", response_model=MasterProcedure)
@@ -252,46 +411,96 @@ async def create_master_procedure(procedure: MasterProcedureCreate):
     """Create a new master procedure in the library."""
     # Convert input fields
     input_fields = [InputField(**field.dict()) for field in procedure.input_fields]
+    check_validation_rules([field.dict() for field in input_fields])
     
     procedure_dict = procedure.dict()
+    procedure_dict['currency'] = currency_code(procedure.currency)
     procedure_dict['input_fields'] = [field.dict() for field in input_fields]
+    try:
+        procedure_dict['path'] = await path_under(db, procedure.parent_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    procedure_dict['depth'] = len(procedure_dict['path'])
     procedure_obj = MasterProcedure(**procedure_dict)
     
-    await db.master_procedures.insert_one(procedure_obj.dict())
-    return procedure_obj
+    await db.master_procedures.insert_one(to_mongo(procedure_obj))
+    await procedure_cache.invalidate(db)
+    return model_response(procedure_obj)
 
 @api_router.get("/master-procedures", response_model=List[MasterProcedure])
-async def get_master_procedures(active_only: bool = Query(True)):
+async def get_master_procedures(request: Request, response: Response, active_only: bool = Query(True),
+                                page: PageParams = Depends()):
     """Get all master procedures from the library."""
     filter_dict = {"is_active": True} if active_only else {}
-    procedures = await db.master_procedures.find(filter_dict).to_list(1000)
-    return [MasterProcedure(**to_dict(proc)) for proc in procedures]
+    if page.streaming:
+        return stream_ndjson(db.master_procedures, filter_dict, page)
+    
+    version = await procedure_cache.current_version(db)
+    not_modified = check_etag(request, response, make_etag("master_procedures", version, active_only, page.limit, page.after))
+    if not_modified:
+        return not_modified
+    
+    if page.after:
+        return json_response(await fetch_page(db.master_procedures, filter_dict, page, response), response)
+    
+    # First pages are cached together with their next-page cursor
+    async def load_first_page():
+        page_response = Response()
+        procedures = await fetch_page(db.master_procedures, filter_dict, page, page_response)
+        return procedures, page_response.headers.get(NEXT_CURSOR_HEADER)
+    
+    procedures, next_cursor = await procedure_cache.get_or_load(db, ("list", active_only, page.limit), load_first_page)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return json_response(procedures, response)
+
+async def get_cached_master_procedure(procedure_id: str) -> Optional[MasterProcedure]:
+    async def load_procedure():
+        procedure = await db.master_procedures.find_one({"id": procedure_id}, NO_ID)
+        return MasterProcedure(**procedure) if procedure else None
+    
+    return await procedure_cache.get_or_load(db, ("id", procedure_id), load_procedure)
 
 @api_router.get("/master-procedures/{procedure_id}", response_model=MasterProcedure)
-async def get_master_procedure(procedure_id: str):
+async def get_master_procedure(procedure_id: str, request: Request, response: Response):
     """Get a specific master procedure by ID."""
-    procedure = await db.master_procedures.find_one({"id": procedure_id})
+    procedure = await get_cached_master_procedure(procedure_id)
     if not procedure:
         raise HTTPException(status_code=404, detail="Master procedure not found")
-    return MasterProcedure(**to_dict(procedure))
+    not_modified = check_etag(request, response, make_etag(procedure.id, procedure.updated_at))
+    if not_modified:
+        return not_modified
+    return model_response(procedure, response)
 
 @api_router.put("/master-procedures/{procedure_id}", response_model=MasterProcedure)
 async def update_master_procedure(procedure_id: str, update_data: MasterProcedureUpdate):
-    """Update a master procedure."""
-    procedure = await db.master_procedures.find_one({"id": procedure_id})
-    if not procedure:
-        raise HTTPException(status_code=404, detail="Master procedure not found")
-    
-    update_dict = {k: v for k, v in update_data.dict(exclude_unset=True).items() if v is not None}
+    """Update a master procedure; a parent_id other than its current one moves it, with its subtree."""
+    submitted = update_data.dict(exclude_unset=True)
+    update_dict = {k: v for k, v in submitted.items() if v is not None and k != 'parent_id'}
+    if 'currency' in update_dict:
+        update_dict['currency'] = currency_code(update_dict['currency'])
     if 'input_fields' in update_dict:
         update_dict['input_fields'] = [InputField(**field).dict() for field in update_dict['input_fields']]
+        check_validation_rules(update_dict['input_fields'])
     
     update_dict['updated_at'] = datetime.utcnow()
+    if 'parent_id' in submitted:
+        try:
+            moved = await move_procedure(db, procedure_id, submitted['parent_id'], update_dict['updated_at'])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not moved:
+            raise HTTPException(status_code=404, detail="Master procedure not found")
     
-    await db.master_procedures.update_one({"id": procedure_id}, {"$set": update_dict})
-    
-    updated_procedure = await db.master_procedures.find_one({"id": procedure_id})
-    return MasterProcedure(**to_dict(updated_procedure))
+    updated_procedure = await db.master_procedures.find_one_and_update(
+        {"id": procedure_id}, {"$set": update_dict}, projection=NO_ID, return_document=ReturnDocument.AFTER
+    )
+    if not updated_procedure:
+        raise HTTPException(status_code=404, detail="Master procedure not found")
+    await procedure_cache.invalidate(db)
+    if 'default_cost' in update_dict:
+        await refresh_for_master_procedure(db, procedure_id)
+    return json_response(updated_procedure)
 
 @api_router.delete("/master-procedures/{procedure_id}")
 async def delete_master_procedure(procedure_id: str):
@@ -302,75 +511,151 @@ async def delete_master_procedure(procedure_id: str):
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Master procedure not found")
+    await procedure_cache.invalidate(db)
     return {"message": "Master procedure archived successfully"}
 
+# PROCEDURE HIERARCHY ENDPOINTS
+
+@api_router.get("/procedure-tree")
+async def get_procedure_tree(
+    depth: Optional[int] = Query(None, ge=0, description="Levels below the top-level procedures to include"),
+    active_only: bool = Query(True)
+):
+    """Get the whole master procedure library as a tree."""
+    async def load_tree():
+        return await load_forest(db, depth, active_only)
+    
+    return json_response(await procedure_cache.get_or_load(db, ("tree", None, depth, active_only), load_tree))
+
+@api_router.get("/master-procedures/{procedure_id}/tree")
+async def get_procedure_subtree(
+    procedure_id: str,
+    depth: Optional[int] = Query(None, ge=0, description="Levels below the procedure to include"),
+    active_only: bool = Query(True)
+):
+    """Get a master procedure with its descendants nested as children."""
+    async def load_tree():
+        return await load_subtree(db, procedure_id, depth, active_only)
+    
+    tree = await procedure_cache.get_or_load(db, ("tree", procedure_id, depth, active_only), load_tree)
+    if tree is None:
+        raise HTTPException(status_code=404, detail="Master procedure not found")
+    return json_response(tree)
+
+@api_router.get("/master-procedures/{procedure_id}/ancestors")
+async def get_procedure_ancestors(procedure_id: str):
+    """Get the chain of parent procedures, from the top level down."""
+    ancestors = await load_ancestors(db, procedure_id)
+    if ancestors is None:
+        raise HTTPException(status_code=404, detail="Master procedure not found")
+    return json_response(ancestors)
+
+@api_router.get("/master-procedures/{procedure_id}/cost-rollup")
+async def get_procedure_cost_rollup(
+    procedure_id: str,
+    active_only: bool = Query(True),
+    currency: Optional[str] = Query(None, description="Currency to report the totals in (default FX_BASE_CURRENCY)"),
+    as_of: Optional[date] = Query(None, description="Date whose FX rates to use (default today)")
+):
+    """Sum the default costs of a procedure and its whole subtree, with a subtotal per direct child."""
+    totals, rates = await asyncio.gather(subtree_cost_totals(db, procedure_id, active_only), get_rate_table())
+    if totals is None:
+        raise HTTPException(status_code=404, detail="Master procedure not found")
+    rollup = {**totals, **converted_costs(totals['costs_by_currency'], rates, currency, as_of)}
+    factors, _ = rates.available_factors(rollup['costs_by_currency'], rollup['currency'],
+                                         date.fromisoformat(rollup['fx_date']))
+    for child in rollup['children']:
+        child['total_cost'] = convert_available(child['costs_by_currency'], factors)
+    return json_response(rollup)
+
 # ANIMAL ENDPOINTS
 
 @api_router.post("/animals", response_model=Animal)
 async def create_animal(animal: AnimalCreate):
     """Create a new animal."""
-    animal_dict = animal.dict()
-    # Convert date to string for MongoDB storage
-    if 'birth_date' in animal_dict and animal_dict['birth_date']:
-        animal_dict['birth_date'] = animal_dict['birth_date'].isoformat()
-    
-    animal_obj = Animal(**animal.dict())
-    animal_obj_dict = animal_obj.dict()
-    if 'birth_date' in animal_obj_dict and isinstance(animal_obj_dict['birth_date'], date):
-        animal_obj_dict['birth_date'] = animal_obj_dict['birth_date'].isoformat()
-    
-    await db.animals.insert_one(animal_obj_dict)
-    return animal_obj
+    # The input is already validated, so the stored model is built without revalidating
+    animal_obj = Animal.model_construct(**dict(animal))
+    await db.animals.insert_one(to_mongo(animal_obj))
+    await bump_collection_version(db, "animals")
+    return model_response(animal_obj)
+
+def animal_document(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate an imported row and build the animal document to store."""
+    return to_mongo(Animal.model_construct(**dict(AnimalCreate(**row))))
+
+@api_router.post("/animals/bulk")
+async def bulk_import_animals(
+    request: Request,
+    file_format: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson)$")
+):
+    """Import animals from a streamed CSV or NDJSON upload, reporting errors per row."""
+    fmt = detect_format(request, file_format)
+    return await import_rows(db.animals, iter_rows(request, fmt), animal_document,
+                             on_insert=lambda: bump_collection_version(db, "animals"))
 
 @api_router.get("/animals", response_model=List[Animal])
-async def get_animals():
+async def get_animals(request: Request, response: Response, page: PageParams = Depends()):
     """Get all animals."""
-    animals = await db.animals.find({"is_active": True}).to_list(1000)
-    return [Animal(**to_dict(animal)) for animal in animals]
+    if page.streaming:
+        return stream_ndjson(db.animals, {"is_active": True}, page)
+    version = await collection_version(db, "animals")
+    not_modified = check_etag(request, response, make_etag("animals", version, page.limit, page.after))
+    if not_modified:
+        return not_modified
+    animals = await fetch_page(db.animals, {"is_active": True}, page, response)
+    return json_response(animals, response)
 
 @api_router.get("/animals/{animal_id}", response_model=Animal)
 async def get_animal(animal_id: str):
     """Get a specific animal by ID."""
-    animal = await db.animals.find_one({"id": animal_id})
+    animal = await db.animals.find_one({"id": animal_id}, NO_ID)
     if not animal:
         raise HTTPException(status_code=404, detail="Animal not found")
-    return Animal(**to_dict(animal))
+    return json_response(animal)
 
 # STUDY ENDPOINTS
 
 @api_router.post("/studies", response_model=Study)
 async def create_study(study: StudyCreate):
     """Create a new study."""
-    study_dict = study.dict()
-    # Convert dates to strings for MongoDB storage
-    if 'start_date' in study_dict and study_dict['start_date']:
-        study_dict['start_date'] = study_dict['start_date'].isoformat()
-    if 'end_date' in study_dict and study_dict['end_date']:
-        study_dict['end_date'] = study_dict['end_date'].isoformat()
-    
-    study_obj = Study(**study.dict())
-    study_obj_dict = study_obj.dict()
-    if 'start_date' in study_obj_dict and isinstance(study_obj_dict['start_date'], date):
-        study_obj_dict['start_date'] = study_obj_dict['start_date'].isoformat()
-    if 'end_date' in study_obj_dict and isinstance(study_obj_dict['end_date'], date):
-        study_obj_dict['end_date'] = study_obj_dict['end_date'].isoformat()
-    
-    await db.studies.insert_one(study_obj_dict)
-    return study_obj
+    study_obj = Study.model_construct(**dict(study))
+    await db.studies.insert_one(to_mongo(study_obj))
+    await bump_collection_version(db, "studies")
+    return model_response(study_obj)
 
 @api_router.get("/studies", response_model=List[Study])
-async def get_studies():
+async def get_studies(request: Request, response: Response, page: PageParams = Depends()):
     """Get all studies."""
-    studies = await db.studies.find().to_list(1000)
-    return [Study(**to_dict(study)) for study in studies]
+    if page.streaming:
+        return stream_ndjson(db.studies, {}, page)
+    version = await collection_version(db, "studies")
+    not_modified = check_etag(request, response, make_etag("studies", version, page.limit, page.after))
+    if not_modified:
+        return not_modified
+    studies = await fetch_page(db.studies, {}, page, response)
+    return json_response(studies, response)
 
 @api_router.get("/studies/{study_id}", response_model=Study)
-async def get_study(study_id: str):
+async def get_study(study_id: str, request: Request, response: Response):
     """Get a specific study by ID."""
-    study = await db.studies.find_one({"id": study_id})
+    study = await db.studies.find_one({"id": study_id}, NO_ID)
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
-    return Study(**to_dict(study))
+    not_modified = check_etag(request, response, document_etag(study))
+    if not_modified:
+        return not_modified
+    return json_response(study, response)
+
+@api_router.get("/studies/{study_id}/workspace")
+async def get_study_workspace(
+    study_id: str,
+    include: Optional[str] = Query(None, description="Comma-separated sections: cohorts, visits, procedures, visit_procedures, costs"),
+    fields: Optional[str] = Query(None, description="Comma-separated section.field projections, e.g. visits.name,cohorts.animal_ids")
+):
+    """Get a study with its cohorts, visits, procedures and costs in one response."""
+    include_sections = parse_include(include)
+    rates = await get_rate_table() if "costs" in include_sections else None
+    return json_response(await load_workspace(db, study_id, include_sections, parse_fields(fields), rates))
 
 # COHORT ENDPOINTS
 
@@ -382,50 +667,58 @@ async def create_cohort(cohort: CohortCreate):
     if not study:
         raise HTTPException(status_code=404, detail="Study not found")
     
-    cohort_obj = Cohort(**cohort.dict())
-    await db.cohorts.insert_one(cohort_obj.dict())
-    return cohort_obj
+    cohort_obj = Cohort.model_construct(**dict(cohort))
+    await db.cohorts.insert_one(to_mongo(cohort_obj))
+    await bump_collection_version(db, "cohorts")
+    return model_response(cohort_obj)
 
 @api_router.get("/studies/{study_id}/cohorts", response_model=List[Cohort])
-async def get_study_cohorts(study_id: str):
+async def get_study_cohorts(study_id: str, request: Request, response: Response, page: PageParams = Depends()):
     """Get all cohorts for a specific study."""
-    cohorts = await db.cohorts.find({"study_id": study_id}).to_list(1000)
-    return [Cohort(**to_dict(cohort)) for cohort in cohorts]
+    if page.streaming:
+        return stream_ndjson(db.cohorts, {"study_id": study_id}, page)
+    version = await collection_version(db, "cohorts")
+    not_modified = check_etag(request, response, make_etag("cohorts", study_id, version, page.limit, page.after))
+    if not_modified:
+        return not_modified
+    cohorts = await fetch_page(db.cohorts, {"study_id": study_id}, page, response)
+    return json_response(cohorts, response)
 
 @api_router.get("/cohorts/{cohort_id}", response_model=Cohort)
-async def get_cohort(cohort_id: str):
+async def get_cohort(cohort_id: str, request: Request, response: Response):
     """Get a specific cohort by ID."""
-    cohort = await db.cohorts.find_one({"id": cohort_id})
+    cohort = await db.cohorts.find_one({"id": cohort_id}, NO_ID)
     if not cohort:
         raise HTTPException(status_code=404, detail="Cohort not found")
-    return Cohort(**to_dict(cohort))
+    not_modified = check_etag(request, response, document_etag(cohort))
+    if not_modified:
+        return not_modified
+    return json_response(cohort, response)
 
 @api_router.put("/cohorts/{cohort_id}", response_model=Cohort)
 async def update_cohort(cohort_id: str, update_data: CohortUpdate):
     """Update a cohort."""
-    cohort = await db.cohorts.find_one({"id": cohort_id})
-    if not cohort:
-        raise HTTPException(status_code=404, detail="Cohort not found")
-    
     update_dict = {k: v for k, v in update_data.dict(exclude_unset=True).items() if v is not None}
     update_dict['updated_at'] = datetime.utcnow()
     
-    await db.cohorts.update_one({"id": cohort_id}, {"$set": update_dict})
-    
-    updated_cohort = await db.cohorts.find_one({"id": cohort_id})
-    return Cohort(**to_dict(updated_cohort))
+    updated_cohort = await db.cohorts.find_one_and_update(
+        {"id": cohort_id}, {"$set": update_dict}, projection=NO_ID, return_document=ReturnDocument.AFTER
+    )
+    if not updated_cohort:
+        raise HTTPException(status_code=404, detail="Cohort not found")
+    await bump_collection_version(db, "cohorts")
+    return json_response(updated_cohort)
 
 @api_router.post("/cohorts/{cohort_id}/animals/{animal_id}")
 async def assign_animal_to_cohort(cohort_id: str, animal_id: str):
     """Assign an animal to a cohort."""
     # Verify cohort and animal exist
-    cohort = await db.cohorts.find_one({"id": cohort_id})
-    if not cohort:
-        raise HTTPException(status_code=404, detail="Cohort not found")
-    
-    animal = await db.animals.find_one({"id": animal_id})
-    if not animal:
-        raise HTTPException(status_code=404, detail="Animal not found")
+    cohorts, _ = await resolve_references(
+        db,
+        Reference("cohorts", [cohort_id], "Cohort not found", projection={"_id": 0, "animal_ids": 1}),
+        Reference("animals", [animal_id], "Animal not found")
+    )
+    cohort = cohorts[cohort_id]
     
     # Check if animal is already assigned to this cohort
     if animal_id in cohort.get('animal_ids', []):
@@ -435,6 +728,8 @@ async def assign_animal_to_cohort(cohort_id: str, animal_id: str):
         {"id": cohort_id}, 
         {"$addToSet": {"animal_ids": animal_id}, "$set": {"updated_at": datetime.utcnow()}}
     )
+    await bump_collection_version(db, "cohorts")
+    await refresh_for_cohort(db, cohort_id)
     
     return {"message": "Animal assigned to cohort successfully"}
 
@@ -448,9 +743,46 @@ async def remove_animal_from_cohort(cohort_id: str, animal_id: str):
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cohort not found")
+    if result.modified_count:
+        await bump_collection_version(db, "cohorts")
+        await refresh_for_cohort(db, cohort_id)
     
     return {"message": "Animal removed from cohort successfully"}
 
+@api_router.post("/cohorts/{cohort_id}/animals", response_model=Cohort)
+async def update_cohort_animals(cohort_id: str, batch: CohortAnimalsBatch):
+    """Add and remove many animals in a cohort with a single write."""
+    overlap = set(batch.add) & set(batch.remove)
+    if overlap:
+        raise HTTPException(status_code=400, detail=f"Animals both added and removed: {sorted(overlap)}")
+    
+    # Verify cohort and animals exist
+    await resolve_references(
+        db,
+        Reference("cohorts", [cohort_id], "Cohort not found"),
+        Reference("animals", batch.add, "Animal {id} not found")
+    )
+    
+    now = datetime.utcnow()
+    operations = []
+    if batch.add:
+        operations.append(UpdateOne(
+            {"id": cohort_id},
+            {"$addToSet": {"animal_ids": {"$each": batch.add}}, "$set": {"updated_at": now}}
+        ))
+    if batch.remove:
+        operations.append(UpdateOne(
+            {"id": cohort_id},
+            {"$pullAll": {"animal_ids": batch.remove}, "$set": {"updated_at": now}}
+        ))
+    if operations:
+        await db.cohorts.bulk_write(operations)
+        await bump_collection_version(db, "cohorts")
+        await refresh_for_cohort(db, cohort_id)
+    
+    updated_cohort = await db.cohorts.find_one({"id": cohort_id}, NO_ID)
+    return json_response(updated_cohort)
+
 @api_router.delete("/cohorts/{cohort_id}")
 async def delete_cohort(cohort_id: str):
     """Delete an empty cohort."""
@@ -462,6 +794,7 @@ async def delete_cohort(cohort_id: str):
         raise HTTPException(status_code=400, detail="Cannot delete cohort with assigned animals")
     
     await db.cohorts.delete_one({"id": cohort_id})
+    await bump_collection_version(db, "cohorts")
     return {"message": "Cohort deleted successfully"}
 
 # STUDY PROCEDURE ENDPOINTS (Importing procedures into studies)
@@ -469,13 +802,11 @@ async def delete_cohort(cohort_id: str):
 @api_router.post("/studies/{study_id}/procedures", response_model=StudyProcedure)
 async def import_procedure_to_study(study_id: str, procedure_data: StudyProcedureCreate):
     """Import a master procedure into a study with optional cost override."""
-    # Verify study exists
-    study = await db.studies.find_one({"id": study_id})
-    if not study:
-        raise HTTPException(status_code=404, detail="Study not found")
-    
-    # Get master procedure
-    master_proc = await db.master_procedures.find_one({"id": procedure_data.master_procedure_id})
+    # Verify study exists and get master procedure
+    _, master_proc = await asyncio.gather(
+        resolve_references(db, Reference("studies", [study_id], "Study not found")),
+        get_cached_master_procedure(procedure_data.master_procedure_id)
+    )
     if not master_proc:
         raise HTTPException(status_code=404, detail="Master procedure not found")
     
@@ -483,75 +814,150 @@ async def import_procedure_to_study(study_id: str, procedure_data: StudyProcedur
     study_procedure = StudyProcedure(
         study_id=study_id,
         master_procedure_id=procedure_data.master_procedure_id,
-        name=master_proc['name'],
-        category=master_proc['category'],
-        description=master_proc['description'],
+        name=master_proc.name,
+        category=master_proc.category,
+        description=master_proc.description,
         study_specific_cost=procedure_data.study_specific_cost,
-        currency=master_proc['currency'],
-        input_fields=master_proc['input_fields']
+        default_cost=master_proc.default_cost,
+        currency=currency_code(master_proc.currency),
+        input_fields=master_proc.input_fields
     )
     
-    await db.study_procedures.insert_one(study_procedure.dict())
-    return study_procedure
+    await db.study_procedures.insert_one(to_mongo(study_procedure))
+    await bump_collection_version(db, "study_procedures")
+    await refresh_for_study_procedure(db, study_procedure.id)
+    return model_response(study_procedure)
 
 @api_router.get("/studies/{study_id}/procedures", response_model=List[StudyProcedure])
-async def get_study_procedures(study_id: str):
+async def get_study_procedures(study_id: str, request: Request, response: Response, page: PageParams = Depends()):
     """Get all procedures imported into a study."""
-    procedures = await db.study_procedures.find({"study_id": study_id}).to_list(1000)
-    return [StudyProcedure(**to_dict(proc)) for proc in procedures]
+    if page.streaming:
+        return stream_ndjson(db.study_procedures, {"study_id": study_id}, page, sort_field="imported_at")
+    version = await collection_version(db, "study_procedures")
+    not_modified = check_etag(request, response, make_etag("study_procedures", study_id, version, page.limit, page.after))
+    if not_modified:
+        return not_modified
+    procedures = await fetch_page(db.study_procedures, {"study_id": study_id}, page, response, sort_field="imported_at")
+    return json_response(procedures, response)
 
 # VISIT ENDPOINTS
 
 @api_router.post("/visits", response_model=Visit)
 async def create_visit(visit: VisitCreate):
     """Create a new visit for a study."""
-    # Verify study exists
-    study = await db.studies.find_one({"id": visit.study_id})
-    if not study:
-        raise HTTPException(status_code=404, detail="Study not found")
+    # Verify study and cohorts exist
+    await resolve_references(
+        db,
+        Reference("studies", [visit.study_id], "Study not found"),
+        Reference("cohorts", visit.cohort_ids, "Cohort {id} not found in study", filter={"study_id": visit.study_id})
+    )
     
-    # Verify cohorts exist
-    for cohort_id in visit.cohort_ids:
-        cohort = await db.cohorts.find_one({"id": cohort_id, "study_id": visit.study_id})
-        if not cohort:
-            raise HTTPException(status_code=404, detail=f"Cohort {cohort_id} not found in study")
+    visit_obj = Visit.model_construct(**dict(visit), **timepoint_fields(visit.planned_timepoint, visit.planned_date))
+    await db.visits.insert_one(to_mongo(visit_obj))
+    await bump_collection_version(db, "visits")
+    await refresh_visits(db, {"id": visit_obj.id})
+    return model_response(visit_obj)
+
+@api_router.post("/studies/{study_id}/schedule")
+async def generate_study_schedule(study_id: str, schedule: ScheduleCreate):
+    """Expand visit templates into planned visits with their procedures pre-assigned."""
+    procedure_ids = [procedure_id for template in schedule.visits for procedure_id in template.study_procedure_ids]
+    studies, _, _ = await resolve_references(
+        db,
+        Reference("studies", [study_id], "Study not found", projection={"_id": 0, "start_date": 1}),
+        Reference("cohorts", schedule.cohort_ids or [], "Cohort {id} not found in study", filter={"study_id": study_id}),
+        Reference("study_procedures", procedure_ids, "Study procedure {id} not found in study",
+                  filter={"study_id": study_id})
+    )
+    start_date = schedule.start_date or studies[study_id].get('start_date')
+    if not start_date:
+        raise HTTPException(status_code=400, detail="Study has no start_date; pass start_date to generate a schedule")
+    if isinstance(start_date, str):
+        start_date = date.fromisoformat(start_date)
     
-    visit_dict = visit.dict()
-    # Convert dates to strings for MongoDB storage
-    if 'planned_date' in visit_dict and visit_dict['planned_date']:
-        visit_dict['planned_date'] = visit_dict['planned_date'].isoformat()
+    cohort_ids = schedule.cohort_ids
+    if cohort_ids is None:
+        cohorts = await db.cohorts.find({"study_id": study_id}, {"_id": 0, "id": 1}).sort([("created_at", 1), ("id", 1)]).to_list(None)
+        cohort_ids = [cohort['id'] for cohort in cohorts]
+    if schedule.per_cohort and not cohort_ids:
+        raise HTTPException(status_code=400, detail="per_cohort schedules need at least one cohort")
+    cohort_groups = [[cohort_id] for cohort_id in cohort_ids] if schedule.per_cohort else [cohort_ids]
     
-    visit_obj = Visit(**visit.dict())
-    visit_obj_dict = visit_obj.dict()
-    if 'planned_date' in visit_obj_dict and isinstance(visit_obj_dict['planned_date'], date):
-        visit_obj_dict['planned_date'] = visit_obj_dict['planned_date'].isoformat()
-    if 'actual_date' in visit_obj_dict and isinstance(visit_obj_dict['actual_date'], date):
-        visit_obj_dict['actual_date'] = visit_obj_dict['actual_date'].isoformat()
+    try:
+        planned = expand_templates([template.dict() for template in schedule.visits], start_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(planned) * len(cohort_groups) > MAX_SCHEDULED_VISITS:
+        raise HTTPException(status_code=400, detail=f"Schedule exceeds {MAX_SCHEDULED_VISITS} visits")
+    
+    visit_docs = []
+    visit_procedure_docs = []
+    for group in cohort_groups:
+        for item in planned:
+            visit_fields = {key: value for key, value in item.items() if key != 'study_procedure_ids'}
+            visit_obj = Visit.model_construct(study_id=study_id, cohort_ids=group, **visit_fields)
+            visit_docs.append(to_mongo(visit_obj))
+            for order, procedure_id in enumerate(item['study_procedure_ids'], start=1):
+                visit_procedure = VisitProcedure.model_construct(
+                    visit_id=visit_obj.id, study_procedure_id=procedure_id, sequence_order=order
+                )
+                visit_procedure_docs.append(to_mongo(visit_procedure))
     
-    await db.visits.insert_one(visit_obj_dict)
-    return visit_obj
+    if visit_docs:
+        await db.visits.insert_many(visit_docs)
+        if visit_procedure_docs:
+            await db.visit_procedures.insert_many(visit_procedure_docs)
+        await bump_collection_version(db, "visits", "visit_procedures")
+        await refresh_visits(db, {"id": {"$in": [visit['id'] for visit in visit_docs]}})
+    
+    # insert_many adds the ObjectId to each document
+    for doc in visit_docs + visit_procedure_docs:
+        doc.pop('_id', None)
+    return json_response({"visits": visit_docs, "visit_procedures": visit_procedure_docs})
 
 @api_router.get("/studies/{study_id}/visits", response_model=List[Visit])
-async def get_study_visits(study_id: str):
+async def get_study_visits(study_id: str, request: Request, response: Response, page: PageParams = Depends()):
     """Get all visits for a specific study."""
-    visits = await db.visits.find({"study_id": study_id}).to_list(1000)
-    return [Visit(**to_dict(visit)) for visit in visits]
+    if page.streaming:
+        return stream_ndjson(db.visits, {"study_id": study_id}, page)
+    version = await collection_version(db, "visits")
+    not_modified = check_etag(request, response, make_etag("visits", study_id, version, page.limit, page.after))
+    if not_modified:
+        return not_modified
+    visits = await fetch_page(db.visits, {"study_id": study_id}, page, response)
+    return json_response(visits, response)
+
+@api_router.get("/worklist")
+async def get_worklist(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    status: Optional[List[VisitStatus]] = Query(None),
+    include_inactive_studies: bool = Query(False)
+):
+    """Get the visits due across all studies between two dates (today by default)."""
+    date_from = date_from or date.today()
+    date_to = date_to or date_from
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (date_to - date_from).days > WORKLIST_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Worklist range is limited to {WORKLIST_MAX_DAYS} days")
+    statuses = [visit_status.value for visit_status in status] if status else None
+    return json_response(await load_worklist(db, date_from, date_to, statuses, include_inactive_studies))
 
 @api_router.get("/visits/{visit_id}", response_model=Visit)
-async def get_visit(visit_id: str):
+async def get_visit(visit_id: str, request: Request, response: Response):
     """Get a specific visit by ID."""
-    visit = await db.visits.find_one({"id": visit_id})
+    visit = await db.visits.find_one({"id": visit_id}, NO_ID)
     if not visit:
         raise HTTPException(status_code=404, detail="Visit not found")
-    return Visit(**to_dict(visit))
+    not_modified = check_etag(request, response, document_etag(visit))
+    if not_modified:
+        return not_modified
+    return json_response(visit, response)
 
 @api_router.put("/visits/{visit_id}", response_model=Visit)
 async def update_visit(visit_id: str, update_data: VisitUpdate):
     """Update a visit."""
-    visit = await db.visits.find_one({"id": visit_id})
-    if not visit:
-        raise HTTPException(status_code=404, detail="Visit not found")
-    
     update_dict = {k: v for k, v in update_data.dict(exclude_unset=True).items() if v is not None}
     # Convert dates to strings for MongoDB storage
     if 'planned_date' in update_dict and isinstance(update_dict['planned_date'], date):
@@ -559,104 +965,276 @@ async def update_visit(visit_id: str, update_data: VisitUpdate):
     if 'actual_date' in update_dict and isinstance(update_dict['actual_date'], date):
         update_dict['actual_date'] = update_dict['actual_date'].isoformat()
     
-    update_dict['updated_at'] = datetime.utcnow()
+    if 'planned_timepoint' in update_dict or 'planned_date' in update_dict:
+        current = await db.visits.find_one({"id": visit_id}, {"_id": 0, "planned_timepoint": 1, "planned_date": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Visit not found")
+        planned_date = update_data.planned_date or current.get('planned_date')
+        if isinstance(planned_date, str):
+            planned_date = date.fromisoformat(planned_date)
+        update_dict.update({field: None for field in TIMEPOINT_FIELDS})
+        derived = timepoint_fields(update_dict.get('planned_timepoint', current['planned_timepoint']), planned_date)
+        update_dict.update({key: value.isoformat() if isinstance(value, date) else value for key, value in derived.items()})
     
-    await db.visits.update_one({"id": visit_id}, {"$set": update_dict})
+    update_dict['updated_at'] = datetime.utcnow()
     
-    updated_visit = await db.visits.find_one({"id": visit_id})
-    return Visit(**to_dict(updated_visit))
+    updated_visit = await db.visits.find_one_and_update(
+        {"id": visit_id}, {"$set": update_dict}, projection=NO_ID, return_document=ReturnDocument.AFTER
+    )
+    if not updated_visit:
+        raise HTTPException(status_code=404, detail="Visit not found")
+    await bump_collection_version(db, "visits")
+    if 'cohort_ids' in update_dict or 'name' in update_dict:
+        await refresh_visits(db, {"id": visit_id})
+    return json_response(updated_visit)
 
 # VISIT PROCEDURE ASSIGNMENT ENDPOINTS
 
 @api_router.post("/visits/{visit_id}/procedures", response_model=VisitProcedure)
 async def assign_procedure_to_visit(visit_id: str, procedure_assignment: VisitProcedureCreate):
     """Assign a procedure to a visit."""
-    # Verify visit exists
-    visit = await db.visits.find_one({"id": visit_id})
-    if not visit:
-        raise HTTPException(status_code=404, detail="Visit not found")
-    
-    # Verify study procedure exists
-    study_proc = await db.study_procedures.find_one({"id": procedure_assignment.study_procedure_id})
-    if not study_proc:
-        raise HTTPException(status_code=404, detail="Study procedure not found")
+    # Verify visit and study procedure exist
+    await resolve_references(
+        db,
+        Reference("visits", [visit_id], "Visit not found"),
+        Reference("study_procedures", [procedure_assignment.study_procedure_id], "Study procedure not found")
+    )
     
     visit_procedure = VisitProcedure(
         visit_id=visit_id,
         **procedure_assignment.dict()
     )
     
-    await db.visit_procedures.insert_one(visit_procedure.dict())
-    return visit_procedure
+    await db.visit_procedures.insert_one(to_mongo(visit_procedure))
+    await bump_collection_version(db, "visit_procedures")
+    await refresh_visits(db, {"id": visit_id})
+    return model_response(visit_procedure)
 
 @api_router.get("/visits/{visit_id}/procedures", response_model=List[VisitProcedure])
-async def get_visit_procedures(visit_id: str):
+async def get_visit_procedures(visit_id: str, request: Request, response: Response, page: PageParams = Depends()):
     """Get all procedures assigned to a visit."""
-    procedures = await db.visit_procedures.find({"visit_id": visit_id}).to_list(1000)
-    return [VisitProcedure(**to_dict(proc)) for proc in procedures]
+    if page.streaming:
+        return stream_ndjson(db.visit_procedures, {"visit_id": visit_id}, page, sort_field="assigned_at")
+    version = await collection_version(db, "visit_procedures")
+    not_modified = check_etag(request, response, make_etag("visit_procedures", visit_id, version, page.limit, page.after))
+    if not_modified:
+        return not_modified
+    procedures = await fetch_page(db.visit_procedures, {"visit_id": visit_id}, page, response, sort_field="assigned_at")
+    return json_response(procedures, response)
 
 # COST CALCULATION ENDPOINTS
 
+@api_router.post("/visits/{visit_id}/results")
+async def submit_visit_results(visit_id: str, submission: ResultSubmission):
+    """Record one procedure's measurements for the animals of a visit."""
+    visits, study_procedures = await resolve_references(
+        db,
+        Reference("visits", [visit_id], "Visit not found",
+                  projection={"_id": 0, "study_id": 1, "cohort_ids": 1, "planned_date": 1, "actual_date": 1}),
+        Reference("study_procedures", [submission.study_procedure_id], "Study procedure not found",
+                  projection={"_id": 0, "study_id": 1, "input_fields": 1})
+    )
+    visit = visits[visit_id]
+    study_procedure = study_procedures[submission.study_procedure_id]
+    
+    assignment, cohorts = await asyncio.gather(
+        db.visit_procedures.find_one({"visit_id": visit_id, "study_procedure_id": submission.study_procedure_id}, {"_id": 1}),
+        db.cohorts.find({"id": {"$in": visit.get('cohort_ids', [])}}, {"_id": 0, "animal_ids": 1}).to_list(None)
+    )
+    if not assignment:
+        raise HTTPException(status_code=400, detail="Procedure is not assigned to this visit")
+    allowed_animals = {animal_id for cohort in cohorts for animal_id in cohort.get('animal_ids', [])}
+    
+    try:
+        validator = validator_for(study_procedure)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = [row.dict() for row in submission.rows]
+    valid, errors = validator.validate_rows(rows, allowed_animals)
+    await store_results(db, visit, study_procedure, [row for _, row in valid])
+    return {"total_rows": len(rows), "stored": len(valid), "failed": len(errors), "errors": errors}
+
+@api_router.get("/visits/{visit_id}/results")
+async def get_visit_results(visit_id: str, study_procedure_id: Optional[str] = Query(None)):
+    """Get the recorded values of a visit, one row per animal and procedure."""
+    return json_response(await visit_results(db, visit_id, study_procedure_id))
+
+@api_router.get("/studies/{study_id}/results")
+async def get_field_history(
+    study_id: str,
+    study_procedure_id: str = Query(...),
+    field: str = Query(...),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to")
+):
+    """Get every measurement of one procedure field across a study's visits."""
+    return json_response(await field_history(db, study_id, study_procedure_id, field, date_from, date_to))
+
+@api_router.get("/studies/{study_id}/export/{table}")
+async def export_study_table(
+    study_id: str,
+    table: str,
+    file_format: str = Query("csv", alias="format"),
+    columns: Optional[str] = Query(None, description="Comma-separated columns to export, in order")
+):
+    """Stream one flat table of a study (animals, cohorts, visits, procedures, results) as CSV, Parquet or Arrow."""
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown export table {table}")
+    await resolve_references(db, Reference("studies", [study_id], "Study not found"))
+    try:
+        stream = export_table(db, study_id, table, file_format, columns.split(",") if columns else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type, extension = EXPORT_FORMATS[file_format]
+    return StreamingResponse(
+        stream, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="study-{study_id}-{table}.{extension}"'}
+    )
+
+async def get_rate_table() -> RateTable:
+    return await fx_cache.get_or_load(db, "rates", lambda: load_rate_table(db))
+
+@api_router.get("/fx-rates", response_model=List[FxRate])
+async def get_fx_rates(currency: Optional[str] = Query(None)):
+    """List FX rates, newest effective date first per currency."""
+    filter_dict = {"currency": currency.upper()} if currency else {}
+    rates = await db.fx_rates.find(filter_dict, NO_ID).sort([("currency", 1), ("effective_date", -1)]).to_list(None)
+    return json_response(rates)
+
+@api_router.post("/fx-rates", response_model=FxRate)
+async def set_fx_rate(rate: FxRateCreate):
+    """Set a currency's rate from an effective date on, replacing a rate set for the same date."""
+    rate_obj = FxRate(currency=rate.currency.upper(), rate=rate.rate, effective_date=rate.effective_date)
+    doc = to_mongo(rate_obj)
+    saved = await db.fx_rates.find_one_and_update(
+        {"currency": doc['currency'], "effective_date": doc['effective_date']},
+        {"$set": {"rate": doc['rate']}, "$setOnInsert": {"id": doc['id'], "created_at": doc['created_at']}},
+        projection=NO_ID,
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    await fx_cache.invalidate(db)
+    return json_response(saved)
+
+@api_router.delete("/fx-rates/{rate_id}")
+async def delete_fx_rate(rate_id: str):
+    """Delete an FX rate."""
+    result = await db.fx_rates.delete_one({"id": rate_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="FX rate not found")
+    await fx_cache.invalidate(db)
+    return {"message": "FX rate deleted successfully"}
+
 @api_router.get("/visits/{visit_id}/cost")
-async def calculate_visit_cost(visit_id: str):
+async def calculate_visit_cost(
+    visit_id: str,
+    currency: Optional[str] = Query(None, description="Currency to report the total in (default FX_BASE_CURRENCY)"),
+    as_of: Optional[date] = Query(None, description="Date whose FX rates to use (default today)")
+):
     """Calculate total cost for a visit."""
-    # Get visit and its cohorts
-    visit = await db.visits.find_one({"id": visit_id})
-    if not visit:
+    rollup, rates = await asyncio.gather(get_visit_rollup(db, visit_id), get_rate_table())
+    if not rollup:
         raise HTTPException(status_code=404, detail="Visit not found")
-    
-    # Get visit procedures
-    visit_procedures = await db.visit_procedures.find({"visit_id": visit_id}).to_list(1000)
-    
-    total_cost = 0
-    total_animals = 0
-    
-    # Get animal count from cohorts
-    for cohort_id in visit.get('cohort_ids', []):
-        cohort = await db.cohorts.find_one({"id": cohort_id})
-        if cohort:
-            total_animals += len(cohort.get('animal_ids', []))
-    
-    # Calculate procedure costs
-    for visit_proc in visit_procedures:
-        study_proc = await db.study_procedures.find_one({"id": visit_proc['study_procedure_id']})
-        if study_proc:
-            cost_per_animal = study_proc.get('study_specific_cost') or study_proc.get('default_cost', 0)
-            total_cost += cost_per_animal * total_animals
-    
-    return {
-        "visit_id": visit_id,
-        "total_cost": total_cost,
-        "currency": "USD",
-        "total_animals": total_animals,
-        "procedure_count": len(visit_procedures)
-    }
+    return visit_cost_response(rollup, rates, currency, as_of)
 
 @api_router.get("/studies/{study_id}/cost")
-async def calculate_study_cost(study_id: str):
+async def calculate_study_cost(
+    study_id: str,
+    currency: Optional[str] = Query(None, description="Currency to report the totals in (default FX_BASE_CURRENCY)"),
+    as_of: Optional[date] = Query(None, description="Date whose FX rates to use (default today)")
+):
     """Calculate total cost for an entire study."""
-    # Get all visits for the study
-    visits = await db.visits.find({"study_id": study_id}).to_list(1000)
-    
-    total_study_cost = 0
-    visit_costs = []
-    
-    for visit in visits:
-        visit_cost_response = await calculate_visit_cost(visit['id'])
-        visit_costs.append({
-            "visit_id": visit['id'],
-            "visit_name": visit['name'],
-            "cost": visit_cost_response['total_cost']
-        })
-        total_study_cost += visit_cost_response['total_cost']
+    rollup, rates = await asyncio.gather(get_study_rollup(db, study_id), get_rate_table())
+    return study_cost_response(rollup, rates, currency, as_of)
+
+@api_router.post("/studies/{study_id}/forecast")
+async def forecast_study_cost(study_id: str, forecast: ForecastRequest):
+    """Price what-if scenarios (cohort sizes, cost changes, extra visits) against the current study plan."""
+    await resolve_references(db, Reference("studies", [study_id], "Study not found"))
+    try:
+        matrix = await load_study_matrix(db, study_id, await get_rate_table(), forecast.currency, forecast.as_of)
+        scenarios = evaluate_scenarios(
+            matrix, [scenario.dict() for scenario in forecast.scenarios], forecast.include_visits
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response({"study_id": study_id, "scenarios": scenarios})
+
+# SEARCH ENDPOINTS
+
+@api_router.get("/search")
+async def search_library(
+    q: str = Query(..., min_length=1, description="Words to search for; quote a phrase, prefix a word with - to exclude it"),
+    search_type: Optional[str] = Query(None, alias="type", description="Comma-separated: procedures, animals, studies (default all)"),
+    category: Optional[str] = Query(None),
+    species: Optional[str] = Query(None),
+    sex: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=MAX_SEARCH_PAGE_SIZE)
+):
+    """Search procedures, animals and studies, ranked by relevance, with facet counts."""
+    filters = {"category": category, "species": species, "sex": sex, "status": status}
+    try:
+        results = await search(db, q, search_type.split(",") if search_type else None, filters, page, page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response(results)
+
+# DASHBOARD ENDPOINTS
+
+async def count_by_status(collection) -> Dict[str, int]:
+    groups = await collection.aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    return {group['_id']: group['count'] for group in groups}
+
+@api_router.get("/stats")
+async def get_stats():
+    """Get dashboard counts with study and visit status breakdowns."""
+    stats = stats_cache.get("stats")
+    if stats is not MISSING:
+        return stats
     
+    studies, animals, procedures, cohorts, visits, studies_by_status, visits_by_status = await asyncio.gather(
+        db.studies.estimated_document_count(),
+        db.animals.count_documents({"is_active": True}),
+        db.master_procedures.count_documents({"is_active": True}),
+        db.cohorts.estimated_document_count(),
+        db.visits.estimated_document_count(),
+        count_by_status(db.studies),
+        count_by_status(db.visits),
+    )
+    stats = {
+        "studies": studies,
+        "animals": animals,
+        "procedures": procedures,
+        "cohorts": cohorts,
+        "visits": visits,
+        "studies_by_status": studies_by_status,
+        "visits_by_status": visits_by_status,
+        "generated_at": datetime.utcnow()
+    }
+    stats_cache.set("stats", stats)
+    return stats
+
+# ADMIN ENDPOINTS
+
+@api_router.get("/admin/cache")
+async def get_cache_stats():
+    """Report hit/miss counters for the in-process caches."""
     return {
-        "study_id": study_id,
-        "total_cost": total_study_cost,
-        "currency": "USD",
-        "visit_costs": visit_costs
+        "master_procedures": procedure_cache.stats(),
+        "fx_rates": fx_cache.stats(),
+        "stats": stats_cache.stats(),
+        "validators": validator_cache.stats()
     }
 
+@api_router.get("/admin/indexes")
+async def get_index_report():
+    """Report declared, missing and undeclared indexes with their usage counters."""
+    return await index_report(db)
+
 # Original status check endpoints (keeping existing functionality)
 @api_router.get("/")
 async def root():
@@ -664,15 +1242,16 @@ async def root():
 
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
-    status_dict = input.dict()
-    status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
-    return status_obj
+    status_obj = StatusCheck.model_construct(**dict(input))
+    await db.status_checks.insert_one(to_mongo(status_obj))
+    return model_response(status_obj)
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(response: Response, page: PageParams = Depends()):
+    if page.streaming:
+        return stream_ndjson(db.status_checks, {}, page, sort_field="timestamp")
+    status_checks = await fetch_page(db.status_checks, {}, page, response, sort_field="timestamp")
+    return json_response(status_checks, response)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -683,7 +1262,15 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Server-Timing"],
 )
+app.add_middleware(ProfilerMiddleware, get_db=lambda: db)
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics for this worker process."""
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 # Configure logging
 logging.basicConfig(
@@ -695,30 +1282,30 @@ logger = logging.getLogger(__name__)
 # Database connection management
 @app.on_event("startup")
 async def startup_event():
-    global client, db
+    global client, db, index_task, status_task
     print(f"Connecting to MongoDB at: {MONGO_URL}")
     print(f"Database name: {DB_NAME}")
     
     try:
-        client = AsyncIOMotorClient(MONGO_URL)
+        client = AsyncIOMotorClient(MONGO_URL, event_listeners=[command_metrics, command_profiler])
         db = client[DB_NAME]
         
         # Test the connection
         await client.admin.command('ping')
         print("✅ Successfully connected to MongoDB!")
         
-        # Create indexes for better performance
-        await db.master_procedures.create_index("id", unique=True)
-        await db.animals.create_index("id", unique=True)
-        await db.animals.create_index("animal_id")
-        await db.studies.create_index("id", unique=True)
-        await db.status_checks.create_index("timestamp")
-        await db.cohorts.create_index("id", unique=True)
-        await db.visits.create_index("id", unique=True)
-        await db.study_procedures.create_index("id", unique=True)
-        await db.visit_procedures.create_index("id", unique=True)
+        # Procedures stored before the hierarchy kept paths get them once
+        backfilled = await backfill_paths(db)
+        if backfilled:
+            print(f"✅ Procedure hierarchy paths backfilled for {backfilled} procedures")
+        
+        # Reconcile indexes in the background so large builds don't delay boot
+        index_task = asyncio.create_task(reconcile_indexes(db))
+        print("✅ Database index reconciliation started")
         
-        print("✅ Database indexes created")
+        # One worker at a time moves visits to Upcoming and Missed as dates pass
+        status_task = asyncio.create_task(run_status_scheduler(db))
+        print("✅ Visit status scheduler started")
         
     except Exception as e:
         print(f"❌ Failed to connect to MongoDB: {e}")
@@ -730,6 +1317,16 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     global client
+    for task in (status_task, index_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                # A task that already failed must not keep the connection from closing
+                logger.exception("Background task failed before shutdown")
     if client:
         client.close()
         print("✅ MongoDB connection closed")
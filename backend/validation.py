@@ -0,0 +1,213 @@
+"""Compiled validators for procedure input fields.
+
+A study procedure's ``input_fields`` snapshot never changes after import, so
+its checks are compiled once into a ``CompiledValidator`` and cached by study
+procedure id. Compiling resolves everything that does not depend on the
+value: the type check, option sets, ``validation_rules`` bounds and compiled
+regular expressions. A submission is then validated a column at a time, each
+field's check running over that field's values from every row.
+
+Supported ``validation_rules``:
+
+* ``min`` / ``max``: bounds for number, integer and date fields (dates as
+  ``YYYY-MM-DD``);
+* ``min_length`` / ``max_length`` and ``regex``: for string and text fields.
+
+Other keys are kept for display and ignored here. A supported rule with an
+unusable value (a non-numeric ``min``, an invalid regex...) raises
+``ValueError`` at compile time.
+"""
+
+import math
+import os
+import re
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from cache import MISSING, TTLCache
+
+VALIDATOR_CACHE_TTL = float(os.getenv("VALIDATOR_CACHE_TTL", "3600"))
+
+NUMERIC_TYPES = {"number", "integer"}
+CHOICE_TYPES = {"radio", "dropdown"}
+
+_TIME = re.compile(r"^([01]\d|2[0-3]):[0-5]\d(:[0-5]\d)?$")
+
+Check = Callable[[Any], Tuple[Any, Optional[str]]]
+
+validator_cache = TTLCache(ttl=VALIDATOR_CACHE_TTL, maxsize=2048)
+
+
+def _rule(rules: Dict[str, Any], key: str, parse: Callable[[Any], Any], field_name: str) -> Any:
+    if rules.get(key) is None:
+        return None
+    try:
+        return parse(rules[key])
+    except (TypeError, ValueError, re.error) as e:
+        raise ValueError(f"{field_name}: invalid validation rule {key}={rules[key]!r} ({e})")
+
+
+def _number(value: Any) -> float:
+    if isinstance(value, bool):
+        raise TypeError("not a number")
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError("not a finite number")
+    return number
+
+
+def _bounds(low: Any, high: Any, describe: Callable[[Any], str] = str) -> Callable[[Any], Optional[str]]:
+    def check(value: Any) -> Optional[str]:
+        if low is not None and value < low:
+            return f"must be at least {describe(low)}"
+        if high is not None and value > high:
+            return f"must be at most {describe(high)}"
+        return None
+    return check
+
+
+def compile_field(field: Dict[str, Any]) -> Check:
+    """Build the check for one input field; it returns ``(normalized value, error)``."""
+    name = field['name']
+    field_type = field['field_type']
+    options = list(field.get('options') or [])
+    option_set = frozenset(options)
+    rules = field.get('validation_rules') or {}
+
+    if field_type in NUMERIC_TYPES:
+        in_bounds = _bounds(_rule(rules, "min", _number, name), _rule(rules, "max", _number, name), lambda v: f"{v:g}")
+        integer = field_type == "integer"
+
+        def check_number(value):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return value, "must be a number"
+            # JSON bodies may carry NaN and Infinity, which no bound or int() handles
+            if not math.isfinite(value):
+                return value, "must be a finite number"
+            if integer:
+                if value != int(value):
+                    return value, "must be an integer"
+                value = int(value)
+            else:
+                value = float(value)
+            return value, in_bounds(value)
+        return check_number
+
+    if field_type in CHOICE_TYPES:
+        def check_choice(value):
+            if not isinstance(value, str) or (option_set and value not in option_set):
+                return value, f"must be one of {options}"
+            return value, None
+        return check_choice
+
+    if field_type == "checkbox":
+        if not options:
+            def check_flag(value):
+                return (value, None) if isinstance(value, bool) else (value, "must be true or false")
+            return check_flag
+
+        def check_selection(value):
+            if not isinstance(value, list) or not option_set.issuperset(value):
+                return value, f"must be a list of {options}"
+            return value, None
+        return check_selection
+
+    if field_type == "date":
+        to_date = lambda value: date.fromisoformat(value).isoformat()
+        in_range = _bounds(_rule(rules, "min", to_date, name), _rule(rules, "max", to_date, name))
+
+        def check_date(value):
+            try:
+                value = date.fromisoformat(value).isoformat()
+            except (TypeError, ValueError):
+                return value, "must be a date (YYYY-MM-DD)"
+            return value, in_range(value)
+        return check_date
+
+    if field_type == "time":
+        def check_time(value):
+            if not isinstance(value, str) or not _TIME.match(value):
+                return value, "must be a time (HH:MM)"
+            return value, None
+        return check_time
+
+    length = _bounds(_rule(rules, "min_length", int, name), _rule(rules, "max_length", int, name),
+                     lambda v: f"{v} characters")
+    pattern = _rule(rules, "regex", re.compile, name)
+
+    def check_text(value):
+        if not isinstance(value, str):
+            return value, "must be text"
+        error = length(len(value))
+        if error:
+            return value, f"length {error}"
+        if pattern is not None and not pattern.fullmatch(value):
+            return value, f"must match {pattern.pattern}"
+        return value, None
+    return check_text
+
+
+class CompiledValidator:
+    """Validates submitted result rows against one procedure's input fields."""
+
+    __slots__ = ("fields", "names")
+
+    def __init__(self, input_fields: Sequence[Dict[str, Any]]):
+        self.fields: Tuple[Tuple[str, bool, Check], ...] = tuple(
+            (field['name'], bool(field.get('is_mandatory')), compile_field(field)) for field in input_fields
+        )
+        self.names = frozenset(name for name, _, _ in self.fields)
+
+    def validate_rows(self, rows: Sequence[Dict[str, Any]],
+                      allowed_animals: Set[str]) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]:
+        """Split rows into valid ``(row number, row)`` pairs and per-row errors.
+
+        Values of valid rows are normalized in place. Missing values are
+        allowed unless the field is mandatory; ``None`` clears a stored value.
+        """
+        row_errors: List[List[str]] = [[] for _ in rows]
+        values = [row['values'] for row in rows]
+
+        for index, row in enumerate(rows):
+            if row['animal_id'] not in allowed_animals:
+                row_errors[index].append(f"animal {row['animal_id']} is not in this visit's cohorts")
+            for name in values[index].keys() - self.names:
+                row_errors[index].append(f"{name}: unknown field")
+
+        for name, mandatory, check in self.fields:
+            for index, row_values in enumerate(values):
+                value = row_values.get(name)
+                if value is None:
+                    if mandatory:
+                        row_errors[index].append(f"{name}: is mandatory")
+                    continue
+                row_values[name], error = check(value)
+                if error:
+                    row_errors[index].append(f"{name}: {error}")
+
+        # A repeated animal is only an error when an earlier row for it was valid
+        seen: Set[str] = set()
+        for index, row in enumerate(rows):
+            if row_errors[index]:
+                continue
+            if row['animal_id'] in seen:
+                row_errors[index].append(f"animal {row['animal_id']} appears more than once")
+            seen.add(row['animal_id'])
+
+        valid = [(index + 1, row) for index, row in enumerate(rows) if not row_errors[index]]
+        errors = [{"row": index + 1, "errors": messages} for index, messages in enumerate(row_errors) if messages]
+        return valid, errors
+
+
+def compile_validator(input_fields: Sequence[Dict[str, Any]]) -> CompiledValidator:
+    """Compile input fields; raises ``ValueError`` for unusable validation rules."""
+    return CompiledValidator(input_fields)
+
+
+def validator_for(study_procedure: Dict[str, Any]) -> CompiledValidator:
+    """Return the cached validator of a study procedure, compiling it on first use."""
+    validator = validator_cache.get(study_procedure['id'])
+    if validator is MISSING:
+        validator = compile_validator(study_procedure.get('input_fields', []))
+        validator_cache.set(study_procedure['id'], validator)
+    return validator
@@ -0,0 +1,122 @@
+"""Time-based visit status transitions run by a background task.
+
+Every ``VISIT_STATUS_INTERVAL`` seconds one worker applies the transitions
+with bulk ``update_many`` calls:
+
+* Scheduled or Upcoming visits whose window has closed (``window_end_date``,
+  or ``planned_date`` for visits without a window) without an
+  ``actual_date`` become Missed;
+* Scheduled visits without an ``actual_date`` that are planned within
+  ``UPCOMING_WINDOW_DAYS`` or whose window opened, become Upcoming as long as
+  their window (or planned date) has not passed.
+
+The transitions only match visits still in their source status, so running
+them twice is harmless. A lease in the ``scheduler_leases`` collection keeps
+the other workers idle while its holder keeps renewing it; if the holder
+dies, another worker takes over once the lease expires.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from etag import bump_collection_version
+
+logger = logging.getLogger(__name__)
+
+VISIT_STATUS_INTERVAL = float(os.getenv("VISIT_STATUS_INTERVAL", "300"))
+VISIT_STATUS_LEASE_SECONDS = float(os.getenv("VISIT_STATUS_LEASE_SECONDS", str(VISIT_STATUS_INTERVAL * 2)))
+UPCOMING_WINDOW_DAYS = int(os.getenv("UPCOMING_WINDOW_DAYS", "7"))
+
+LEASE_NAME = "visit_status"
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Mirrors VisitStatus in server.py
+SCHEDULED = "Scheduled"
+UPCOMING = "Upcoming"
+MISSED = "Missed"
+
+
+async def acquire_lease(db, name: str, owner: str, seconds: float) -> bool:
+    """Take or renew the named lease; False while another owner holds it."""
+    now = datetime.utcnow()
+    try:
+        lease = await db.scheduler_leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds), "renewed_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The lease exists and is held by someone else, so the upsert collided
+        return False
+    return lease is not None and lease['owner'] == owner
+
+
+async def release_lease(db, name: str, owner: str) -> None:
+    await db.scheduler_leases.delete_one({"_id": name, "owner": owner})
+
+
+async def apply_transitions(db, today: Optional[date] = None,
+                            upcoming_days: int = UPCOMING_WINDOW_DAYS) -> Dict[str, int]:
+    """Apply the time-based transitions and return how many visits each one changed."""
+    today = today or date.today()
+    now = datetime.utcnow()
+    missed = await db.visits.update_many(
+        {
+            "status": {"$in": [SCHEDULED, UPCOMING]},
+            "actual_date": None,
+            "$or": [
+                {"window_end_date": {"$lt": today.isoformat()}},
+                {"window_end_date": None, "planned_date": {"$lt": today.isoformat()}},
+            ],
+        },
+        {"$set": {"status": MISSED, "updated_at": now}}
+    )
+    # Performed visits and closed windows keep their status; the Missed step above skips the former
+    upcoming = await db.visits.update_many(
+        {
+            "status": SCHEDULED,
+            "actual_date": None,
+            "$and": [
+                {"$or": [
+                    {"planned_date": {"$lte": (today + timedelta(days=upcoming_days)).isoformat()}},
+                    {"window_start_date": {"$lte": today.isoformat()}},
+                ]},
+                {"$or": [
+                    {"window_end_date": {"$gte": today.isoformat()}},
+                    {"window_end_date": None, "planned_date": {"$gte": today.isoformat()}},
+                ]},
+            ],
+        },
+        {"$set": {"status": UPCOMING, "updated_at": now}}
+    )
+    if missed.modified_count or upcoming.modified_count:
+        await bump_collection_version(db, "visits")
+    return {"missed": missed.modified_count, "upcoming": upcoming.modified_count}
+
+
+async def run_status_scheduler(db, interval: float = VISIT_STATUS_INTERVAL,
+                               lease_seconds: float = VISIT_STATUS_LEASE_SECONDS,
+                               owner: str = WORKER_ID) -> None:
+    """Apply the transitions every ``interval`` seconds while holding the lease."""
+    try:
+        while True:
+            try:
+                if await acquire_lease(db, LEASE_NAME, owner, lease_seconds):
+                    changed = await apply_transitions(db)
+                    if any(changed.values()):
+                        logger.info(f"Visit status transitions applied: {changed}")
+            except Exception:
+                logger.exception("Visit status transitions failed")
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        await release_lease(db, LEASE_NAME, owner)
+        raise
@@ -0,0 +1,82 @@
+"""Daily worklist: visits due across all studies in a date range.
+
+One aggregation does all the work. The visits are matched on the
+``(planned_date, status, id)`` index. Each visit is then joined with its
+study, its cohorts (reduced to their animal counts) and its assigned
+procedures in sequence order, with the study procedure names resolved. The
+``$lookup`` stages combine ``localField`` with a sub-pipeline, which needs
+MongoDB 5.0 or later.
+"""
+
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence
+
+# Studies in these states have no work left to schedule
+INACTIVE_STUDY_STATUSES = ("Completed",)
+
+
+def worklist_pipeline(date_from: date, date_to: date, statuses: Optional[Sequence[str]] = None,
+                      include_inactive: bool = False) -> List[Dict[str, Any]]:
+    match: Dict[str, Any] = {"planned_date": {"$gte": date_from.isoformat(), "$lte": date_to.isoformat()}}
+    if statuses:
+        match["status"] = {"$in": list(statuses)}
+
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": match},
+        {"$sort": {"planned_date": 1, "status": 1, "id": 1}},
+        {"$lookup": {
+            "from": "studies",
+            "localField": "study_id",
+            "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "id": 1, "name": 1, "status": 1, "principal_investigator": 1}}],
+            "as": "study"
+        }},
+        {"$unwind": "$study"},
+    ]
+    if not include_inactive:
+        pipeline.append({"$match": {"study.status": {"$nin": list(INACTIVE_STUDY_STATUSES)}}})
+    pipeline += [
+        {"$lookup": {
+            "from": "cohorts",
+            "localField": "cohort_ids",
+            "foreignField": "id",
+            "pipeline": [{"$project": {
+                "_id": 0, "id": 1, "name": 1, "animal_count": {"$size": {"$ifNull": ["$animal_ids", []]}}
+            }}],
+            "as": "cohorts"
+        }},
+        {"$lookup": {
+            "from": "visit_procedures",
+            "localField": "id",
+            "foreignField": "visit_id",
+            "pipeline": [
+                {"$sort": {"sequence_order": 1, "assigned_at": 1, "id": 1}},
+                {"$lookup": {
+                    "from": "study_procedures",
+                    "localField": "study_procedure_id",
+                    "foreignField": "id",
+                    "pipeline": [{"$project": {"_id": 0, "name": 1, "category": 1}}],
+                    "as": "study_procedure"
+                }},
+                {"$unwind": {"path": "$study_procedure", "preserveNullAndEmptyArrays": True}},
+                {"$project": {
+                    "_id": 0,
+                    "id": 1,
+                    "study_procedure_id": 1,
+                    "sequence_order": 1,
+                    "name": "$study_procedure.name",
+                    "category": "$study_procedure.category"
+                }}
+            ],
+            "as": "procedures"
+        }},
+        {"$addFields": {"animal_count": {"$sum": "$cohorts.animal_count"}}},
+        {"$project": {"_id": 0}},
+    ]
+    return pipeline
+
+
+async def load_worklist(db, date_from: date, date_to: date, statuses: Optional[Sequence[str]] = None,
+                        include_inactive: bool = False) -> List[Dict[str, Any]]:
+    pipeline = worklist_pipeline(date_from, date_to, statuses, include_inactive)
+    return await db.visits.aggregate(pipeline).to_list(None)
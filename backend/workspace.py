@@ -0,0 +1,108 @@
+"""Study workspace: the whole study graph assembled in one response.
+
+The study, its cohorts, visits, imported procedures and cost rollup are read
+concurrently; visit procedures and per-visit costs follow in a second
+concurrent round once the visit ids are known. Visit procedures and costs are
+nested under their visit. Costs are reported in ``FX_BASE_CURRENCY`` at
+today's rates.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import HTTPException
+
+from cost_rollups import ROLLUP_VISIT, get_study_rollup, study_cost_response, visit_cost_response
+from fx import RateTable
+
+WORKSPACE_SECTIONS = ("cohorts", "visits", "procedures", "visit_procedures", "costs")
+
+# Sections whose fields can be narrowed with ``fields=section.field``
+PROJECTABLE_SECTIONS = {"study", "cohorts", "visits", "procedures", "visit_procedures"}
+
+
+def parse_include(include: Optional[str]) -> Set[str]:
+    if not include:
+        return set(WORKSPACE_SECTIONS)
+    sections = {section.strip() for section in include.split(",") if section.strip()}
+    unknown = sections - set(WORKSPACE_SECTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown workspace sections: {sorted(unknown)}")
+    return sections
+
+
+def parse_fields(fields: Optional[str]) -> Dict[str, Dict[str, int]]:
+    """Turn ``section.field`` pairs into a MongoDB projection per section."""
+    projections: Dict[str, Dict[str, int]] = {}
+    if not fields:
+        return projections
+    for item in fields.split(","):
+        section, _, field = item.strip().partition(".")
+        if section not in PROJECTABLE_SECTIONS or not field:
+            raise HTTPException(status_code=400, detail=f"Invalid field selector: {item.strip()!r}")
+        projections.setdefault(section, {"_id": 0, "id": 1})[field] = 1
+    return projections
+
+
+async def _skipped(value: Any) -> Any:
+    return value
+
+
+async def load_workspace(db, study_id: str, include: Set[str], projections: Dict[str, Dict[str, int]],
+                         rates: RateTable) -> Dict[str, Any]:
+    """Return the study with the requested sections, or raise 404.
+
+    Costs in a currency without an FX rate leave ``total_cost`` null and are
+    listed in ``missing_rates``.
+    """
+    def projection(section: str, *required: str) -> Dict[str, int]:
+        selected = projections.get(section)
+        if selected is None:
+            return {"_id": 0}
+        return {**selected, **{field: 1 for field in required}}
+
+    def find_all(collection, filter_dict, section, sort_field, *required):
+        return collection.find(filter_dict, projection(section, *required)).sort([(sort_field, 1), ("id", 1)]).to_list(None)
+
+    study, cohorts, visits, procedures, study_cost = await asyncio.gather(
+        db.studies.find_one({"id": study_id}, projection("study")),
+        find_all(db.cohorts, {"study_id": study_id}, "cohorts", "created_at") if "cohorts" in include else _skipped([]),
+        find_all(db.visits, {"study_id": study_id}, "visits", "created_at")
+        if include & {"visits", "visit_procedures", "costs"} else _skipped([]),
+        find_all(db.study_procedures, {"study_id": study_id}, "procedures", "imported_at")
+        if "procedures" in include else _skipped([]),
+        get_study_rollup(db, study_id) if "costs" in include else _skipped(None),
+    )
+    if not study:
+        raise HTTPException(status_code=404, detail="Study not found")
+
+    visit_ids = [visit['id'] for visit in visits]
+    visit_procedures, visit_rollups = await asyncio.gather(
+        find_all(db.visit_procedures, {"visit_id": {"$in": visit_ids}}, "visit_procedures", "assigned_at", "visit_id")
+        if "visit_procedures" in include and visit_ids else _skipped([]),
+        db.cost_rollups.find({"kind": ROLLUP_VISIT, "study_id": study_id}, {"_id": 0}).to_list(None)
+        if "costs" in include else _skipped([]),
+    )
+
+    if "visit_procedures" in include:
+        procedures_by_visit: Dict[str, List[Dict[str, Any]]] = {visit_id: [] for visit_id in visit_ids}
+        for visit_proc in visit_procedures:
+            procedures_by_visit[visit_proc['visit_id']].append(visit_proc)
+        for visit in visits:
+            visit['procedures'] = procedures_by_visit[visit['id']]
+    if "costs" in include:
+        costs_by_visit = {rollup['id']: visit_cost_response(rollup, rates) for rollup in visit_rollups}
+        study_costs = study_cost_response(study_cost, rates)
+        for visit in visits:
+            visit['cost'] = costs_by_visit.get(visit['id'])
+
+    workspace: Dict[str, Any] = {"study": study}
+    if "cohorts" in include:
+        workspace["cohorts"] = cohorts
+    if include & {"visits", "visit_procedures", "costs"}:
+        workspace["visits"] = visits
+    if "procedures" in include:
+        workspace["procedures"] = procedures
+    if "costs" in include:
+        workspace["costs"] = study_costs
+    return workspace
@@ -11,6 +11,7 @@ import axios from "axios";
 import CohortManager from "./components/CohortManager";
 import VisitManager from "./components/VisitManager";
 import StudyProcedureManager from "./components/StudyProcedureManager";
+import { fetchAllPages } from "./pagination";
 
 const BACKEND_URL =
   process.env.REACT_APP_BACKEND_URL || "http://localhost:8001";
@@ -67,17 +68,13 @@ const Dashboard = () => {
   useEffect(() => {
     const fetchStats = async () => {
       try {
-        const [studiesRes, animalsRes, proceduresRes] = await Promise.all([
-          axios.get(`${API}/studies`),
-          axios.get(`${API}/animals`),
-          axios.get(`${API}/master-procedures`),
-        ]);
+        const response = await axios.get(`${API}/stats`);
 
         setStats({
-          studies: studiesRes.data.length,
-          animals: animalsRes.data.length,
-          procedures: proceduresRes.data.length,
-          cohorts: 0, // We'll calculate this when we load studies
+          studies: response.data.studies,
+          animals: response.data.animals,
+          procedures: response.data.procedures,
+          cohorts: response.data.cohorts,
         });
       } catch (error) {
         console.error("Error fetching stats:", error);
@@ -221,8 +218,7 @@ const StudiesManager = () => {
 
   const fetchStudies = async () => {
     try {
-      const response = await axios.get(`${API}/studies`);
-      setStudies(response.data);
+      setStudies(await fetchAllPages(`${API}/studies`));
     } catch (error) {
       console.error("Error fetching studies:", error);
     } finally {
@@ -491,15 +487,13 @@ const StudyDetails = ({ study }) => {
 
   const fetchStudyData = async () => {
     try {
-      const [cohortsRes, visitsRes, proceduresRes] = await Promise.all([
-        axios.get(`${API}/studies/${study.id}/cohorts`),
-        axios.get(`${API}/studies/${study.id}/visits`),
-        axios.get(`${API}/studies/${study.id}/procedures`),
-      ]);
-
-      setCohorts(cohortsRes.data);
-      setVisits(visitsRes.data);
-      setProcedures(proceduresRes.data);
+      const response = await axios.get(`${API}/studies/${study.id}/workspace`, {
+        params: { include: "cohorts,visits,procedures" },
+      });
+
+      setCohorts(response.data.cohorts);
+      setVisits(response.data.visits);
+      setProcedures(response.data.procedures);
     } catch (error) {
       console.error("Error fetching study data:", error);
     }
@@ -680,8 +674,7 @@ const AnimalsManager = () => {
 
   const fetchAnimals = async () => {
     try {
-      const response = await axios.get(`${API}/animals`);
-      setAnimals(response.data);
+      setAnimals(await fetchAllPages(`${API}/animals`));
     } catch (error) {
       console.error("Error fetching animals:", error);
     } finally {
@@ -953,8 +946,7 @@ const ProceduresLibrary = () => {
 
   const fetchProcedures = async () => {
     try {
-      const response = await axios.get(`${API}/master-procedures`);
-      setProcedures(response.data);
+      setProcedures(await fetchAllPages(`${API}/master-procedures`));
     } catch (error) {
       console.error("Error fetching procedures:", error);
     } finally {
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from "react";
 import axios from "axios";
 import { useParams, Link } from "react-router-dom";
+import { fetchAllPages } from "../pagination";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -20,15 +21,15 @@ const CohortManager = () => {
 
   const fetchData = async () => {
     try {
-      const [studyRes, cohortsRes, animalsRes] = await Promise.all([
+      const [studyRes, cohortList, animalList] = await Promise.all([
         axios.get(`${API}/studies/${studyId}`),
-        axios.get(`${API}/studies/${studyId}/cohorts`),
-        axios.get(`${API}/animals`)
+        fetchAllPages(`${API}/studies/${studyId}/cohorts`),
+        fetchAllPages(`${API}/animals`)
       ]);
       
       setStudy(studyRes.data);
-      setCohorts(cohortsRes.data);
-      setAnimals(animalsRes.data);
+      setCohorts(cohortList);
+      setAnimals(animalList);
     } catch (error) {
       console.error('Error fetching data:', error);
     } finally {
@@ -46,23 +47,20 @@ const CohortManager = () => {
     }
   };
 
-  const assignAnimal = async (cohortId, animalId) => {
+  const updateCohortAnimals = async (cohortId, changes) => {
     try {
-      await axios.post(`${API}/cohorts/${cohortId}/animals/${animalId}`);
-      await fetchData();
+      const response = await axios.post(`${API}/cohorts/${cohortId}/animals`, changes);
+      const updatedCohort = response.data;
+      setCohorts(cohorts.map(cohort => cohort.id === cohortId ? updatedCohort : cohort));
+      setSelectedCohort(updatedCohort);
     } catch (error) {
-      console.error('Error assigning animal:', error);
+      console.error('Error updating cohort animals:', error);
     }
   };
 
-  const removeAnimal = async (cohortId, animalId) => {
-    try {
-      await axios.delete(`${API}/cohorts/${cohortId}/animals/${animalId}`);
-      await fetchData();
-    } catch (error) {
-      console.error('Error removing animal:', error);
-    }
-  };
+  const assignAnimals = (cohortId, animalIds) => updateCohortAnimals(cohortId, { add: animalIds });
+
+  const removeAnimal = (cohortId, animalId) => updateCohortAnimals(cohortId, { remove: [animalId] });
 
   if (loading) {
     return <div className="p-6">Loading cohorts...</div>;
@@ -134,9 +132,10 @@ const CohortManager = () => {
         <div className="lg:col-span-1">
           {selectedCohort ? (
             <CohortDetails 
+              key={selectedCohort.id}
               cohort={selectedCohort} 
               animals={animals}
-              onAssignAnimal={assignAnimal}
+              onAssignAnimals={assignAnimals}
               onRemoveAnimal={removeAnimal}
             />
           ) : (
@@ -279,12 +278,25 @@ const CreateCohortForm = ({ studyId, onSubmit, onCancel }) => {
   );
 };
 
-const CohortDetails = ({ cohort, animals, onAssignAnimal, onRemoveAnimal }) => {
+const CohortDetails = ({ cohort, animals, onAssignAnimals, onRemoveAnimal }) => {
   const [showAssignForm, setShowAssignForm] = useState(false);
+  const [selectedAnimalIds, setSelectedAnimalIds] = useState([]);
   
   const assignedAnimals = animals.filter(animal => cohort.animal_ids.includes(animal.id));
   const availableAnimals = animals.filter(animal => !cohort.animal_ids.includes(animal.id));
 
+  const toggleSelected = (animalId) => {
+    setSelectedAnimalIds(selectedAnimalIds.includes(animalId)
+      ? selectedAnimalIds.filter(id => id !== animalId)
+      : [...selectedAnimalIds, animalId]);
+  };
+
+  const assignSelected = () => {
+    onAssignAnimals(cohort.id, selectedAnimalIds);
+    setSelectedAnimalIds([]);
+    setShowAssignForm(false);
+  };
+
   return (
     <div className="bg-white rounded-lg shadow-md">
       <div className="p-4 border-b">
@@ -332,14 +344,31 @@ const CohortDetails = ({ cohort, animals, onAssignAnimal, onRemoveAnimal }) => {
 
           {showAssignForm && (
             <div className="mb-3 p-3 bg-gray-50 rounded-lg">
-              <h5 className="text-sm font-medium mb-2">Available Animals</h5>
+              <div className="flex justify-between items-center mb-2">
+                <h5 className="text-sm font-medium">Available Animals</h5>
+                {selectedAnimalIds.length > 0 && (
+                  <button
+                    onClick={assignSelected}
+                    className="text-blue-600 hover:text-blue-800 text-sm"
+                  >
+                    Assign Selected ({selectedAnimalIds.length})
+                  </button>
+                )}
+              </div>
               <div className="space-y-1 max-h-32 overflow-y-auto">
                 {availableAnimals.map(animal => (
                   <div key={animal.id} className="flex justify-between items-center text-sm">
-                    <span>{animal.animal_id} ({animal.sex} {animal.species})</span>
+                    <label className="flex items-center space-x-2">
+                      <input
+                        type="checkbox"
+                        checked={selectedAnimalIds.includes(animal.id)}
+                        onChange={() => toggleSelected(animal.id)}
+                      />
+                      <span>{animal.animal_id} ({animal.sex} {animal.species})</span>
+                    </label>
                     <button
                       onClick={() => {
-                        onAssignAnimal(cohort.id, animal.id);
+                        onAssignAnimals(cohort.id, [animal.id]);
                         setShowAssignForm(false);
                       }}
                       className="text-blue-600 hover:text-blue-800"
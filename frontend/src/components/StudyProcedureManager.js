@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from "react";
 import axios from "axios";
 import { useParams, Link } from "react-router-dom";
+import { fetchAllPages } from "../pagination";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -20,15 +21,15 @@ const StudyProcedureManager = () => {
 
   const fetchData = async () => {
     try {
-      const [studyRes, studyProceduresRes, masterProceduresRes] = await Promise.all([
+      const [studyRes, studyProcedureList, masterProcedureList] = await Promise.all([
         axios.get(`${API}/studies/${studyId}`),
-        axios.get(`${API}/studies/${studyId}/procedures`),
-        axios.get(`${API}/master-procedures`)
+        fetchAllPages(`${API}/studies/${studyId}/procedures`),
+        fetchAllPages(`${API}/master-procedures`)
       ]);
       
       setStudy(studyRes.data);
-      setStudyProcedures(studyProceduresRes.data);
-      setMasterProcedures(masterProceduresRes.data);
+      setStudyProcedures(studyProcedureList);
+      setMasterProcedures(masterProcedureList);
     } catch (error) {
       console.error('Error fetching data:', error);
     } finally {
@@ -21,17 +21,14 @@ const VisitManager = () => {
 
   const fetchData = async () => {
     try {
-      const [studyRes, visitsRes, cohortsRes, proceduresRes] = await Promise.all([
-        axios.get(`${API}/studies/${studyId}`),
-        axios.get(`${API}/studies/${studyId}/visits`),
-        axios.get(`${API}/studies/${studyId}/cohorts`),
-        axios.get(`${API}/studies/${studyId}/procedures`)
-      ]);
+      const response = await axios.get(`${API}/studies/${studyId}/workspace`);
+      const workspace = response.data;
       
-      setStudy(studyRes.data);
-      setVisits(visitsRes.data);
-      setCohorts(cohortsRes.data);
-      setProcedures(proceduresRes.data);
+      setStudy(workspace.study);
+      setVisits(workspace.visits);
+      setCohorts(workspace.cohorts);
+      setProcedures(workspace.procedures);
+      setSelectedVisit(current => current && workspace.visits.find(visit => visit.id === current.id));
     } catch (error) {
       console.error('Error fetching data:', error);
     } finally {
@@ -372,28 +369,11 @@ const CreateVisitForm = ({ studyId, cohorts, onSubmit, onCancel }) => {
 };
 
 const VisitDetails = ({ visit, cohorts, procedures, onAssignProcedure }) => {
-  const [visitProcedures, setVisitProcedures] = useState([]);
   const [showAssignForm, setShowAssignForm] = useState(false);
-  const [visitCost, setVisitCost] = useState(null);
 
-  useEffect(() => {
-    if (visit) {
-      fetchVisitDetails();
-    }
-  }, [visit]);
-
-  const fetchVisitDetails = async () => {
-    try {
-      const [proceduresRes, costRes] = await Promise.all([
-        axios.get(`${API}/visits/${visit.id}/procedures`),
-        axios.get(`${API}/visits/${visit.id}/cost`)
-      ]);
-      setVisitProcedures(proceduresRes.data);
-      setVisitCost(costRes.data);
-    } catch (error) {
-      console.error('Error fetching visit details:', error);
-    }
-  };
+  // Procedures and cost come nested in the study workspace response
+  const visitProcedures = visit.procedures || [];
+  const visitCost = visit.cost;
 
   const visitCohorts = cohorts.filter(cohort => visit.cohort_ids.includes(cohort.id));
   const assignedProcedureIds = visitProcedures.map(vp => vp.study_procedure_id);
@@ -424,7 +404,15 @@ const VisitDetails = ({ visit, cohorts, procedures, onAssignProcedure }) => {
           {visitCost && (
             <div className="flex justify-between">
               <span className="text-gray-600">Total Cost:</span>
-              <span className="font-medium">${visitCost.total_cost.toFixed(2)}</span>
+              {visitCost.total_cost != null ? (
+                <span className="font-medium">{visitCost.total_cost.toFixed(2)} {visitCost.currency}</span>
+              ) : (
+                <span className="font-medium" title={`No FX rate for ${visitCost.missing_rates.join(", ")}`}>
+                  {Object.entries(visitCost.costs_by_currency)
+                    .map(([currency, amount]) => `${amount.toFixed(2)} ${currency}`)
+                    .join(" + ")}
+                </span>
+              )}
             </div>
           )}
         </div>
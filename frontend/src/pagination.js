@@ -0,0 +1,17 @@
+import axios from "axios";
+
+// Largest page the API serves (MAX_PAGE_SIZE in backend/pagination.py)
+export const PAGE_SIZE = 1000;
+
+// Fetch a whole list endpoint one bounded page at a time, following the
+// X-Next-Cursor header, so the server never builds the full list at once.
+export const fetchAllPages = async (url, params = {}) => {
+  const items = [];
+  let after;
+  do {
+    const response = await axios.get(url, { params: { ...params, limit: PAGE_SIZE, after } });
+    items.push(...response.data);
+    after = response.headers["x-next-cursor"];
+  } while (after);
+  return items;
+};
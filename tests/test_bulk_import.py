@@ -0,0 +1,104 @@
+import unittest
+
+import httpx
+from fastapi import HTTPException, Request
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from bulk_import import detect_format, import_rows, iter_rows
+
+
+def upload(*chunks: bytes, content_type: str = "text/csv") -> Request:
+    """A request whose body arrives in the given chunks."""
+    messages = [{"type": "http.request", "body": chunk, "more_body": position < len(chunks) - 1}
+                for position, chunk in enumerate(chunks)]
+
+    async def receive():
+        return messages.pop(0)
+
+    return Request({"type": "http", "method": "POST", "headers": [(b"content-type", content_type.encode())]}, receive)
+
+
+async def collect(rows):
+    return [row async for row in rows]
+
+
+class IterRowsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_csv_rows_split_across_chunks(self):
+        body = "\ufeffanimal_id,species,sex\r\nR1,Rat,M\r\nR2,Mouse,\r\n".encode()
+        # Split inside a line and inside the byte order mark
+        request = upload(body[:2], body[2:30], body[30:])
+
+        rows = await collect(iter_rows(request, "csv"))
+
+        self.assertEqual(rows, [
+            (1, {"animal_id": "R1", "species": "Rat", "sex": "M"}),
+            (2, {"animal_id": "R2", "species": "Mouse", "sex": None}),
+        ])
+
+    async def test_csv_column_count_mismatch_is_reported(self):
+        rows = await collect(iter_rows(upload(b"animal_id,species\nR1,Rat,M\nR2,Rat"), "csv"))
+
+        self.assertIsInstance(rows[0][1], ValueError)
+        self.assertEqual(rows[1], (2, {"animal_id": "R2", "species": "Rat"}))
+
+    async def test_ndjson_reports_bad_lines(self):
+        body = b'{"animal_id": "R1"}\n\nnot json\n[1, 2]\n{"animal_id": "R2"}'
+
+        rows = await collect(iter_rows(upload(body, content_type="application/x-ndjson"), "ndjson"))
+
+        self.assertEqual([number for number, _ in rows], [1, 2, 3, 4])
+        self.assertEqual(rows[0][1], {"animal_id": "R1"})
+        self.assertIsInstance(rows[1][1], ValueError)
+        self.assertIsInstance(rows[2][1], ValueError)
+        self.assertEqual(rows[3][1], {"animal_id": "R2"})
+
+    def test_format_from_parameter_or_content_type(self):
+        self.assertEqual(detect_format(upload(b"", content_type="application/x-ndjson"), None), "ndjson")
+        self.assertEqual(detect_format(upload(b"", content_type="text/csv; charset=utf-8"), None), "csv")
+        self.assertEqual(detect_format(upload(b"", content_type="application/json"), "csv"), "csv")
+        with self.assertRaises(HTTPException) as raised:
+            detect_format(upload(b"", content_type="application/json"), None)
+        self.assertEqual(raised.exception.status_code, 415)
+
+
+class ImportRowsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["bulk_import_test"]
+        await self.db.animals.create_index("id", unique=True)
+
+    async def test_rejected_writes_are_reported_per_row(self):
+        async def rows():
+            for number, animal_id in enumerate(["a1", "a2", "a1", "a3"], start=1):
+                yield number, {"id": animal_id}
+
+        report = await import_rows(self.db.animals, rows(), dict, chunk_size=3)
+
+        self.assertEqual(report["inserted"], 3)
+        self.assertEqual([error["row"] for error in report["errors"]], [3])
+        self.assertEqual(await self.db.animals.count_documents({}), 3)
+
+
+class BulkImportEndpointTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["bulk_import_test"]
+        previous, server.db = server.db, self.db
+        self.addCleanup(setattr, server, "db", previous)
+
+    async def test_valid_rows_are_stored_and_invalid_ones_reported(self):
+        body = "animal_id,species,sex,weight\nR1,Rat,M,250.5\nR2,Rat,,\nR3,Mouse,F,heavy\nR4,Mouse,F,\n"
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/api/animals/bulk", content=body, headers={"Content-Type": "text/csv"})
+
+        report = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((report["total_rows"], report["inserted"], report["failed"]), (4, 2, 2))
+        self.assertEqual([error["row"] for error in report["errors"]], [2, 3])
+        stored = await self.db.animals.find({}, {"_id": 0}).sort("animal_id", 1).to_list(None)
+        self.assertEqual([(animal["animal_id"], animal["weight"]) for animal in stored], [("R1", 250.5), ("R4", None)])
+        self.assertTrue(all(animal["id"] and animal["is_active"] for animal in stored))
+
+
+if __name__ == "__main__":
+    unittest.main()
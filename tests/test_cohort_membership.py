@@ -0,0 +1,60 @@
+import unittest
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from cost_rollups import ROLLUP_VISIT
+
+
+class CohortAnimalsBatchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["cohort_membership_test"]
+        previous, server.db = server.db, self.db
+        self.addCleanup(setattr, server, "db", previous)
+        transport = httpx.ASGITransport(app=server.app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        self.addAsyncCleanup(self.client.aclose)
+
+        await self.db.animals.insert_many([{"id": f"a{number}", "is_active": True} for number in range(1, 6)])
+        await self.db.studies.insert_one({"id": "s1"})
+        await self.db.cohorts.insert_one({"id": "c1", "study_id": "s1", "animal_ids": ["a1", "a2"]})
+        await self.db.study_procedures.insert_one(
+            {"id": "p1", "study_id": "s1", "master_procedure_id": "m1", "default_cost": 10.0, "currency": "USD"}
+        )
+        await self.db.visits.insert_one({"id": "v1", "study_id": "s1", "name": "Day 1", "cohort_ids": ["c1"]})
+        await self.db.visit_procedures.insert_one({"id": "vp1", "visit_id": "v1", "study_procedure_id": "p1"})
+
+    async def batch(self, cohort_id="c1", **body):
+        return await self.client.post(f"/api/cohorts/{cohort_id}/animals", json=body)
+
+    async def test_adds_and_removes_in_one_request(self):
+        response = await self.batch(add=["a3", "a4", "a1"], remove=["a2"])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()["animal_ids"]), ["a1", "a3", "a4"])
+        rollup = await self.db.cost_rollups.find_one({"kind": ROLLUP_VISIT, "id": "v1"})
+        self.assertEqual((rollup["total_animals"], rollup["costs_by_currency"]), (3, {"USD": 30.0}))
+
+    async def test_empty_batch_changes_nothing(self):
+        response = await self.batch()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["animal_ids"], ["a1", "a2"])
+        self.assertIsNone(await self.db.cost_rollups.find_one({}))
+
+    async def test_invalid_batches_are_rejected_without_writing(self):
+        for cohort_id, body, status in (
+            ("c1", {"add": ["a3"], "remove": ["a3"]}, 400),
+            ("c1", {"add": ["a3", "missing"]}, 404),
+            ("nope", {"add": ["a3"]}, 404),
+        ):
+            with self.subTest(cohort_id=cohort_id, body=body):
+                response = await self.batch(cohort_id, **body)
+                self.assertEqual(response.status_code, status)
+        cohort = await self.db.cohorts.find_one({"id": "c1"})
+        self.assertEqual(cohort["animal_ids"], ["a1", "a2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
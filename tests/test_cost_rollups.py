@@ -0,0 +1,160 @@
+import unittest
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+import cost_rollups
+from cost_engine import compute_study_costs
+from cost_rollups import (
+    ROLLUP_STUDY,
+    ROLLUP_VISIT,
+    get_study_rollup,
+    rebuild,
+    refresh_for_cohort,
+    refresh_for_master_procedure,
+    refresh_for_study_procedure,
+    refresh_studies,
+    refresh_visits,
+)
+
+STUDY_ID = "study-1"
+
+
+async def seed_study(db):
+    """Three visits stored without rollups, as on a database predating them."""
+    created = datetime(2024, 1, 1)
+    await db.cohorts.insert_many([
+        {"id": "c1", "study_id": STUDY_ID, "animal_ids": ["a1", "a2", "a3"]},
+        {"id": "c2", "study_id": STUDY_ID, "animal_ids": ["a4", "a5"]},
+    ])
+    await db.study_procedures.insert_many([
+        {"id": "p1", "study_id": STUDY_ID, "master_procedure_id": "m1", "study_specific_cost": 10.0,
+         "default_cost": 4.0, "currency": "USD"},
+        {"id": "p2", "study_id": STUDY_ID, "master_procedure_id": "m2", "study_specific_cost": None,
+         "default_cost": 25.0, "currency": "EUR"},
+    ])
+    await db.visits.insert_many([
+        {"id": "v1", "study_id": STUDY_ID, "name": "Day 1", "cohort_ids": ["c1", "c2"], "created_at": created},
+        {"id": "v2", "study_id": STUDY_ID, "name": "Day 7", "cohort_ids": ["c1"], "created_at": created},
+        {"id": "v3", "study_id": STUDY_ID, "name": "Day 14", "cohort_ids": ["c2"], "created_at": created},
+    ])
+    await db.visit_procedures.insert_many([
+        {"id": "vp1", "visit_id": "v1", "study_procedure_id": "p1"},
+        {"id": "vp2", "visit_id": "v2", "study_procedure_id": "p1"},
+        {"id": "vp3", "visit_id": "v3", "study_procedure_id": "p2"},
+    ])
+
+
+class CostRollupTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["cost_rollups_test"]
+        await seed_study(self.db)
+
+    async def stored_study(self):
+        return await self.db.cost_rollups.find_one({"kind": ROLLUP_STUDY, "id": STUDY_ID}, {"_id": 0})
+
+    async def assert_matches_engine(self):
+        rollup = await self.stored_study()
+        expected = await compute_study_costs(self.db, STUDY_ID)
+        self.assertEqual(rollup['costs_by_currency'], expected['costs_by_currency'])
+        self.assertEqual(rollup['visit_costs'], expected['visit_costs'])
+        self.assertEqual(await rebuild(self.db, verify_only=True), [])
+
+    async def test_first_visit_refresh_sums_every_visit_of_the_study(self):
+        await self.db.visit_procedures.insert_one({"id": "vp4", "visit_id": "v3", "study_procedure_id": "p1"})
+        await refresh_visits(self.db, {"id": "v3"})
+
+        rollup = await self.stored_study()
+        self.assertEqual(rollup['costs_by_currency'], {"USD": 100.0, "EUR": 50.0})
+        self.assertEqual([visit['visit_id'] for visit in rollup['visit_costs']], ["v1", "v2", "v3"])
+        await self.assert_matches_engine()
+
+    async def test_study_rollup_without_revision_is_recomputed(self):
+        # Written by an earlier refresh that only saw one visit
+        await self.db.cost_rollups.insert_one({
+            "kind": ROLLUP_STUDY, "id": STUDY_ID, "study_id": STUDY_ID,
+            "costs_by_currency": {"USD": 50.0}, "visit_costs": []
+        })
+
+        rollup = await get_study_rollup(self.db, STUDY_ID)
+
+        self.assertEqual(rollup['costs_by_currency'], {"USD": 80.0, "EUR": 50.0})
+        self.assertIn('revision', rollup)
+        await self.assert_matches_engine()
+
+    async def test_unknown_study_is_not_stored(self):
+        rollup = await get_study_rollup(self.db, "missing")
+
+        self.assertEqual(rollup['costs_by_currency'], {})
+        self.assertEqual(await self.db.cost_rollups.count_documents({}), 0)
+
+    async def test_cohort_change_refreshes_its_visits(self):
+        await refresh_studies(self.db, [STUDY_ID])
+        await self.db.cohorts.update_one({"id": "c2"}, {"$push": {"animal_ids": "a6"}})
+        await refresh_for_cohort(self.db, "c2")
+
+        visit = await self.db.cost_rollups.find_one({"kind": ROLLUP_VISIT, "id": "v3"})
+        self.assertEqual(visit['total_animals'], 3)
+        self.assertEqual(visit['costs_by_currency'], {"EUR": 75.0})
+        await self.assert_matches_engine()
+
+    async def test_study_procedure_cost_change_refreshes_its_visits(self):
+        await refresh_studies(self.db, [STUDY_ID])
+        await self.db.study_procedures.update_one({"id": "p1"}, {"$set": {"study_specific_cost": 20.0}})
+        await refresh_for_study_procedure(self.db, "p1")
+
+        self.assertEqual((await self.stored_study())['costs_by_currency'], {"USD": 160.0, "EUR": 50.0})
+        await self.assert_matches_engine()
+
+    async def test_master_price_change_refreshes_procedures_falling_back_to_it(self):
+        # Imported before default_cost was snapshotted, so it prices at the master's
+        await self.db.master_procedures.insert_one({"id": "m3", "default_cost": 7.0})
+        await self.db.study_procedures.insert_one(
+            {"id": "p3", "study_id": STUDY_ID, "master_procedure_id": "m3", "study_specific_cost": None, "currency": "USD"}
+        )
+        await self.db.visit_procedures.insert_one({"id": "vp4", "visit_id": "v2", "study_procedure_id": "p3"})
+        await refresh_studies(self.db, [STUDY_ID])
+        self.assertEqual((await self.stored_study())['costs_by_currency'], {"USD": 101.0, "EUR": 50.0})
+
+        await self.db.master_procedures.update_one({"id": "m3"}, {"$set": {"default_cost": 9.0}})
+        await refresh_for_master_procedure(self.db, "m3")
+
+        self.assertEqual((await self.stored_study())['costs_by_currency'], {"USD": 107.0, "EUR": 50.0})
+        await self.assert_matches_engine()
+
+    async def test_stale_refresh_does_not_overwrite_a_newer_rollup(self):
+        await refresh_studies(self.db, [STUDY_ID])
+        revisions = await cost_rollups._stored_revisions(self.db, ROLLUP_VISIT, ["v1"])
+        # A concurrent refresh stores its rollup after ours read the revision
+        await refresh_visits(self.db, {"id": "v1"})
+
+        stale = {"kind": ROLLUP_VISIT, "id": "v1", "study_id": STUDY_ID, "costs_by_currency": {"USD": 1.0}}
+        conflicts = await cost_rollups._write_rollups(self.db, ROLLUP_VISIT, {"v1": stale}, revisions)
+
+        self.assertEqual(conflicts, ["v1"])
+        visit = await self.db.cost_rollups.find_one({"kind": ROLLUP_VISIT, "id": "v1"})
+        self.assertEqual(visit['costs_by_currency'], {"USD": 50.0})
+
+    async def test_refresh_recomputes_after_a_concurrent_change(self):
+        await refresh_studies(self.db, [STUDY_ID])
+        calls = []
+
+        async def compute(visit_ids):
+            rollups = await cost_rollups._compute_visit_rollups(self.db, visit_ids)
+            if not calls:
+                # Another request changes the cohort and refreshes between our read and write
+                await self.db.cohorts.update_one({"id": "c1"}, {"$pull": {"animal_ids": "a3"}})
+                await refresh_for_cohort(self.db, "c1")
+            calls.append(visit_ids)
+            return rollups
+
+        refreshed = await cost_rollups._refresh_guarded(self.db, ROLLUP_VISIT, ["v2"], compute)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(refreshed["v2"]['costs_by_currency'], {"USD": 20.0})
+        await refresh_studies(self.db, [STUDY_ID])
+        await self.assert_matches_engine()
+
+
+if __name__ == "__main__":
+    unittest.main()
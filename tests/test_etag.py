@@ -0,0 +1,53 @@
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+
+from bulk_import import import_rows
+from etag import bump_collection_version, collection_version, make_etag
+
+
+async def rows(*items):
+    for number, item in enumerate(items, start=1):
+        yield number, item
+
+
+class CollectionVersionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["etag_test"]
+
+    async def test_bump_changes_only_the_named_collections(self):
+        self.assertEqual(await collection_version(self.db, "visits"), 0)
+
+        await bump_collection_version(self.db, "visits", "visit_procedures")
+        await bump_collection_version(self.db, "visits")
+
+        self.assertEqual(await collection_version(self.db, "visits"), 2)
+        self.assertEqual(await collection_version(self.db, "visit_procedures"), 1)
+        self.assertEqual(await collection_version(self.db, "animals"), 0)
+
+    async def test_delete_and_older_insert_change_the_list_etag(self):
+        # (count, latest timestamp) stayed the same for this pair of writes
+        before = make_etag("animals", await collection_version(self.db, "animals"), None, None)
+        await self.db.animals.delete_one({"id": "a1"})
+        await bump_collection_version(self.db, "animals")
+        await self.db.animals.insert_one({"id": "a0"})
+        await bump_collection_version(self.db, "animals")
+
+        after = make_etag("animals", await collection_version(self.db, "animals"), None, None)
+        self.assertNotEqual(before, after)
+
+    async def test_bulk_import_bumps_after_each_stored_batch(self):
+        bumps = []
+
+        async def on_insert():
+            bumps.append(await self.db.animals.count_documents({}))
+
+        report = await import_rows(self.db.animals, rows({"id": "a1"}, {"id": "a2"}, ValueError("bad"), {"id": "a3"}),
+                                   dict, chunk_size=2, on_insert=on_insert)
+
+        self.assertEqual(report["inserted"], 3)
+        self.assertEqual(bumps, [2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+
+from export import procedure_rows, visit_rows
+
+from .test_cost_rollups import STUDY_ID, seed_study
+
+
+async def collect(chunks):
+    return [row async for chunk in chunks for row in chunk]
+
+
+class ExportTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["export_test"]
+        await seed_study(self.db)
+        await self.db.fx_rates.insert_one({"id": "r1", "currency": "EUR", "rate": 1.2, "effective_date": "2000-01-01"})
+
+    async def test_visits_without_rollups_export_their_cost(self):
+        rows = await collect(visit_rows(self.db, STUDY_ID, 2))
+
+        costs = {row['id']: (row['total_cost'], row['currency']) for row in rows}
+        self.assertEqual(costs, {"v1": (50.0, "USD"), "v2": (30.0, "USD"), "v3": (60.0, "USD")})
+        self.assertEqual(rows[0]['cohort_ids'], "c1; c2")
+
+    async def test_missing_rate_exports_an_empty_cost(self):
+        await self.db.fx_rates.delete_many({})
+
+        rows = await collect(visit_rows(self.db, STUDY_ID, 10))
+
+        costs = {row['id']: row['total_cost'] for row in rows}
+        self.assertEqual(costs, {"v1": 50.0, "v2": 30.0, "v3": None})
+
+    async def test_procedures_export_their_effective_cost(self):
+        rows = await collect(procedure_rows(self.db, STUDY_ID, 10))
+
+        self.assertEqual({row['id']: (row['cost'], row['currency']) for row in rows},
+                         {"vp1": (10.0, "USD"), "vp2": (10.0, "USD"), "vp3": (25.0, "EUR")})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import unittest
+from datetime import date, datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from cost_engine import compute_study_costs
+from forecast import MAX_ADDED_VISITS, evaluate_scenarios, load_study_matrix
+from fx import RateTable, convert
+
+STUDY_ID = "study-1"
+ON = date(2024, 6, 1)
+RATES = RateTable([{"currency": "EUR", "rate": 1.2, "effective_date": "2024-01-01"}], base="USD")
+
+
+async def seed_study(db):
+    """Two cohorts, three visits and procedures in USD, EUR and (legacy) lower-case usd."""
+    created = datetime(2024, 1, 1)
+    await db.master_procedures.insert_one({"id": "m3", "default_cost": 7.0})
+    await db.cohorts.insert_many([
+        {"id": "c1", "study_id": STUDY_ID, "animal_ids": ["a1", "a2", "a3"], "planned_animal_count": 4,
+         "created_at": created},
+        {"id": "c2", "study_id": STUDY_ID, "animal_ids": ["a4", "a5"], "planned_animal_count": 5,
+         "created_at": created},
+    ])
+    await db.study_procedures.insert_many([
+        # Override wins over the default cost
+        {"id": "p1", "study_id": STUDY_ID, "master_procedure_id": "m1", "name": "Weigh", "category": "In-life Measurement",
+         "study_specific_cost": 10.0, "default_cost": 4.0, "currency": "USD", "imported_at": created},
+        {"id": "p2", "study_id": STUDY_ID, "master_procedure_id": "m2", "name": "Bleed", "category": "Sample Collection",
+         "study_specific_cost": None, "default_cost": 25.0, "currency": "EUR", "imported_at": created},
+        # Imported before default_cost was snapshotted: falls back to the master
+        {"id": "p3", "study_id": STUDY_ID, "master_procedure_id": "m3", "name": "Observe", "category": "Observation",
+         "study_specific_cost": None, "currency": "usd", "imported_at": created},
+    ])
+    await db.visits.insert_many([
+        {"id": "v1", "study_id": STUDY_ID, "name": "Day 1", "cohort_ids": ["c1", "c2"], "planned_date": "2024-01-02",
+         "created_at": created},
+        {"id": "v2", "study_id": STUDY_ID, "name": "Day 7", "cohort_ids": ["c1"], "planned_date": "2024-01-08",
+         "created_at": created},
+        {"id": "v3", "study_id": STUDY_ID, "name": "Day 14", "cohort_ids": ["c2"], "planned_date": "2024-01-15",
+         "created_at": created},
+    ])
+    await db.visit_procedures.insert_many([
+        {"id": "vp1", "visit_id": "v1", "study_procedure_id": "p1"},
+        {"id": "vp2", "visit_id": "v1", "study_procedure_id": "p2"},
+        {"id": "vp3", "visit_id": "v2", "study_procedure_id": "p1"},
+        {"id": "vp4", "visit_id": "v2", "study_procedure_id": "p3"},
+        {"id": "vp5", "visit_id": "v3", "study_procedure_id": "p2"},
+        {"id": "vp6", "visit_id": "v3", "study_procedure_id": "p3"},
+    ])
+
+
+class ForecastBaselineTest(unittest.IsolatedAsyncioTestCase):
+    """The unchanged baseline must price the study exactly like the cost engine."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["forecast_test"]
+        await seed_study(self.db)
+
+    async def engine_costs(self):
+        costs = await compute_study_costs(self.db, STUDY_ID)
+        factors = RATES.factors(costs['costs_by_currency'], "USD", ON)
+        by_visit = {visit['visit_id']: convert(visit['costs_by_currency'], factors) for visit in costs['visit_costs']}
+        return convert(costs['costs_by_currency'], factors), by_visit
+
+    async def test_baseline_matches_cost_engine(self):
+        matrix = await load_study_matrix(self.db, STUDY_ID, RATES, "USD", ON)
+        [baseline] = evaluate_scenarios(matrix, [])
+        total, by_visit = await self.engine_costs()
+
+        self.assertEqual(baseline["name"], "baseline")
+        self.assertAlmostEqual(baseline["total_cost"], total)
+        self.assertEqual(baseline["difference"], 0)
+        self.assertEqual({visit["visit_id"] for visit in baseline["by_visit"]}, set(by_visit))
+        for visit in baseline["by_visit"]:
+            self.assertAlmostEqual(visit["cost"], by_visit[visit["visit_id"]])
+        self.assertAlmostEqual(sum(baseline["by_category"].values()), total)
+        self.assertAlmostEqual(sum(procedure["cost"] for procedure in baseline["by_procedure"]), total)
+
+    async def test_scenario_matches_engine_after_same_change(self):
+        matrix = await load_study_matrix(self.db, STUDY_ID, RATES, "USD", ON)
+        _, scenario = evaluate_scenarios(matrix, [
+            {"name": "bigger", "cohort_sizes": {"c2": 6}, "cost_overrides": {"p3": 9.0}},
+        ])
+        await self.db.cohorts.update_one({"id": "c2"}, {"$set": {"animal_ids": [f"b{n}" for n in range(6)]}})
+        await self.db.study_procedures.update_one({"id": "p3"}, {"$set": {"study_specific_cost": 9.0}})
+        total, _ = await self.engine_costs()
+        self.assertAlmostEqual(scenario["total_cost"], total)
+
+    async def test_forecast_in_another_currency(self):
+        usd = evaluate_scenarios(await load_study_matrix(self.db, STUDY_ID, RATES, "USD", ON), [])[0]
+        eur = evaluate_scenarios(await load_study_matrix(self.db, STUDY_ID, RATES, "eur", ON), [])[0]
+        self.assertEqual(eur["currency"], "EUR")
+        self.assertAlmostEqual(eur["total_cost"] * 1.2, usd["total_cost"])
+
+    async def test_missing_rate(self):
+        with self.assertRaises(ValueError):
+            await load_study_matrix(self.db, STUDY_ID, RATES, "USD", date(2023, 6, 1))
+
+
+class EvaluateScenariosTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db = AsyncMongoMockClient()["forecast_test"]
+        await seed_study(db)
+        self.matrix = await load_study_matrix(db, STUDY_ID, RATES, "USD", ON)
+
+    def test_planned_basis_and_multipliers(self):
+        baseline, planned, pricier = evaluate_scenarios(self.matrix, [
+            {"name": "planned", "animal_basis": "planned"},
+            {"name": "pricier", "category_multipliers": {"Sample Collection": 2}, "cost_multipliers": {"p1": 1.5}},
+        ])
+        self.assertGreater(planned["total_cost"], baseline["total_cost"])
+        self.assertAlmostEqual(pricier["by_category"]["Sample Collection"], 2 * baseline["by_category"]["Sample Collection"])
+        self.assertAlmostEqual(pricier["by_category"]["In-life Measurement"],
+                               1.5 * baseline["by_category"]["In-life Measurement"])
+        self.assertAlmostEqual(pricier["by_category"]["Observation"], baseline["by_category"]["Observation"])
+
+    def test_added_visits_only_count_for_their_scenario(self):
+        baseline, added, other = evaluate_scenarios(self.matrix, [
+            {"name": "added", "added_visits": [{"name": "Extra", "study_procedure_ids": ["p1"], "cohort_ids": ["c1"],
+                                                 "count": 2}]},
+            {"name": "other"},
+        ])
+        self.assertAlmostEqual(added["difference"], 2 * 3 * 10.0)
+        self.assertEqual([visit["visit_name"] for visit in added["by_visit"] if visit["added"]], ["Extra 1", "Extra 2"])
+        self.assertAlmostEqual(other["total_cost"], baseline["total_cost"])
+        self.assertFalse(any(visit["added"] for visit in other["by_visit"]))
+
+    def test_invalid_scenarios(self):
+        for scenario in (
+            {"name": "x", "cohort_sizes": {"nope": 1}},
+            {"name": "x", "animal_basis": "guessed"},
+            {"name": "x", "category_multipliers": {"Unknown": 2}},
+            {"name": "x", "added_visits": [{"name": "v", "count": MAX_ADDED_VISITS + 1}]},
+            {"name": "x", "cohort_sizes": {"c1": -1}},
+            {"name": "x", "cost_overrides": {"p1": float("nan")}},
+            {"name": "x", "cost_multipliers": {"p1": float("inf")}},
+            {"name": "x", "category_multipliers": {"Observation": -0.5}},
+        ):
+            with self.subTest(scenario=scenario):
+                with self.assertRaises(ValueError):
+                    evaluate_scenarios(self.matrix, [scenario])
+
+
+class ForecastRequestTest(unittest.IsolatedAsyncioTestCase):
+    """Scenario values are validated before anything reaches the matrices."""
+
+    async def test_negative_and_non_finite_values_are_a_422(self):
+        import httpx
+        import server
+
+        bodies = [
+            '{"scenarios": [{"name": "x", "cohort_sizes": {"c1": -3}}]}',
+            '{"scenarios": [{"name": "x", "cost_overrides": {"p1": -1.5}}]}',
+            '{"scenarios": [{"name": "x", "cost_overrides": {"p1": NaN}}]}',
+            '{"scenarios": [{"name": "x", "cost_multipliers": {"p1": Infinity}}]}',
+            '{"scenarios": [{"name": "x", "category_multipliers": {"Observation": -1}}]}',
+        ]
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for body in bodies:
+                with self.subTest(body=body):
+                    response = await client.post(f"/api/studies/{STUDY_ID}/forecast", content=body,
+                                                 headers={"Content-Type": "application/json"})
+                    self.assertEqual(response.status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from datetime import date
+
+from fx import FX_BASE_CURRENCY, RateTable, add_amounts, convert, converted_costs, currency_code
+
+RATES = [
+    {"currency": "EUR", "rate": 1.10, "effective_date": "2024-01-01"},
+    {"currency": "EUR", "rate": 1.20, "effective_date": "2024-07-01"},
+    {"currency": "GBP", "rate": 1.25, "effective_date": "2024-03-15"},
+    {"currency": "eur", "rate": 1.05, "effective_date": "2023-06-01"},
+]
+
+
+class RateTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = RateTable(RATES, base="USD")
+
+    def test_rate_effective_on_date(self):
+        cases = {
+            date(2023, 6, 1): 1.05,
+            date(2023, 12, 31): 1.05,
+            date(2024, 1, 1): 1.10,
+            date(2024, 6, 30): 1.10,
+            date(2024, 7, 1): 1.20,
+            date(2030, 1, 1): 1.20,
+        }
+        for on, rate in cases.items():
+            with self.subTest(on=on):
+                self.assertEqual(self.table.rate("EUR", on), rate)
+
+    def test_base_currency_is_one(self):
+        self.assertEqual(self.table.rate("USD", date(1990, 1, 1)), 1.0)
+
+    def test_currency_codes_are_case_insensitive(self):
+        self.assertEqual(self.table.rate("eur", date(2024, 2, 1)), 1.10)
+        self.assertEqual(self.table.rate("usd", date(2024, 2, 1)), 1.0)
+
+    def test_no_rate_before_first_effective_date(self):
+        for currency, on in (("GBP", date(2024, 3, 14)), ("JPY", date(2024, 3, 14)), ("EUR", date(2023, 5, 31))):
+            with self.subTest(currency=currency):
+                with self.assertRaises(ValueError):
+                    self.table.rate(currency, on)
+
+    def test_factors_into_base_and_other_currencies(self):
+        on = date(2024, 8, 1)
+        self.assertEqual(self.table.factors(["EUR", "USD"], "USD", on), {"EUR": 1.20, "USD": 1.0})
+        factors = self.table.factors(["EUR", "USD", "GBP"], "GBP", on)
+        self.assertAlmostEqual(factors["EUR"], 1.20 / 1.25)
+        self.assertAlmostEqual(factors["USD"], 1 / 1.25)
+        self.assertEqual(factors["GBP"], 1.0)
+        self.assertAlmostEqual(convert({"EUR": 100, "USD": 50}, factors), (120 + 50) / 1.25)
+
+    def test_factors_raise_for_a_missing_rate(self):
+        with self.assertRaises(ValueError):
+            self.table.factors(["EUR", "GBP"], "USD", date(2024, 2, 1))
+
+    def test_available_factors_list_missing_currencies(self):
+        factors, missing = self.table.available_factors(["EUR", "GBP", "JPY"], "USD", date(2024, 2, 1))
+        self.assertEqual(factors, {"EUR": 1.10})
+        self.assertEqual(missing, ["GBP", "JPY"])
+
+    def test_available_factors_with_unknown_target(self):
+        factors, missing = self.table.available_factors(["EUR", "CHF"], "CHF", date(2024, 2, 1))
+        self.assertEqual(factors, {"CHF": 1.0})
+        self.assertEqual(missing, ["CHF"])
+
+    def test_currencies(self):
+        self.assertEqual(self.table.currencies, ["EUR", "GBP", "USD"])
+
+
+class ConvertedCostsTest(unittest.TestCase):
+    def setUp(self):
+        self.table = RateTable(RATES, base="USD")
+
+    def test_converted_total(self):
+        costs = converted_costs({"EUR": 100.0, "USD": 5.0}, self.table, None, date(2024, 8, 1))
+        self.assertAlmostEqual(costs["total_cost"], 125.0)
+        self.assertEqual(costs["currency"], "USD")
+        self.assertEqual(costs["missing_rates"], [])
+        self.assertEqual(costs["fx_date"], "2024-08-01")
+
+    def test_missing_rate_keeps_native_totals(self):
+        costs = converted_costs({"GBP": 10.0, "USD": 5.0}, self.table, "usd", date(2024, 1, 1))
+        self.assertIsNone(costs["total_cost"])
+        self.assertEqual(costs["costs_by_currency"], {"GBP": 10.0, "USD": 5.0})
+        self.assertEqual(costs["missing_rates"], ["GBP"])
+
+    def test_lower_case_totals_are_merged(self):
+        costs = converted_costs({"usd": 2.0, "USD": 3.0}, self.table, None, date(2024, 1, 1))
+        self.assertEqual(costs["costs_by_currency"], {"USD": 5.0})
+        self.assertEqual(costs["total_cost"], 5.0)
+
+    def test_add_amounts_and_currency_code(self):
+        self.assertEqual(add_amounts({"USD": 1.0}, {"usd": 2.0, "EUR": 3.0}), {"USD": 3.0, "EUR": 3.0})
+        self.assertEqual(currency_code(" eur "), "EUR")
+        self.assertEqual(currency_code(None), FX_BASE_CURRENCY)
+
+
+if __name__ == "__main__":
+    unittest.main()
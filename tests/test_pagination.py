@@ -0,0 +1,89 @@
+import unittest
+from datetime import datetime
+
+from fastapi import HTTPException, Response
+from mongomock_motor import AsyncMongoMockClient
+
+from pagination import (
+    DEFAULT_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    PageParams,
+    decode_cursor,
+    encode_cursor,
+    fetch_page,
+    keyset_filter,
+)
+
+
+class CursorTest(unittest.TestCase):
+    """Keyset cursors round-trip the sort value and id of the last document."""
+
+    def test_datetime_round_trip(self):
+        created_at = datetime(2024, 3, 1, 12, 30, 15, 250000)
+        cursor = encode_cursor({"id": "a1", "created_at": created_at}, "created_at")
+        self.assertEqual(decode_cursor(cursor), (created_at, "a1"))
+
+    def test_plain_value_round_trip(self):
+        cursor = encode_cursor({"id": "a2", "name": "Day 7"}, "name")
+        self.assertEqual(decode_cursor(cursor), ("Day 7", "a2"))
+
+    def test_missing_sort_value_round_trips_as_none(self):
+        cursor = encode_cursor({"id": "a3"}, "imported_at")
+        self.assertEqual(decode_cursor(cursor), (None, "a3"))
+
+    def test_cursor_is_url_safe_without_padding(self):
+        cursor = encode_cursor({"id": "x" * 7, "created_at": datetime(2024, 1, 1)}, "created_at")
+        self.assertNotIn("=", cursor)
+        self.assertRegex(cursor, r"^[A-Za-z0-9_-]+$")
+
+    def test_invalid_cursor_is_a_400(self):
+        for cursor in ("not-a-cursor", "e30", encode_cursor({"id": "a"}, "id")[:-2] + "!!"):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(HTTPException) as raised:
+                    decode_cursor(cursor)
+                self.assertEqual(raised.exception.status_code, 400)
+
+
+class KeysetFilterTest(unittest.TestCase):
+    def test_first_page_keeps_filter(self):
+        self.assertEqual(keyset_filter({"is_active": True}, "created_at", None), {"is_active": True})
+
+    def test_later_page_starts_after_cursor(self):
+        created_at = datetime(2024, 3, 1)
+        cursor = encode_cursor({"id": "a1", "created_at": created_at}, "created_at")
+        position = {"$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": "a1"}},
+        ]}
+        self.assertEqual(keyset_filter({}, "created_at", cursor), position)
+        self.assertEqual(keyset_filter({"is_active": True}, "created_at", cursor),
+                         {"$and": [{"is_active": True}, position]})
+
+
+class DefaultPageSizeTest(unittest.IsolatedAsyncioTestCase):
+    """JSON pages are bounded even when the client does not pass a limit."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["pagination_test"]
+        await self.db.animals.insert_many([
+            {"id": f"a{number:04d}", "created_at": datetime(2024, 1, 1)} for number in range(DEFAULT_PAGE_SIZE + 5)
+        ])
+
+    async def test_json_defaults_to_a_bounded_page(self):
+        page = PageParams(limit=None, after=None, response_format="json")
+        response = Response()
+
+        first = await fetch_page(self.db.animals, {}, page, response)
+
+        self.assertEqual(len(first), DEFAULT_PAGE_SIZE)
+        page = PageParams(limit=None, after=response.headers[NEXT_CURSOR_HEADER], response_format="json")
+        rest = await fetch_page(self.db.animals, {}, page, Response())
+        self.assertEqual([doc['id'] for doc in rest], [f"a{number:04d}" for number in range(DEFAULT_PAGE_SIZE, DEFAULT_PAGE_SIZE + 5)])
+
+    def test_ndjson_streams_everything_unless_limited(self):
+        self.assertIsNone(PageParams(limit=None, after=None, response_format="ndjson").limit)
+        self.assertEqual(PageParams(limit=10, after=None, response_format="ndjson").limit, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from procedure_tree import (
+    backfill_paths,
+    build_tree,
+    load_ancestors,
+    load_forest,
+    load_subtree,
+    move_procedure,
+    path_under,
+    subtree_cost_totals,
+)
+
+NOW = datetime(2024, 6, 1)
+
+
+async def add_procedure(db, procedure_id, parent_id=None, default_cost=10.0, currency="USD", name=None):
+    path = await path_under(db, parent_id)
+    await db.master_procedures.insert_one({
+        "id": procedure_id, "name": name or procedure_id.upper(), "parent_id": parent_id, "path": path,
+        "depth": len(path), "default_cost": default_cost, "currency": currency, "is_active": True,
+    })
+
+
+class ProcedureTreeTestCase(unittest.IsolatedAsyncioTestCase):
+    """a > b > c and a > d."""
+
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["procedure_tree_test"]
+        await add_procedure(self.db, "a")
+        await add_procedure(self.db, "b", "a")
+        await add_procedure(self.db, "c", "b", 5.0, "EUR")
+        await add_procedure(self.db, "d", "a", 1.0)
+
+    async def stored(self, procedure_id):
+        return await self.db.master_procedures.find_one({"id": procedure_id}, {"_id": 0})
+
+
+class MoveProcedureTest(ProcedureTreeTestCase):
+    async def test_new_child_path(self):
+        self.assertEqual(await path_under(self.db, None), [])
+        self.assertEqual(await path_under(self.db, "c"), ["a", "b", "c"])
+        with self.assertRaises(ValueError):
+            await path_under(self.db, "nope")
+
+    async def test_move_rewrites_the_subtree_paths(self):
+        self.assertTrue(await move_procedure(self.db, "b", "d", NOW))
+
+        self.assertEqual({key: (await self.stored("b"))[key] for key in ("parent_id", "path", "depth")},
+                         {"parent_id": "d", "path": ["a", "d"], "depth": 2})
+        self.assertEqual((await self.stored("c"))['path'], ["a", "d", "b"])
+        self.assertEqual((await self.stored("c"))['updated_at'], NOW)
+        self.assertEqual((await self.stored("d"))['path'], ["a"])
+
+    async def test_move_to_the_top_level(self):
+        await move_procedure(self.db, "b", None, NOW)
+
+        self.assertEqual(((await self.stored("b"))['parent_id'], (await self.stored("b"))['path']), (None, []))
+        self.assertEqual((await self.stored("c"))['path'], ["b"])
+
+    async def test_moves_below_itself_are_rejected(self):
+        for procedure_id, parent_id in (("a", "a"), ("b", "c")):
+            with self.subTest(procedure_id=procedure_id, parent_id=parent_id):
+                with self.assertRaises(ValueError):
+                    await move_procedure(self.db, procedure_id, parent_id, NOW)
+        self.assertEqual((await self.stored("c"))['path'], ["a", "b"])
+
+    async def test_unknown_procedure_or_parent(self):
+        self.assertFalse(await move_procedure(self.db, "nope", "a", NOW))
+        with self.assertRaises(ValueError):
+            await move_procedure(self.db, "b", "nope", NOW)
+
+    async def test_current_parent_is_not_a_move(self):
+        # An update echoing the stored parent_id, top level included
+        self.assertTrue(await move_procedure(self.db, "b", "a", NOW))
+        self.assertTrue(await move_procedure(self.db, "a", None, NOW))
+
+        self.assertNotIn("updated_at", await self.stored("a"))
+        self.assertNotIn("updated_at", await self.stored("b"))
+        self.assertEqual((await self.stored("c"))['path'], ["a", "b"])
+
+
+class TreeQueryTest(ProcedureTreeTestCase):
+    @staticmethod
+    def shape(node):
+        return node['id'], [TreeQueryTest.shape(child) for child in node['children']]
+
+    async def test_subtree_and_depth_limit(self):
+        self.assertEqual(self.shape(await load_subtree(self.db, "a")), ("a", [("b", [("c", [])]), ("d", [])]))
+        self.assertEqual(self.shape(await load_subtree(self.db, "a", max_depth=1)), ("a", [("b", []), ("d", [])]))
+        self.assertEqual(self.shape(await load_subtree(self.db, "b")), ("b", [("c", [])]))
+        self.assertIsNone(await load_subtree(self.db, "nope"))
+
+    async def test_archived_procedures_hide_their_subtree(self):
+        await self.db.master_procedures.update_one({"id": "b"}, {"$set": {"is_active": False}})
+
+        self.assertEqual(self.shape(await load_subtree(self.db, "a", active_only=True)), ("a", [("d", [])]))
+
+    async def test_forest(self):
+        await add_procedure(self.db, "e")
+
+        self.assertEqual([self.shape(root) for root in await load_forest(self.db, max_depth=1)],
+                         [("a", [("b", []), ("d", [])]), ("e", [])])
+
+    async def test_ancestors_from_the_root_down(self):
+        self.assertEqual([ancestor['id'] for ancestor in await load_ancestors(self.db, "c")], ["a", "b"])
+        self.assertEqual(await load_ancestors(self.db, "a"), [])
+        self.assertIsNone(await load_ancestors(self.db, "nope"))
+
+    def test_children_are_ordered_by_name(self):
+        nodes = [{"id": "r", "name": "Root"}, {"id": "x", "name": "Zeta", "parent_id": "r"},
+                 {"id": "y", "name": "Alpha", "parent_id": "r"}]
+
+        [root] = build_tree(nodes, ["r"])
+        self.assertEqual([child['name'] for child in root['children']], ["Alpha", "Zeta"])
+
+    async def test_cost_totals_per_direct_child(self):
+        totals = await subtree_cost_totals(self.db, "a")
+
+        self.assertEqual(totals['costs_by_currency'], {"USD": 21.0, "EUR": 5.0})
+        self.assertEqual(totals['procedure_count'], 4)
+        self.assertEqual([(child['procedure_id'], child['costs_by_currency'], child['procedure_count'])
+                          for child in totals['children']],
+                         [("b", {"USD": 10.0, "EUR": 5.0}, 2), ("d", {"USD": 1.0}, 1)])
+        self.assertIsNone(await subtree_cost_totals(self.db, "nope"))
+
+
+class BackfillPathsTest(ProcedureTreeTestCase):
+    async def test_paths_are_rebuilt_from_parent_ids(self):
+        await self.db.master_procedures.update_many({}, {"$unset": {"path": "", "depth": ""}})
+
+        self.assertEqual(await backfill_paths(self.db), 4)
+        self.assertEqual({key: (await self.stored("c"))[key] for key in ("path", "depth")},
+                         {"path": ["a", "b"], "depth": 2})
+        self.assertEqual(await backfill_paths(self.db), 0)
+
+    async def test_cycles_and_missing_parents_terminate(self):
+        await self.db.master_procedures.insert_many([
+            {"id": "x", "parent_id": "y"}, {"id": "y", "parent_id": "x"}, {"id": "z", "parent_id": "gone"},
+        ])
+
+        await backfill_paths(self.db)
+        self.assertEqual((await self.stored("x"))['path'], ["y"])
+        self.assertEqual((await self.stored("z"))['path'], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
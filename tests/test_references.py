@@ -0,0 +1,57 @@
+import unittest
+
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+from references import Reference, resolve_references
+
+
+class ResolveReferencesTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["references_test"]
+        await self.db.studies.insert_one({"id": "s1", "name": "Tox", "start_date": "2024-01-01"})
+        await self.db.cohorts.insert_many([
+            {"id": "c1", "study_id": "s1", "name": "Low"},
+            {"id": "c2", "study_id": "s1", "name": "High"},
+            {"id": "c3", "study_id": "s2", "name": "Other"},
+        ])
+
+    async def assert_not_found(self, detail, *references):
+        with self.assertRaises(HTTPException) as raised:
+            await resolve_references(self.db, *references)
+        self.assertEqual((raised.exception.status_code, raised.exception.detail), (404, detail))
+
+    async def test_returns_documents_keyed_by_id_per_reference(self):
+        studies, cohorts, empty = await resolve_references(
+            self.db,
+            Reference("studies", ["s1"], "Study not found", projection={"_id": 0, "start_date": 1}),
+            Reference("cohorts", ["c2", "c1", "c2"], "Cohort {id} not found"),
+            Reference("animals", [], "Animal {id} not found"),
+        )
+
+        self.assertEqual(studies, {"s1": {"id": "s1", "start_date": "2024-01-01"}})
+        self.assertEqual(cohorts, {"c1": {"id": "c1"}, "c2": {"id": "c2"}})
+        self.assertEqual(empty, {})
+
+    async def test_first_missing_id_in_declaration_order_is_reported(self):
+        await self.assert_not_found(
+            "Study not found",
+            Reference("studies", ["nope"], "Study not found"),
+            Reference("cohorts", ["missing"], "Cohort {id} not found"),
+        )
+        await self.assert_not_found(
+            "Cohort c9 not found",
+            Reference("studies", ["s1"], "Study not found"),
+            Reference("cohorts", ["c1", "c9", "c8"], "Cohort {id} not found"),
+        )
+
+    async def test_filter_scopes_the_lookup(self):
+        # c3 exists, but in another study
+        await self.assert_not_found(
+            "Cohort c3 not found in study",
+            Reference("cohorts", ["c1", "c3"], "Cohort {id} not found in study", filter={"study_id": "s1"}),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
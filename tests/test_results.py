@@ -0,0 +1,67 @@
+import unittest
+from datetime import date, datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from results import RESULTS_COLLECTION, field_history, store_results, visit_results
+
+RECORDED = datetime(2024, 1, 8, 9, 30)
+STUDY_PROCEDURE = {
+    "id": "p1", "study_id": "s1",
+    "input_fields": [
+        {"name": "weight", "field_type": "number", "units": "g"},
+        {"name": "notes", "field_type": "text"},
+    ],
+}
+
+
+def visit(visit_id, planned_date, actual_date=None):
+    return {"id": visit_id, "study_id": "s1", "planned_date": planned_date, "actual_date": actual_date}
+
+
+class ResultBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["results_test"]
+        await store_results(self.db, visit("v1", "2024-01-08"), STUDY_PROCEDURE, [
+            {"animal_id": "a1", "values": {"weight": 250.0, "notes": "calm"}, "recorded_at": RECORDED},
+            {"animal_id": "a2", "values": {"weight": 241.5}, "recorded_at": RECORDED},
+        ])
+
+    async def test_one_bucket_per_field_and_visit(self):
+        buckets = await self.db[RESULTS_COLLECTION].find({}, {"_id": 0}).sort("field", 1).to_list(None)
+
+        self.assertEqual([(bucket["field"], sorted(bucket["values"])) for bucket in buckets],
+                         [("notes", ["a1"]), ("weight", ["a1", "a2"])])
+        weight = buckets[1]
+        self.assertEqual((weight["study_id"], weight["visit_date"], weight["field_type"], weight["units"]),
+                         ("s1", "2024-01-08", "number", "g"))
+        self.assertEqual(weight["values"]["a1"], {"value": 250.0, "recorded_at": RECORDED})
+
+    async def test_resubmitting_overwrites_and_null_clears(self):
+        await store_results(self.db, visit("v1", "2024-01-08"), STUDY_PROCEDURE, [
+            {"animal_id": "a1", "values": {"weight": 252.0, "notes": None}},
+        ])
+
+        self.assertEqual(await visit_results(self.db, "v1"), [
+            {"animal_id": "a1", "study_procedure_id": "p1", "values": {"weight": 252.0}},
+            {"animal_id": "a2", "study_procedure_id": "p1", "values": {"weight": 241.5}},
+        ])
+        self.assertEqual(await self.db[RESULTS_COLLECTION].count_documents({}), 2)
+
+    async def test_field_history_across_visits(self):
+        # The actual date, when set, dates the bucket
+        await store_results(self.db, visit("v2", "2024-01-15", actual_date="2024-01-16"), STUDY_PROCEDURE, [
+            {"animal_id": "a1", "values": {"weight": 260.0}, "recorded_at": RECORDED},
+        ])
+
+        history = await field_history(self.db, "s1", "p1", "weight")
+        self.assertEqual([(row["visit_date"], row["animal_id"], row["value"]) for row in history], [
+            ("2024-01-08", "a1", 250.0), ("2024-01-08", "a2", 241.5), ("2024-01-16", "a1", 260.0),
+        ])
+        later = await field_history(self.db, "s1", "p1", "weight", date_from=date(2024, 1, 10))
+        self.assertEqual([row["visit_id"] for row in later], ["v2"])
+        self.assertEqual(await field_history(self.db, "s1", "p1", "weight", date_to=date(2024, 1, 1)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+from datetime import date
+
+from schedule import MAX_SCHEDULED_VISITS, Timepoint, expand_templates, parse_timepoint, timepoint_fields
+
+
+class ParseTimepointTest(unittest.TestCase):
+    def test_offsets(self):
+        cases = {
+            "Day 7": Timepoint(7),
+            "day 0": Timepoint(0),
+            "Day -3": Timepoint(-3),
+            "D14": Timepoint(14),
+            "Week 2": Timepoint(14),
+            "w4": Timepoint(28),
+        }
+        for text, expected in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(parse_timepoint(text), expected)
+
+    def test_windows(self):
+        cases = {
+            "Day 7 +/- 1 day": Timepoint(7, 1, 1),
+            "Day 7 ± 2": Timepoint(7, 2, 2),
+            "Day 7 (+/- 1 week)": Timepoint(7, 7, 7),
+            "Day 28 -2/+1 days": Timepoint(28, 2, 1),
+            "Day 28 +1/-2": Timepoint(28, 2, 1),
+            "Day 3 +1": Timepoint(3, 0, 1),
+            "Day 3 -2 days": Timepoint(3, 2, 0),
+        }
+        for text, expected in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(parse_timepoint(text), expected)
+
+    def test_unrecognized_text(self):
+        for text in ("", "Baseline", "Day seven", "Day 7 sometime", "Day 7 +1/+2"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_timepoint(text)
+
+    def test_describe_round_trips(self):
+        for timepoint in (Timepoint(7), Timepoint(14, 1, 1), Timepoint(28, 2, 1), Timepoint(3, 0, 1)):
+            with self.subTest(timepoint=timepoint):
+                self.assertEqual(parse_timepoint(timepoint.describe()), timepoint)
+
+    def test_timepoint_fields(self):
+        fields = timepoint_fields("Day 7 +/- 2 days", date(2024, 1, 8))
+        self.assertEqual(fields["timepoint_offset_days"], 7)
+        self.assertEqual(fields["window_start_date"], date(2024, 1, 6))
+        self.assertEqual(fields["window_end_date"], date(2024, 1, 10))
+        self.assertEqual(timepoint_fields("Screening", date(2024, 1, 8)), {})
+
+
+class ExpandTemplatesTest(unittest.TestCase):
+    start = date(2024, 1, 1)
+
+    def test_single_visit(self):
+        [visit] = expand_templates([{"name": "Dose", "label": "D", "planned_timepoint": "Day 1 +/- 1 day"}], self.start)
+        self.assertEqual(visit["planned_date"], date(2024, 1, 2))
+        self.assertEqual(visit["planned_timepoint"], "Day 1 +/- 1 day")
+        self.assertEqual((visit["window_start_date"], visit["window_end_date"]), (date(2024, 1, 1), date(2024, 1, 3)))
+        self.assertEqual(visit["study_procedure_ids"], [])
+
+    def test_repeating_template_with_placeholders(self):
+        visits = expand_templates([{
+            "name": "Weigh week {week}", "label": "W{n}", "planned_timepoint": "Week 1",
+            "repeat_every_days": 7, "repeat_count": 3, "study_procedure_ids": ["sp1"],
+        }], self.start)
+        self.assertEqual([visit["name"] for visit in visits], ["Weigh week 1", "Weigh week 2", "Weigh week 3"])
+        self.assertEqual([visit["label"] for visit in visits], ["W1", "W2", "W3"])
+        self.assertEqual([visit["planned_date"] for visit in visits],
+                         [date(2024, 1, 8), date(2024, 1, 15), date(2024, 1, 22)])
+        self.assertEqual([visit["planned_timepoint"] for visit in visits], ["Day 7", "Day 14", "Day 21"])
+
+    def test_repeated_names_without_placeholders_are_numbered(self):
+        visits = expand_templates([{
+            "name": "Bleed", "label": "B", "planned_timepoint": "Day 2", "repeat_every_days": 2, "repeat_count": 2,
+        }], self.start)
+        self.assertEqual([(visit["name"], visit["label"]) for visit in visits], [("Bleed 1", "B 1"), ("Bleed 2", "B 2")])
+
+    def test_visits_are_ordered_by_offset(self):
+        visits = expand_templates([
+            {"name": "Late", "label": "L", "planned_timepoint": "Day 10"},
+            {"name": "Early", "label": "E", "planned_timepoint": "Day 3", "repeat_every_days": 4, "repeat_count": 3},
+        ], self.start)
+        self.assertEqual([visit["timepoint_offset_days"] for visit in visits], [3, 7, 10, 11])
+
+    def test_repeat_without_interval(self):
+        with self.assertRaises(ValueError):
+            expand_templates([{"name": "X", "label": "X", "planned_timepoint": "Day 1", "repeat_count": 2}], self.start)
+
+    def test_schedule_size_limit(self):
+        template = {"name": "X", "label": "X", "planned_timepoint": "Day 1", "repeat_every_days": 1}
+        self.assertEqual(len(expand_templates([{**template, "repeat_count": MAX_SCHEDULED_VISITS}], self.start)),
+                         MAX_SCHEDULED_VISITS)
+        with self.assertRaises(ValueError):
+            expand_templates([{**template, "repeat_count": MAX_SCHEDULED_VISITS}, template], self.start)
+
+
+if __name__ == "__main__":
+    unittest.main()
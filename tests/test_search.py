@@ -0,0 +1,100 @@
+import re
+import unittest
+from unittest import mock
+
+from mongomock_motor import AsyncMongoMockClient
+
+import search as search_module
+from indexes import INDEXES
+from search import MAX_SEARCH_WINDOW, SEARCH_TARGETS, search, search_pipeline
+
+
+def regex_text_match(query):
+    """Stands in for ``$text``, which mongomock does not implement."""
+    pattern = {"$regex": re.escape(query), "$options": "i"}
+    return {"$or": [{field: pattern} for field in
+                    ("name", "category", "description", "animal_id", "species", "strain", "principal_investigator")]}
+
+
+class SearchPipelineTest(unittest.TestCase):
+    def test_text_match_comes_first_and_facets_skip_their_own_filter(self):
+        pipeline = search_pipeline(SEARCH_TARGETS["animals"], "wistar", {"species": "Rat", "sex": "F"}, 40)
+
+        # $text must lead the pipeline to use the text index
+        self.assertEqual(pipeline[0], {"$match": {"$text": {"$search": "wistar"}, "is_active": True}})
+        self.assertEqual(pipeline[1], {"$addFields": {"score": {"$meta": "textScore"}}})
+        facets = pipeline[2]["$facet"]
+        self.assertEqual(facets["results"][0], {"$match": {"species": "Rat", "sex": "F"}})
+        self.assertEqual(facets["results"][2], {"$limit": 40})
+        self.assertEqual(facets["species"][0], {"$match": {"sex": "F"}})
+        self.assertEqual(facets["sex"][0], {"$match": {"species": "Rat"}})
+
+    def test_every_target_has_a_text_index(self):
+        for target in SEARCH_TARGETS.values():
+            with self.subTest(collection=target.collection):
+                names = [index.document.get("name") for index in INDEXES[target.collection]]
+                self.assertIn("search_text", names)
+
+
+class SearchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["search_test"]
+        # ``rank`` stands in for the text score
+        await self.db.master_procedures.insert_many([
+            {"id": "p1", "name": "Rat bleed", "category": "Sample Collection", "is_active": True, "rank": 3.0},
+            {"id": "p2", "name": "Rat weigh", "category": "In-life Measurement", "is_active": True, "rank": 1.0},
+            {"id": "p3", "name": "Rat retired", "category": "Observation", "is_active": False, "rank": 9.0},
+        ])
+        await self.db.animals.insert_many([
+            {"id": "a1", "animal_id": "R-1", "species": "Rat", "sex": "M", "is_active": True, "rank": 2.0},
+            {"id": "a2", "animal_id": "R-2", "species": "Rat", "sex": "F", "is_active": True, "rank": 2.5},
+            {"id": "a3", "animal_id": "M-1", "species": "Mouse", "strain": "rat-tolerant", "sex": "F",
+             "is_active": True, "rank": 0.5},
+        ])
+        await self.db.studies.insert_one({"id": "s1", "name": "Rat tox", "status": "Active", "rank": 1.5})
+        for patch in (mock.patch.object(search_module, "_text_match", regex_text_match),
+                      mock.patch.object(search_module, "SCORE", "$rank")):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def test_results_from_every_kind_merged_by_score(self):
+        results = await search(self.db, "rat")
+
+        self.assertEqual([(result["type"], result["id"]) for result in results["results"]], [
+            ("procedures", "p1"), ("animals", "a2"), ("animals", "a1"), ("studies", "s1"), ("procedures", "p2"),
+            ("animals", "a3"),
+        ])
+        self.assertEqual(results["totals_by_type"], {"procedures": 2, "animals": 3, "studies": 1})
+        self.assertEqual(results["total"], 6)
+        self.assertEqual(results["facets"]["species"], [{"value": "Rat", "count": 2}, {"value": "Mouse", "count": 1}])
+        self.assertEqual(results["facets"]["status"], [{"value": "Active", "count": 1}])
+        self.assertNotIn("rank", results["results"][0])
+
+    async def test_facet_counts_ignore_their_own_filter(self):
+        results = await search(self.db, "rat", filters={"species": "Rat", "sex": "F"})
+
+        # Procedures and studies have no species facet, so they cannot match
+        self.assertEqual(results["totals_by_type"], {"procedures": 0, "animals": 1, "studies": 0})
+        self.assertEqual([result["id"] for result in results["results"]], ["a2"])
+        self.assertEqual(results["facets"]["species"], [{"value": "Mouse", "count": 1}, {"value": "Rat", "count": 1}])
+        self.assertEqual(results["facets"]["sex"], [{"value": "F", "count": 1}, {"value": "M", "count": 1}])
+
+    async def test_pages(self):
+        first = await search(self.db, "rat", kinds=["animals"], page_size=2)
+        second = await search(self.db, "rat", kinds=["animals"], page=2, page_size=2)
+
+        self.assertEqual([result["id"] for result in first["results"]], ["a2", "a1"])
+        self.assertEqual([result["id"] for result in second["results"]], ["a3"])
+        self.assertEqual(second["total"], 3)
+        self.assertEqual(set(second["facets"]), {"species", "sex"})
+
+    async def test_invalid_requests(self):
+        for kwargs in ({"kinds": ["plants"]}, {"filters": {"colour": "brown"}},
+                       {"page": MAX_SEARCH_WINDOW // 20 + 1, "page_size": 20}):
+            with self.subTest(**kwargs):
+                with self.assertRaises(ValueError):
+                    await search(self.db, "rat", **kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+
+from validation import compile_field, compile_validator
+
+
+def field(field_type, **extra):
+    return {"name": "f", "field_type": field_type, **extra}
+
+
+class CompileFieldTest(unittest.TestCase):
+    def assertValid(self, check, value, normalized=None):
+        result, error = check(value)
+        self.assertIsNone(error, f"{value!r}: {error}")
+        self.assertEqual(result, value if normalized is None else normalized)
+
+    def assertInvalid(self, check, value, message=None):
+        _, error = check(value)
+        self.assertIsNotNone(error, f"{value!r} was accepted")
+        if message:
+            self.assertIn(message, error)
+
+    def test_number_bounds(self):
+        check = compile_field(field("number", validation_rules={"min": 0, "max": 10.5}))
+        self.assertValid(check, 3, 3.0)
+        self.assertValid(check, 10.5)
+        self.assertInvalid(check, -0.1, "at least 0")
+        self.assertInvalid(check, 11, "at most 10.5")
+        self.assertInvalid(check, "3", "must be a number")
+        self.assertInvalid(check, True, "must be a number")
+
+    def test_integer(self):
+        check = compile_field(field("integer"))
+        self.assertValid(check, 4)
+        self.assertValid(check, 4.0, 4)
+        self.assertInvalid(check, 4.5, "integer")
+
+    def test_non_finite_numbers(self):
+        for field_type in ("number", "integer"):
+            check = compile_field(field(field_type, validation_rules={"min": 0, "max": 10}))
+            for value in (float("nan"), float("inf"), float("-inf")):
+                with self.subTest(field_type=field_type, value=value):
+                    self.assertInvalid(check, value, "finite")
+
+    def test_choices(self):
+        check = compile_field(field("dropdown", options=["low", "high"]))
+        self.assertValid(check, "low")
+        self.assertInvalid(check, "medium")
+        checkbox = compile_field(field("checkbox", options=["a", "b"]))
+        self.assertValid(checkbox, ["a", "b"])
+        self.assertInvalid(checkbox, ["c"])
+        flag = compile_field(field("checkbox"))
+        self.assertValid(flag, False)
+        self.assertInvalid(flag, "yes")
+
+    def test_date_and_time(self):
+        check = compile_field(field("date", validation_rules={"min": "2024-01-01"}))
+        self.assertValid(check, "2024-02-03")
+        self.assertInvalid(check, "2023-12-31", "at least 2024-01-01")
+        self.assertInvalid(check, "03/02/2024", "YYYY-MM-DD")
+        time = compile_field(field("time"))
+        self.assertValid(time, "08:30")
+        self.assertInvalid(time, "25:00")
+
+    def test_text_rules(self):
+        check = compile_field(field("string", validation_rules={"min_length": 2, "max_length": 4, "regex": "[A-Z]+"}))
+        self.assertValid(check, "ABC")
+        self.assertInvalid(check, "A", "at least 2 characters")
+        self.assertInvalid(check, "ABCDE", "at most 4 characters")
+        self.assertInvalid(check, "abc", "must match")
+        self.assertInvalid(check, 12, "must be text")
+
+    def test_unusable_rules_fail_at_compile_time(self):
+        for rules in ({"min": "low"}, {"max": "NaN"}, {"regex": "("}, {"max_length": "long"}):
+            field_type = "string" if {"regex", "max_length"} & set(rules) else "number"
+            with self.subTest(rules=rules):
+                with self.assertRaises(ValueError):
+                    compile_field(field(field_type, validation_rules=rules))
+
+    def test_unknown_rules_are_ignored(self):
+        check = compile_field(field("number", validation_rules={"display": "g"}))
+        self.assertValid(check, 1, 1.0)
+
+
+class ValidateRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.validator = compile_validator([
+            {"name": "weight", "field_type": "number", "is_mandatory": True, "validation_rules": {"min": 0}},
+            {"name": "note", "field_type": "string"},
+        ])
+
+    def test_valid_rows_are_normalized(self):
+        rows = [{"animal_id": "a1", "values": {"weight": 200}}, {"animal_id": "a2", "values": {"weight": 1.5, "note": "ok"}}]
+        valid, errors = self.validator.validate_rows(rows, {"a1", "a2"})
+        self.assertEqual(errors, [])
+        self.assertEqual([number for number, _ in valid], [1, 2])
+        self.assertEqual(valid[0][1]["values"]["weight"], 200.0)
+        self.assertIsInstance(valid[0][1]["values"]["weight"], float)
+
+    def test_row_errors(self):
+        rows = [
+            {"animal_id": "a1", "values": {}},
+            {"animal_id": "zz", "values": {"weight": 1}},
+            {"animal_id": "a2", "values": {"weight": -1, "colour": "red"}},
+        ]
+        valid, errors = self.validator.validate_rows(rows, {"a1", "a2"})
+        self.assertEqual(valid, [])
+        self.assertEqual([error["row"] for error in errors], [1, 2, 3])
+        self.assertIn("weight: is mandatory", errors[0]["errors"])
+        self.assertIn("animal zz is not in this visit's cohorts", errors[1]["errors"])
+        self.assertIn("colour: unknown field", errors[2]["errors"])
+        self.assertIn("weight: must be at least 0", errors[2]["errors"])
+
+    def test_duplicates_only_count_valid_rows(self):
+        rows = [
+            {"animal_id": "a1", "values": {"weight": -5}},
+            {"animal_id": "a1", "values": {"weight": 5}},
+            {"animal_id": "a1", "values": {"weight": 6}},
+        ]
+        valid, errors = self.validator.validate_rows(rows, {"a1"})
+        self.assertEqual([number for number, _ in valid], [2])
+        self.assertEqual([error["row"] for error in errors], [1, 3])
+        self.assertEqual(errors[1]["errors"], ["animal a1 appears more than once"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+from datetime import date, datetime, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+from etag import collection_version
+from visit_status import (
+    LEASE_NAME,
+    MISSED,
+    SCHEDULED,
+    UPCOMING,
+    acquire_lease,
+    apply_transitions,
+    release_lease,
+    run_status_scheduler,
+)
+
+TODAY = date(2024, 6, 10)
+
+
+def day(offset: int) -> str:
+    return (TODAY + timedelta(days=offset)).isoformat()
+
+
+class ApplyTransitionsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["visit_status_test"]
+        await self.db.visits.insert_many([
+            {"id": "past", "status": SCHEDULED, "planned_date": day(-1), "actual_date": None},
+            {"id": "past_upcoming", "status": UPCOMING, "planned_date": day(-2), "actual_date": None},
+            {"id": "performed", "status": SCHEDULED, "planned_date": day(-1), "actual_date": day(-1)},
+            {"id": "soon", "status": SCHEDULED, "planned_date": day(3), "actual_date": None},
+            {"id": "today", "status": SCHEDULED, "planned_date": day(0), "actual_date": None},
+            {"id": "later", "status": SCHEDULED, "planned_date": day(30), "actual_date": None},
+            # Window opened already although the planned date is weeks away
+            {"id": "window_open", "status": SCHEDULED, "planned_date": day(20), "actual_date": None,
+             "window_start_date": day(-1), "window_end_date": day(40)},
+            # Planned date passed but the window is still open
+            {"id": "window_late", "status": SCHEDULED, "planned_date": day(-3), "actual_date": None,
+             "window_start_date": day(-5), "window_end_date": day(2)},
+            {"id": "window_closed", "status": SCHEDULED, "planned_date": day(-3), "actual_date": None,
+             "window_start_date": day(-5), "window_end_date": day(-1)},
+            {"id": "completed", "status": "Completed", "planned_date": day(-10), "actual_date": None},
+        ])
+
+    async def statuses(self):
+        return {visit["id"]: visit["status"] async for visit in self.db.visits.find({}, {"_id": 0, "id": 1, "status": 1})}
+
+    async def test_transitions(self):
+        changed = await apply_transitions(self.db, TODAY, upcoming_days=7)
+
+        self.assertEqual(changed, {"missed": 3, "upcoming": 4})
+        self.assertEqual(await self.statuses(), {
+            "past": MISSED, "past_upcoming": MISSED, "performed": SCHEDULED, "soon": UPCOMING, "today": UPCOMING,
+            "later": SCHEDULED, "window_open": UPCOMING, "window_late": UPCOMING, "window_closed": MISSED,
+            "completed": "Completed",
+        })
+        self.assertEqual(await collection_version(self.db, "visits"), 1)
+
+    async def test_running_twice_changes_nothing_more(self):
+        await apply_transitions(self.db, TODAY, upcoming_days=7)
+        statuses = await self.statuses()
+
+        self.assertEqual(await apply_transitions(self.db, TODAY, upcoming_days=7), {"missed": 0, "upcoming": 0})
+        self.assertEqual(await self.statuses(), statuses)
+        self.assertEqual(await collection_version(self.db, "visits"), 1)
+
+
+class LeaseTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["visit_status_test"]
+
+    async def test_only_the_holder_gets_the_lease_until_it_expires(self):
+        self.assertTrue(await acquire_lease(self.db, LEASE_NAME, "w1", 60))
+        self.assertFalse(await acquire_lease(self.db, LEASE_NAME, "w2", 60))
+        # The holder renews
+        self.assertTrue(await acquire_lease(self.db, LEASE_NAME, "w1", 60))
+
+        await self.db.scheduler_leases.update_one({"_id": LEASE_NAME},
+                                                  {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+        self.assertTrue(await acquire_lease(self.db, LEASE_NAME, "w2", 60))
+        self.assertFalse(await acquire_lease(self.db, LEASE_NAME, "w1", 60))
+
+    async def test_release_frees_the_lease_for_others(self):
+        await acquire_lease(self.db, LEASE_NAME, "w1", 60)
+        await release_lease(self.db, LEASE_NAME, "w2")
+        self.assertFalse(await acquire_lease(self.db, LEASE_NAME, "w2", 60))
+
+        await release_lease(self.db, LEASE_NAME, "w1")
+        self.assertTrue(await acquire_lease(self.db, LEASE_NAME, "w2", 60))
+
+    async def test_cancelled_scheduler_releases_its_lease(self):
+        await self.db.visits.insert_one({"id": "past", "status": SCHEDULED, "planned_date": "2000-01-01",
+                                         "actual_date": None})
+        task = asyncio.create_task(run_status_scheduler(self.db, interval=60, lease_seconds=60, owner="w1"))
+        while (await self.db.visits.find_one({"id": "past"}))["status"] != MISSED:
+            await asyncio.sleep(0.01)
+        self.assertFalse(await acquire_lease(self.db, LEASE_NAME, "w2", 60))
+
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(await acquire_lease(self.db, LEASE_NAME, "w2", 60))
+
+
+if __name__ == "__main__":
+    unittest.main()